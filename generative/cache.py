@@ -0,0 +1,475 @@
+import textwrap
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional, Tuple
+
+from RestrictedPython import compile_restricted
+
+from .utils import (
+    remove_prepended,
+    extract_func_name,
+    is_valid_syntax,
+    hash_source,
+    hash_normalized_source,
+    format_binary_output,
+)
+
+from .metaclasses import (
+    AbstractAsyncGenerativeModel,
+    AbstractDatabase,
+    AbstractGenerativeModel,
+    DatabaseException,
+)
+from .models import (
+    CRITIC_OPTIONS,
+    AsyncModelAdapter,
+    agenerate_with,
+    generate_with,
+)
+from .prompt import format_semantic_checker
+
+"""
+A bounded, thread-safe least-recently-used cache.
+
+Lookups do not take the lock, so a hit costs a dictionary lookup plus a reorder. Inserts and
+evictions are serialized. Hit, miss and eviction counters are kept for reporting.
+
+Args:
+    maxsize (int): Maximum number of entries kept before the least-recently-used entry is evicted.
+
+Raises:
+    ValueError: If `maxsize` is not a positive integer.
+"""
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = 1024) -> None:
+        if maxsize <= 0:
+            raise ValueError("maxsize must be a positive integer")
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Returns the value stored under `key` and marks it as recently used.
+
+        :param key: Key to look up.
+        :param default: Value returned when the key is missing.
+        :return: The cached value or `default`.
+        """
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            # Evicted by another thread between the lookup and the reorder
+            pass
+
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Stores `value` under `key`, evicting least-recently-used entries if the cache is full.
+
+        :param key: Key to store.
+        :param value: Value to store.
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+
+
+"""
+A generated function that has been validated, compiled and executed.
+
+Attributes:
+    name (str): Name of the generated function.
+    code (str): Cleaned source code the function was compiled from.
+    func (Callable): The ready-to-call function.
+"""
+
+
+class CompiledFunction(NamedTuple):
+    name: str
+    code: str
+    func: Callable[..., Any]
+
+
+"""
+Compile generated code under RestrictedPython and return the function it defines.
+
+Args:
+    code (str): Generated source code, possibly with text around the function definition.
+    global_vars (dict, optional): Global namespace to execute the compiled code in.
+
+Returns:
+    CompiledFunction: The cleaned source and the function it defines.
+
+Raises:
+    SyntaxError: If the cleaned code is not valid Python syntax.
+"""
+
+
+def compile_function(
+    code: str, global_vars: Optional[Dict[str, Any]] = None
+) -> CompiledFunction:
+    # TODO: sanitize given function using traditional methods and LLM
+    # It's recommended to use RestrictedPython.safe_globals to whitelist
+    # the global namespace
+    # global_vars = {} allows all global variables to be accessed.
+    # However, using RestrictedPython.safe_globals prevents many common functions
+    # from being implemented by the LLM.
+    if global_vars is None:
+        global_vars = {}
+
+    code = remove_prepended(code)
+    code = textwrap.dedent(code)
+
+    if not is_valid_syntax(code):
+        raise SyntaxError("Invalid syntax")
+
+    byte_code = compile_restricted(code, mode="exec")
+    exec(byte_code, global_vars)
+
+    # TODO: sanitize generated code i.e. generative_func
+    func_name = extract_func_name(code)
+
+    return CompiledFunction(func_name, code, global_vars[func_name])
+
+
+"""
+Return a stable identity for a decorated function that survives re-decoration.
+
+Args:
+    func (Callable): The decorated function.
+
+Returns:
+    str: The module-qualified name of the function.
+"""
+
+
+def function_identity(func: Callable[..., Any]) -> str:
+    module = getattr(func, "__module__", None) or ""
+    qualname = getattr(func, "__qualname__", None) or repr(func)
+    return f"{module}.{qualname}"
+
+
+"""
+An LRU cache of compiled generated functions.
+
+Entries are keyed by the identity of the decorated function and a hash of the raw generated
+source, so a cache hit skips cleaning, syntax checking, RestrictedPython compilation and `exec`.
+
+Args:
+    maxsize (int): Maximum number of compiled functions kept in memory.
+"""
+
+
+class CompiledFunctionCache(LRUCache):
+    @staticmethod
+    def key(func: Callable[..., Any], code: str) -> Tuple[str, str]:
+        return function_identity(func), hash_source(code)
+
+
+# Process-wide cache shared by decorators that are not given their own
+compiled_functions = CompiledFunctionCache(maxsize=1024)
+
+
+class _Failure(NamedTuple):
+    count: int
+    retry_at: float
+
+
+"""
+Remembers keys whose generation failed and backs off before they are generated again.
+
+After the n-th consecutive failure for a key, generation is skipped for
+`base_delay * 2 ** (n - 1)` seconds, capped at `max_delay`. A success clears the key. Skips are
+counted so they can be reported alongside the other cache statistics.
+
+Args:
+    base_delay (float): Seconds to back off after the first failure.
+    max_delay (float): Upper bound on the back-off, in seconds.
+    maxsize (int): Maximum number of failing keys remembered.
+    clock (Callable, optional): Returns the current time in seconds. Defaults to
+        `time.monotonic`.
+
+Raises:
+    ValueError: If `base_delay` is negative or `max_delay` is less than `base_delay`.
+"""
+
+
+class NegativeCache:
+    def __init__(
+        self,
+        base_delay: float = 1.0,
+        max_delay: float = 3600.0,
+        maxsize: int = 1024,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if base_delay < 0 or max_delay < base_delay:
+            raise ValueError("Delays must satisfy 0 <= base_delay <= max_delay")
+
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.failures = 0
+        self.skips = 0
+        self._entries = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def should_skip(self, key: Hashable) -> bool:
+        """
+        Returns True if `key` failed recently enough that it should not be generated yet.
+
+        :param key: Key to check.
+        :return: Whether generation should be skipped.
+        """
+        failure = self._entries.get(key)
+
+        if failure is None or self.clock() >= failure.retry_at:
+            return False
+
+        self.skips += 1
+        return True
+
+    def record_failure(self, key: Hashable) -> float:
+        """
+        Records a failed generation for `key` and schedules its next attempt.
+
+        :param key: Key whose generation failed.
+        :return: Seconds until the key will be generated again.
+        """
+        with self._lock:
+            failure = self._entries.get(key)
+            count = failure.count + 1 if failure is not None else 1
+            # The exponent is bounded so long failure streaks cannot overflow
+            delay = min(self.base_delay * 2 ** min(count - 1, 64), self.max_delay)
+
+            self._entries.set(key, _Failure(count, self.clock() + delay))
+            self.failures += 1
+
+        return delay
+
+    def record_success(self, key: Hashable) -> None:
+        self._entries.pop(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "failures": self.failures,
+            "skips": self.skips,
+            "size": len(self._entries),
+        }
+
+
+# Process-wide record of failed generations shared by decorators that are not given their own
+failed_generations = NegativeCache()
+
+
+"""
+Name a critic for keying its verdicts.
+
+Critics are named by their class, so the name stays the same across restarts. Synchronous critics
+adapted for asynchronous use are named after the critic they wrap.
+
+Args:
+    critic (Any): A critic model class or instance, or None.
+
+Returns:
+    str: The critic's qualified class name, or "" if no critic is given.
+"""
+
+
+def critic_name(critic: Any) -> str:
+    if critic is None:
+        return ""
+
+    if isinstance(critic, AsyncModelAdapter):
+        critic = critic.model
+
+    cls = critic if isinstance(critic, type) else type(critic)
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
+"""
+Remembers critics' verdicts on generated code.
+
+Verdicts are keyed by the critic's class and a hash of the code that ignores formatting, so code
+that a critic has already accepted or rejected is not sent to it again, while other critics still
+judge it for themselves. Verdicts are kept in an in-memory LRU cache and, if a database is given,
+persisted under "verdict:<critic>:<hash>" keys so they survive restarts.
+
+Critics of the same class that could judge the same code differently should be given separate
+caches.
+
+Args:
+    maxsize (int): Maximum number of verdicts kept in memory.
+    database (AbstractDatabase, optional): Database verdicts are persisted to.
+"""
+
+
+class VerdictCache(LRUCache):
+    def __init__(
+        self, maxsize: int = 1024, database: Optional[AbstractDatabase] = None
+    ) -> None:
+        super().__init__(maxsize=maxsize)
+        self.database = database
+
+    @staticmethod
+    def key(code: str, critic: Any = None) -> str:
+        return f"verdict:{critic_name(critic)}:{hash_normalized_source(code)}"
+
+    def verdict(self, code: str, critic: Any = None) -> Optional[bool]:
+        """
+        Returns the remembered verdict on `code`.
+
+        :param code: Generated code.
+        :param critic: The critic whose verdict is wanted.
+        :return: True if the code was accepted, False if it was rejected, None if it is unknown.
+        """
+        key = self.key(code, critic)
+        verdict = self.get(key)
+
+        if verdict is None and self.database:
+            record = self.database.get(key)
+
+            if isinstance(record, dict) and "verdict" in record:
+                verdict = bool(record["verdict"])
+                super().set(key, verdict)
+
+        return verdict
+
+    def record(self, code: str, verdict: bool, critic: Any = None) -> None:
+        """
+        Remembers the critic's verdict on `code`.
+
+        :param code: Generated code.
+        :param verdict: True if the critic accepted the code.
+        :param critic: The critic that gave the verdict.
+        """
+        key = self.key(code, critic)
+        self.set(key, verdict)
+
+        if self.database:
+            try:
+                self.database.set(key, {"verdict": verdict})
+            except Exception as e:
+                raise DatabaseException(
+                    "An error occurred while adding to the database"
+                ) from e
+
+
+# Process-wide verdicts shared by decorators that are not given their own
+critic_verdicts = VerdictCache(maxsize=1024)
+
+
+"""
+Ask a critic model whether generated code is semantically correct.
+
+The critic is only asked about code it has not judged before; earlier verdicts are reused.
+
+Args:
+    critic (AbstractGenerativeModel): LLM to review the generated code.
+    code (str): Generated code to review.
+    verdicts (VerdictCache, optional): Verdicts already given on generated code. Defaults to the
+        process-wide `critic_verdicts`.
+
+Returns:
+    bool: The critic's verdict.
+"""
+
+
+def critique(
+    critic: AbstractGenerativeModel,
+    code: str,
+    verdicts: Optional[VerdictCache] = None,
+) -> bool:
+    if verdicts is None:
+        verdicts = critic_verdicts
+
+    verdict = verdicts.verdict(code, critic)
+
+    if verdict is None:
+        prompt = format_semantic_checker(code, input="", context="")
+        output = generate_with(critic, prompt, CRITIC_OPTIONS)
+        verdict = format_binary_output(output)
+        verdicts.record(code, verdict, critic)
+
+    return verdict
+
+
+"""
+Asynchronous counterpart of `critique`.
+
+Args:
+    critic (AbstractAsyncGenerativeModel): LLM to review the generated code.
+    code (str): Generated code to review.
+    verdicts (VerdictCache, optional): Verdicts already given on generated code. Defaults to the
+        process-wide `critic_verdicts`.
+
+Returns:
+    bool: The critic's verdict.
+"""
+
+
+async def acritique(
+    critic: AbstractAsyncGenerativeModel,
+    code: str,
+    verdicts: Optional[VerdictCache] = None,
+) -> bool:
+    if verdicts is None:
+        verdicts = critic_verdicts
+
+    verdict = verdicts.verdict(code, critic)
+
+    if verdict is None:
+        prompt = format_semantic_checker(code, input="", context="")
+        output = await agenerate_with(critic, prompt, CRITIC_OPTIONS)
+        verdict = format_binary_output(output)
+        verdicts.record(code, verdict, critic)
+
+    return verdict
@@ -1,6 +1,6 @@
-import inspect
-import textwrap
-from typing import Callable, Any, Optional, Type
+import functools
+import threading
+from typing import Callable, Any, Dict, Optional, Type
 
 from .utils import (
     clean_function,
@@ -15,9 +15,31 @@ from .metaclasses import (
     AbstractGenerativeModel,
 )
 
-from .utils import format_binary_output
+from .models import (
+    CODE_GENERATION_OPTIONS,
+    agenerate_code,
+    as_async_model,
+    generate_code,
+    is_async_model,
+)
+
+from .index import MAX_CONTEXT_FUNCTIONS, MAX_CONTEXT_TOKENS, context_index
+
+from .cache import (
+    CompiledFunction,
+    NegativeCache,
+    VerdictCache,
+    acritique,
+    compile_function,
+    critique,
+    critic_verdicts,
+    failed_generations,
+    function_identity,
+)
+
+from .concurrency import SingleFlight, generations
 
-from .prompt import format_generative_function_from_input, format_semantic_checker
+from .prompt import format_generative_function_from_input
 
 """
 A decorator that allows for dynamic generation and execution of class attributes.
@@ -25,15 +47,16 @@ A decorator that allows for dynamic generation and execution of class attributes
 This decorator takes a function (model) that generates Python code in response to a prompt.
 When an attempt is made to access an attribute that doesn't exist on an instance of the decorated
 class, the decorator calls the provided model function to generate Python code. The decorator then
-compiles and executes this code to define a new function. The newly defined function is immediately
-invoked and its result is returned as the value of the attribute.
+compiles and executes this code to define a new function, which is called with the arguments the
+missing attribute was called with.
 
-This new attribute is also added to the instance of the decorated class, so on subsequent attempts
-to access it, the attribute exists and the saved value is returned without the need for regenerating
-and re-executing the function.
+The compiled function is installed on the decorated class as a static method, so later accesses
+from any instance are ordinary attribute lookups that neither regenerate nor recompile it.
+Installed functions can be listed with `generated_members` and removed with
+`evict_generated_members`.
 
-Note: The generated function does not accept any arguments, as it's called immediately upon being
-defined.
+If `model` is an `AbstractAsyncGenerativeModel`, missing attributes are coroutine functions that
+must be awaited.
 
 Args:
     model (AbstractGenerativeModel): A function that takes a string prompt and returns a string of
@@ -41,6 +64,19 @@ Args:
     critic (AbstractGenerativeModel, optional): LLM to review generated code from `model`.
     database (AbstractDatabase, optional): An instance of a class that implements the
         AbstractDatabase interface.
+    negative_cache (NegativeCache, optional): Remembers attributes whose generation failed so
+        they raise AttributeError without calling the model until the back-off expires. Defaults
+        to the process-wide `cache.failed_generations`.
+    verdicts (VerdictCache, optional): Remembers the critic's verdicts on generated code.
+        Defaults to the process-wide `cache.critic_verdicts`.
+    single_flight (SingleFlight, optional): Coalesces concurrent generations of the same
+        attribute. Defaults to the process-wide `concurrency.generations`.
+    max_context_tokens (int, optional): Token budget for class functions shown to `model` in
+        full. The functions most relevant to the missing attribute are chosen; the rest are
+        listed by signature.
+    max_context_functions (int, optional): Maximum number of class functions shown in full.
+    minify (bool, optional): Show `model` class functions without comments, docstrings or blank
+        lines. See `utils.minify_source`.
 
 Returns:
     A class decorator that can be used to decorate a class, with the added capability of dynamically
@@ -55,92 +91,289 @@ def generate_attribute(
     model: AbstractGenerativeModel,
     critic: Optional[AbstractGenerativeModel] = None,
     database: Optional[AbstractDatabase] = None,
+    negative_cache: Optional[NegativeCache] = None,
+    verdicts: Optional[VerdictCache] = None,
+    single_flight: Optional[SingleFlight] = None,
+    max_context_tokens: int = MAX_CONTEXT_TOKENS,
+    max_context_functions: int = MAX_CONTEXT_FUNCTIONS,
+    minify: bool = False,
 ) -> Callable[[Type[Any]], Type[Any]]:
+    if negative_cache is None:
+        negative_cache = failed_generations
+
+    if verdicts is None:
+        verdicts = critic_verdicts
+
+    if single_flight is None:
+        single_flight = generations
+
     def decorator(cls: Type[Any]) -> Type[Any]:
+        identity = function_identity(cls)
+
+        def build_prompt(func_name: str, kwargs: Any) -> str:
+            # The class's functions are read once into its context index and reused for
+            # every missing attribute
+            return format_generative_function_from_input(
+                func_name,
+                kwargs,
+                context_index(cls),
+                max_context_tokens,
+                max_context_functions,
+                minify,
+            )
+
+        def validate(func_source: str, exception: AttributeError) -> None:
+            if not func_source:
+                raise exception
+
+            if not is_valid_syntax(func_source):
+                raise SyntaxError("Invalid syntax")
+
+            if is_incomplete_code(func_source):
+                raise exception
+
+        def context_hash() -> str:
+            return context_index(cls).context_hash()
+
+        def storage_key(func_name: str, context_hash: str) -> str:
+            # Records are versioned by the class's functions, so changing the class after a
+            # deploy regenerates its attributes
+            return f"{func_name}:{context_hash[:16]}"
+
+        def store(func_name: str, func_source: str, args: Any, kwargs: Any) -> None:
+            if database:
+                try:
+                    class_hash = context_hash()
+                    capability = {
+                        "function_name": func_name,
+                        "context_hash": class_hash,
+                        "args": args,
+                        "kwargs": kwargs,
+                        "generated_code": func_source,
+                    }
+                    database.set(storage_key(func_name, class_hash), capability)
+                except Exception as e:
+                    raise DatabaseException(
+                        "An error occurred while adding to the database"
+                    ) from e
+
+        # Asynchronous models produce awaitable attributes so generation does not block the
+        # event loop
+        async_model = as_async_model(model) if is_async_model(model) else None
+        async_critic = as_async_model(critic) if async_model else None
+
+        def cached_code(func_name: str) -> Optional[str]:
+            if database:
+                key = storage_key(func_name, context_hash())
+                if database.contains(key):
+                    return database.get(key)["generated_code"]
+
+            return None
+
+        def install(name: str, func_source: str) -> Callable[..., Any]:
+            compiled = compile_function(func_source)
+            attribute = compiled.func
+
+            if async_model:
+                attribute = _awaitable(compiled.func)
+
+            with Wrapper._generated_lock:
+                # Another thread may have installed the attribute first
+                existing = Wrapper.__dict__.get(name)
+                if name in Wrapper._generated_members and existing is not None:
+                    return existing.__func__
+
+                setattr(Wrapper, name, staticmethod(attribute))
+                Wrapper._generated_members = {
+                    **Wrapper._generated_members,
+                    name: compiled,
+                }
+
+            return attribute
+
+        def accept(
+            name: str,
+            func_source: str,
+            is_accepted: bool,
+            exception: AttributeError,
+            args: Any,
+            kwargs: Any,
+        ) -> Callable[..., Any]:
+            func_name = to_func_name(name)
+
+            if not is_accepted:
+                negative_cache.record_failure((identity, func_name))
+                raise exception
+
+            try:
+                attribute = install(name, func_source)
+            except Exception as e:
+                # Code that RestrictedPython rejects or that fails to run is backed off like
+                # code the critic rejects
+                negative_cache.record_failure((identity, func_name))
+                raise exception from e
+
+            negative_cache.record_success((identity, func_name))
+            store(func_name, func_source, args, kwargs)
+
+            return attribute
+
+        def check(func_name: str, func_source: str, exception: AttributeError) -> None:
+            try:
+                validate(func_source, exception)
+            except (AttributeError, SyntaxError):
+                negative_cache.record_failure((identity, func_name))
+                raise
+
+        async def aresolve(
+            name: str, exception: AttributeError, args: Any, kwargs: Any
+        ) -> Callable[..., Any]:
+            func_name = to_func_name(name)
+            func_source = cached_code(func_name)
+
+            if func_source is not None:
+                return install(name, func_source)
+
+            # Attributes that failed recently are not generated again yet
+            if negative_cache.should_skip((identity, func_name)):
+                raise exception
+
+            prompt = build_prompt(func_name, kwargs)
+            func_source = clean_function(
+                await agenerate_code(async_model, prompt, CODE_GENERATION_OPTIONS)
+            )
+            check(func_name, func_source, exception)
+
+            is_accepted = async_critic is not None and await acritique(
+                async_critic, func_source, verdicts
+            )
+
+            return accept(name, func_source, is_accepted, exception, args, kwargs)
+
+        def resolve(
+            name: str, exception: AttributeError, args: Any, kwargs: Any
+        ) -> Callable[..., Any]:
+            func_name = to_func_name(name)
+            func_source = cached_code(func_name)
+
+            if func_source is not None:
+                return install(name, func_source)
+
+            # If model is specified and callable, use it to generate the output string
+            if model is None:
+                raise exception
+
+            # Attributes that failed recently are not generated again yet
+            if negative_cache.should_skip((identity, func_name)):
+                raise exception
+
+            prompt = build_prompt(func_name, kwargs)
+            func_source = clean_function(
+                generate_code(model, prompt, CODE_GENERATION_OPTIONS)
+            )
+            check(func_name, func_source, exception)
+
+            is_accepted = critic is not None and critique(critic, func_source, verdicts)
+
+            return accept(name, func_source, is_accepted, exception, args, kwargs)
+
         class Wrapper(cls):
+            # Generated functions installed on this class, by attribute name. The dictionary is
+            # replaced rather than mutated so it can be read without the lock.
+            _generated_members: Dict[str, CompiledFunction] = {}
+            _generated_lock = threading.Lock()
+
             def __init__(self, *args, **kwargs):
                 super().__init__(*args, **kwargs)
                 if model:
                     self._is_generative = True
 
-            def __getattribute__(self, name: str) -> Any:
-                try:
-                    # Try to get attribute normally
-                    return super().__getattribute__(name)
-                except AttributeError as e:
-                    exception = e
-
-                    def method_not_found(*args, **kwargs):
-                        func_name = to_func_name(name)
-                        has_cached_code = ""
-
-                        if database:
-                            has_cached_code = database.contains(func_name)
-
-                            if has_cached_code:
-                                return database.get(func_name)["generated_code"]
-
-                        # If model is specified and callable, use it to generate the output string
-                        if not has_cached_code and model is not None:
-                            # This will return a list of tuples where the first item is the name of
-                            # the method and the second item is the method itself. If you only want
-                            # the names, you can do:
-                            all_methods = inspect.getmembers(
-                                cls, predicate=inspect.isfunction
-                            )
-                            available_funcs = [
-                                (
-                                    method[0],
-                                    textwrap.dedent(inspect.getsource(method[1])),
-                                )
-                                for method in all_methods
-                            ]
-
-                            prompt = format_generative_function_from_input(
-                                func_name, kwargs, context=available_funcs
-                            )
-                            func_source = clean_function(model.generate(prompt))
-
-                            if not func_source:
-                                raise exception
-
-                            if not is_valid_syntax(func_source):
-                                raise SyntaxError("Invalid syntax")
-
-                            if is_incomplete_code(func_source):
-                                raise exception
-
-                            is_semantically_correct = False
-
-                            if critic:
-                                prompt = format_semantic_checker(
-                                    func_source, input="", context=""
-                                )
-                                output = critic.generate(prompt)
-                                is_semantically_correct = format_binary_output(output)
-
-                            if not is_semantically_correct:
-                                raise exception
-
-                            if database:
-                                try:
-                                    capability = {
-                                        "args": args,
-                                        "kwargs": kwargs,
-                                        "generated_code": func_source,
-                                    }
-                                    database.set(func_name, capability)
-                                except Exception as e:
-                                    raise DatabaseException(
-                                        "An error occurred while adding to the database"
-                                    ) from e
-
-                            return func_source
-                        else:
-                            raise exception
-
-                    return method_not_found
+            def __getattr__(self, name: str) -> Any:
+                # Only called when normal attribute lookup fails, so existing fields and methods
+                # are accessed without any overhead from this class
+                exception = AttributeError(
+                    f"'{type(self).__name__}' object has no attribute '{name}'"
+                )
+
+                # Leave special names, looked up by protocols such as copy and pickle, alone
+                if name.startswith("__") and name.endswith("__"):
+                    raise exception
+
+                # Defer to a fallback defined by the decorated class
+                if hasattr(cls, "__getattr__"):
+                    try:
+                        return cls.__getattr__(self, name)
+                    except AttributeError as e:
+                        exception = e
+
+                async def async_method_not_found(*args, **kwargs):
+                    # Concurrent misses of the same attribute share a single generation
+                    attribute = await single_flight.ado(
+                        (identity, name),
+                        functools.partial(aresolve, name, exception, args, kwargs),
+                    )
+                    return await attribute(*args, **kwargs)
+
+                def method_not_found(*args, **kwargs):
+                    # Concurrent misses of the same attribute share a single generation
+                    attribute = single_flight.do(
+                        (identity, name),
+                        functools.partial(resolve, name, exception, args, kwargs),
+                    )
+                    return attribute(*args, **kwargs)
+
+                if async_model:
+                    return async_method_not_found
+
+                return method_not_found
 
         return Wrapper
 
     return decorator
+
+
+def _awaitable(func: Callable[..., Any]) -> Callable[..., Any]:
+    @functools.wraps(func)
+    async def attribute(*args: Any, **kwargs: Any) -> Any:
+        return func(*args, **kwargs)
+
+    return attribute
+
+
+"""
+List the generated functions installed on a class decorated with `generate_attribute`.
+
+Args:
+    cls (type): The decorated class.
+
+Returns:
+    dict: Source code of each installed function, by attribute name.
+"""
+
+
+def generated_members(cls: Type[Any]) -> Dict[str, str]:
+    members = getattr(cls, "_generated_members", {})
+    return {name: compiled.code for name, compiled in members.items()}
+
+
+"""
+Remove generated functions from a class decorated with `generate_attribute`.
+
+The next access to an evicted attribute resolves it again, from the database if one was given or
+from the model.
+
+Args:
+    cls (type): The decorated class.
+    names (str): Attribute names to evict. Every generated function is evicted if none are given.
+"""
+
+
+def evict_generated_members(cls: Type[Any], *names: str) -> None:
+    with cls._generated_lock:
+        members = dict(cls._generated_members)
+
+        for name in names or list(members):
+            if members.pop(name, None) is not None and name in cls.__dict__:
+                delattr(cls, name)
+
+        cls._generated_members = members
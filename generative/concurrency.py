@@ -0,0 +1,217 @@
+import asyncio
+import functools
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+WAIT = "wait"
+FALLBACK = "fallback"
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _AsyncCall:
+    def __init__(self, task: "asyncio.Task[Any]") -> None:
+        self.task = task
+        self.waiters = 0
+
+
+"""
+Coalesces concurrent calls that share a key into a single call.
+
+The first caller for a key (the leader) runs the call. Callers that arrive while it is in flight
+either wait for and share the leader's result, or immediately receive a default value so they can
+fall back to the original function, depending on `policy`. Exceptions raised by the leader are
+re-raised in waiting callers.
+
+Threads are coalesced through `do` and coroutines through `ado`. Coroutines are only coalesced
+with other coroutines running on the same event loop. A coalesced coroutine call runs as its own
+task, so cancelling one caller does not cancel the others; the call itself is only cancelled once
+every caller waiting on it has been cancelled.
+
+Args:
+    policy (str): "wait" to share the leader's result or "fallback" to return the default value.
+
+Raises:
+    ValueError: If `policy` is not "wait" or "fallback".
+"""
+
+
+class SingleFlight:
+    def __init__(self, policy: str = WAIT) -> None:
+        if policy not in (WAIT, FALLBACK):
+            raise ValueError(f"Unknown single-flight policy: {policy}")
+
+        self.policy = policy
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, _Call] = {}
+        self._async_calls: Dict[Tuple[Hashable, int], _AsyncCall] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any], default: Any = None) -> Any:
+        """
+        Runs `fn` unless a call for `key` is already in flight.
+
+        :param key: Identifies calls that produce the same result.
+        :param fn: The call to run if this caller is the leader.
+        :param default: Value returned to concurrent callers under the "fallback" policy.
+        :return: The result of `fn`, shared with concurrent callers.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+
+            if is_leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            if self.policy == FALLBACK:
+                return default
+
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+            call.done.set()
+
+    async def ado(
+        self, key: Hashable, fn: Callable[[], Awaitable[Any]], default: Any = None
+    ) -> Any:
+        """
+        Awaits `fn()` unless a call for `key` is already in flight on this event loop.
+
+        :param key: Identifies calls that produce the same result.
+        :param fn: Returns the awaitable to run if this caller is the leader.
+        :param default: Value returned to concurrent callers under the "fallback" policy.
+        :return: The result of `fn()`, shared with concurrent callers.
+        """
+        loop = asyncio.get_running_loop()
+        loop_key = (key, id(loop))
+
+        with self._lock:
+            call = self._async_calls.get(loop_key)
+            is_leader = call is None
+
+            if is_leader:
+                call = self._async_calls[loop_key] = _AsyncCall(loop.create_task(fn()))
+                call.task.add_done_callback(
+                    functools.partial(self._finish, loop_key, call)
+                )
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+                if self.policy == FALLBACK:
+                    return default
+
+            call.waiters += 1
+
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            # Only abandon the call once no caller is left waiting for it
+            with self._lock:
+                call.waiters -= 1
+                is_abandoned = call.waiters == 0
+
+            if is_abandoned:
+                call.task.cancel()
+
+            raise
+
+    def _finish(
+        self,
+        loop_key: Tuple[Hashable, int],
+        call: _AsyncCall,
+        task: "asyncio.Task[Any]",
+    ) -> None:
+        with self._lock:
+            if self._async_calls.get(loop_key) is call:
+                del self._async_calls[loop_key]
+
+        # Mark the exception as retrieved in case no caller is waiting on it
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls) + len(self._async_calls),
+        }
+
+
+"""
+Holds a single value that is replaced atomically.
+
+Reads return the current value without taking a lock, which is safe because the value is only
+ever replaced as a whole, never mutated in place. Writers are serialized so that
+`compare_and_set` can be used to replace a value only if it has not changed.
+
+Args:
+    value (Any, optional): Initial value.
+"""
+
+
+class AtomicSlot:
+    def __init__(self, value: Any = None) -> None:
+        self._value = value
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        return self._value
+
+    def set(self, value: Any) -> None:
+        with self._lock:
+            self._value = value
+
+    def update(self, fn: Callable[[Any], Any]) -> Any:
+        """
+        Replaces the value with `fn(value)` while holding the write lock.
+
+        :param fn: Builds the replacement from the current value without mutating it.
+        :return: The replacement value.
+        """
+        with self._lock:
+            self._value = fn(self._value)
+            return self._value
+
+    def compare_and_set(self, expected: Any, value: Any) -> bool:
+        """
+        Replaces the value only if it is still `expected`.
+
+        :param expected: Value the slot must currently hold.
+        :param value: Replacement value.
+        :return: True if the value was replaced.
+        """
+        with self._lock:
+            if self._value is not expected:
+                return False
+
+            self._value = value
+            return True
+
+
+# Process-wide coalescing of generations for decorators that are not given their own
+generations = SingleFlight()
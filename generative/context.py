@@ -0,0 +1,173 @@
+import inspect
+import threading
+import weakref
+from typing import Any, Callable, NamedTuple, Optional, Type
+
+from .cache import function_identity
+from .index import MAX_CONTEXT_FUNCTIONS, MAX_CONTEXT_TOKENS, context_index
+from .utils import extract_func_name, hash_source
+from .prompt import format_generative_function
+
+
+class _ClassEntry(NamedTuple):
+    context_hash: str
+    prompt: str
+
+
+"""
+Precomputed state needed to generate code for a decorated function.
+
+The function's source, name and identity are resolved once when the decorator is applied. Prompts
+are built lazily from the class's context index, once per class the function is called on, and
+rebuilt only when that class's functions change. Only the class functions most relevant to the
+decorated function are shown in full; see `index.select_context`. Steady-state calls through a
+decorator therefore do no reflection, regex matching or prompt formatting.
+
+Stored records are keyed by `storage_key`, which includes a hash of the function's source and of
+the class context. Changing either after a deploy makes old records unreachable, while unchanged
+functions keep finding their records.
+
+Args:
+    func (Callable): The decorated function.
+    max_context_tokens (int, optional): Token budget for class functions shown in full.
+    max_context_functions (int, optional): Maximum number of class functions shown in full.
+    minify (bool, optional): Build prompts from minified source; see `utils.minify_source`.
+
+Attributes:
+    func (Callable): The decorated function.
+    identity (str): Module-qualified name of the decorated function.
+    source (str): Source code of the decorated function, or "" if it is unavailable.
+    name (str): Name of the function as written in its source.
+    source_hash (str): Content hash of `source`.
+"""
+
+
+class GenerationContext:
+    def __init__(
+        self,
+        func: Callable[..., Any],
+        max_context_tokens: int = MAX_CONTEXT_TOKENS,
+        max_context_functions: int = MAX_CONTEXT_FUNCTIONS,
+        minify: bool = False,
+    ) -> None:
+        self.func = func
+        self.max_context_tokens = max_context_tokens
+        self.max_context_functions = max_context_functions
+        self.minify = minify
+        self.identity = function_identity(func)
+
+        try:
+            # Get the source code of the function
+            self.source = inspect.getsource(func)
+        except (TypeError, OSError):
+            self.source = ""
+
+        self.name = (
+            extract_func_name(self.source)
+            if self.source
+            else getattr(func, "__name__", "")
+        )
+
+        self.source_hash = hash_source(self.source)
+
+        self._prompt: Optional[str] = None
+        self._classes: "weakref.WeakKeyDictionary[type, _ClassEntry]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
+
+    def prompt(self, cls: Optional[Type[Any]] = None) -> str:
+        """
+        Returns the generation prompt for the function.
+
+        :param cls: Class whose functions are offered to the model as context, if any.
+        :return: The formatted prompt.
+        """
+        if cls is None:
+            if self._prompt is None:
+                self._prompt = format_generative_function(
+                    self.source, minify=self.minify
+                )
+            return self._prompt
+
+        return self._class_entry(cls).prompt
+
+    def context_hash(self, cls: Optional[Type[Any]] = None) -> str:
+        """
+        Returns a content hash of the functions offered to the model as context.
+
+        :param cls: Class whose functions are offered to the model as context, if any.
+        :return: Hex digest of the class's functions, or of no functions.
+        """
+        if cls is None:
+            return hash_source("")
+
+        return self._class_entry(cls).context_hash
+
+    def storage_key(self, key: str, cls: Optional[Type[Any]] = None) -> str:
+        """
+        Versions a database key with the function's source hash and the context hash.
+
+        :param key: Key built by the decorator's key policy.
+        :param cls: Class whose functions are offered to the model as context, if any.
+        :return: The versioned key.
+        """
+        return f"{key}:{self.source_hash[:16]}:{self.context_hash(cls)[:16]}"
+
+    def failure_key(self, key: str, error: BaseException) -> str:
+        """
+        Versions a database key for repairs of a particular failure.
+
+        Failures are identified by the function's source hash, the exception's type and the line
+        of the function it was raised from, relative to the start of the function, so edits
+        elsewhere in the module do not change it.
+
+        :param key: Key built by the decorator's key policy.
+        :param error: Exception raised by the function.
+        :return: The versioned key.
+        """
+        code = getattr(self.func, "__code__", None)
+        line = -1
+
+        # The innermost frame of the function is where it failed, or called what failed
+        frame = error.__traceback__
+        while frame is not None:
+            if code is not None and frame.tb_frame.f_code is code:
+                line = frame.tb_lineno - code.co_firstlineno
+            frame = frame.tb_next
+
+        kind = type(error)
+        return f"{self.storage_key(key)}:{kind.__module__}.{kind.__qualname__}:{line}"
+
+    def _class_entry(self, cls: Type[Any]) -> _ClassEntry:
+        index = context_index(cls)
+        context_hash = index.context_hash()
+        entry = self._classes.get(cls)
+
+        if entry is None or entry.context_hash != context_hash:
+            prompt = format_generative_function(
+                self.source,
+                index,
+                self.max_context_tokens,
+                self.max_context_functions,
+                self.minify,
+            )
+            entry = _ClassEntry(context_hash, prompt)
+
+            with self._lock:
+                self._classes[cls] = entry
+
+        return entry
+
+    def invalidate(self, cls: Optional[Type[Any]] = None) -> None:
+        """
+        Discards prompts built for `cls`, or every prompt if no class is given.
+
+        :param cls: Class whose prompt should be rebuilt on next use.
+        """
+        with self._lock:
+            if cls is None:
+                self._prompt = None
+                self._classes.clear()
+            else:
+                self._classes.pop(cls, None)
@@ -0,0 +1,525 @@
+import json
+import time
+import queue
+import logging
+import sqlite3
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from .metaclasses import AbstractDatabase
+
+logger = logging.getLogger(__name__)
+
+_Row = Tuple[str, Optional[str], Optional[str], str, float]
+
+
+def _write_rows(connection: sqlite3.Connection, rows: List[_Row]) -> None:
+    if not rows:
+        return
+
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.executemany(
+            "INSERT OR REPLACE INTO generated_code "
+            "(key, function_name, source_hash, data, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+
+    connection.execute("COMMIT")
+
+
+def _flush_pending(
+    path: str, timeout: float, pending: Dict[str, _Row], lock: threading.Lock
+) -> None:
+    # Runs when a batching database is garbage collected or the interpreter exits, so it cannot
+    # use the instance or its per-thread connections
+    with lock:
+        rows = list(pending.values())
+        pending.clear()
+
+    if not rows:
+        return
+
+    connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    try:
+        _write_rows(connection, rows)
+    except sqlite3.Error:
+        logger.exception("Could not write %d buffered records to %s", len(rows), path)
+    finally:
+        connection.close()
+
+
+"""
+An `AbstractDatabase` backed by SQLite.
+
+Records are stored as JSON alongside the function name and source hash they describe, both of
+which are indexed. The database runs in write-ahead-logging mode so that readers in other threads
+and worker processes are not blocked by a writer. Each thread uses its own connection.
+
+Writes can be batched: with a `batch_size` greater than one, `set` buffers records and writes
+them in a single transaction once the batch is full or `flush` is called. Buffered records are
+visible to `get` and `contains` on the same instance before they are flushed, but other instances
+and processes only see them once they are written, so up to `batch_size - 1` records can be
+missing there. Buffered records are also written when the instance is closed or garbage
+collected and when the interpreter exits normally; they are lost if the process is killed.
+
+Args:
+    path (str): Path of the database file. Created if it does not exist.
+    batch_size (int, optional): Number of `set` calls buffered before they are written.
+    timeout (float, optional): Seconds to wait for a lock held by another connection.
+"""
+
+
+class SQLiteDatabase(AbstractDatabase):
+    def __init__(self, path: str, batch_size: int = 1, timeout: float = 30.0) -> None:
+        if batch_size <= 0:
+            raise ValueError("batch_size must be a positive integer")
+
+        self.path = path
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._pending: Dict[str, _Row] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        if batch_size > 1:
+            # Write what is still buffered if the instance is dropped or the interpreter exits
+            weakref.finalize(
+                self, _flush_pending, path, timeout, self._pending, self._lock
+            )
+
+        connection = self._connection()
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS generated_code (
+                key TEXT PRIMARY KEY,
+                function_name TEXT,
+                source_hash TEXT,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_generated_code_function_name
+                ON generated_code (function_name);
+            CREATE INDEX IF NOT EXISTS idx_generated_code_source_hash
+                ON generated_code (source_hash);
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            # Autocommit mode; batches open their own transactions
+            connection = sqlite3.connect(
+                self.path,
+                timeout=self.timeout,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+
+            with self._lock:
+                self._connections.append(connection)
+
+        return connection
+
+    @staticmethod
+    def _row(key: str, data: Any) -> _Row:
+        function_name = key
+        source_hash = None
+
+        if isinstance(data, dict):
+            function_name = data.get("function_name", key)
+            source_hash = data.get("source_hash")
+
+        return (
+            key,
+            function_name,
+            source_hash,
+            json.dumps(data, default=repr),
+            time.time(),
+        )
+
+    def contains(self, query: str) -> bool:
+        if query in self._pending:
+            return True
+
+        cursor = self._connection().execute(
+            "SELECT 1 FROM generated_code WHERE key = ?", (query,)
+        )
+        return cursor.fetchone() is not None
+
+    def get(self, query: str) -> Any:
+        pending = self._pending.get(query)
+        if pending is not None:
+            return json.loads(pending[3])
+
+        cursor = self._connection().execute(
+            "SELECT data FROM generated_code WHERE key = ?", (query,)
+        )
+        row = cursor.fetchone()
+
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, key: str, data: Any) -> None:
+        with self._lock:
+            self._pending[key] = self._row(key, data)
+            is_full = len(self._pending) >= self.batch_size
+
+        if is_full:
+            self.flush()
+
+    def set_many(self, items: Iterable[Tuple[str, Any]]) -> None:
+        """
+        Writes several records in a single transaction.
+
+        :param items: Pairs of keys and records.
+        """
+        self._write([self._row(key, data) for key, data in items])
+
+    def flush(self) -> None:
+        """
+        Writes all buffered records in a single transaction.
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows = list(self._pending.values())
+
+            self._write(rows)
+
+            # Records stay visible in the buffer until they are committed, and records that
+            # were replaced while the batch was being written stay buffered
+            with self._lock:
+                for row in rows:
+                    if self._pending.get(row[0]) is row:
+                        del self._pending[row[0]]
+
+    def _write(self, rows: List[_Row]) -> None:
+        _write_rows(self._connection(), rows)
+
+    def find(
+        self, function_name: Optional[str] = None, source_hash: Optional[str] = None
+    ) -> List[Any]:
+        """
+        Returns every record stored for a function name and/or source hash.
+
+        :param function_name: Name of the generated function.
+        :param source_hash: Hash of the source the record was generated from.
+        :return: Matching records, most recently written first.
+        """
+        self.flush()
+
+        clauses, params = [], []
+        if function_name is not None:
+            clauses.append("function_name = ?")
+            params.append(function_name)
+        if source_hash is not None:
+            clauses.append("source_hash = ?")
+            params.append(source_hash)
+
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        cursor = self._connection().execute(
+            f"SELECT data FROM generated_code{where} ORDER BY updated_at DESC", params
+        )
+
+        return [json.loads(row[0]) for row in cursor.fetchall()]
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._pending.pop(key, None)
+
+        self._connection().execute("DELETE FROM generated_code WHERE key = ?", (key,))
+
+    def count(self) -> int:
+        """
+        Returns the number of stored records.
+        """
+        self.flush()
+        cursor = self._connection().execute("SELECT COUNT(*) FROM generated_code")
+        return cursor.fetchone()[0]
+
+    def close(self) -> None:
+        """
+        Flushes buffered records and closes every connection opened by this instance.
+        """
+        self.flush()
+
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+        self._local = threading.local()
+
+
+class _Entry(NamedTuple):
+    data: Any
+    expires_at: Optional[float]
+    size: int
+
+
+"""
+A bounded in-process `AbstractDatabase` with least-recently-used eviction and per-entry expiry.
+
+Entries are evicted once either the number of entries exceeds `max_entries` or their approximate
+serialized size exceeds `max_bytes`; an entry larger than `max_bytes` on its own is not kept.
+Entries older than their time-to-live are treated as missing and dropped when next read. Reads do
+not take a lock, so this can serve as a zero-latency tier in front of slower stores.
+
+Args:
+    max_entries (int, optional): Maximum number of entries kept.
+    max_bytes (int, optional): Maximum approximate size of all entries, or None for no limit.
+    ttl (float, optional): Default time-to-live of an entry in seconds, or None to never expire.
+"""
+
+
+class MemoryDatabase(AbstractDatabase):
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ) -> None:
+        if max_entries <= 0:
+            raise ValueError("max_entries must be a positive integer")
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bytes = 0
+        self._data: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(data: Any) -> int:
+        return len(json.dumps(data, default=repr))
+
+    def _entry(self, key: str) -> Optional[_Entry]:
+        entry = self._data.get(key)
+
+        if entry is None:
+            return None
+
+        if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+            with self._lock:
+                if self._data.get(key) is entry:
+                    del self._data[key]
+                    self.bytes -= entry.size
+                    self.expirations += 1
+            return None
+
+        return entry
+
+    def contains(self, query: str) -> bool:
+        return self._entry(query) is not None
+
+    def get(self, query: str) -> Any:
+        entry = self._entry(query)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        try:
+            self._data.move_to_end(query)
+        except KeyError:
+            # Evicted by another thread between the lookup and the reorder
+            pass
+
+        self.hits += 1
+        return entry.data
+
+    def set(self, key: str, data: Any, ttl: Optional[float] = None) -> None:
+        """
+        Inserts data into the database.
+
+        :param key: Key to be inserted.
+        :param data: Data to be inserted.
+        :param ttl: Time-to-live of this entry in seconds. Defaults to the database's `ttl`.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        entry = _Entry(data, expires_at, self._size(data))
+
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous.size
+
+            self._data[key] = entry
+            self.bytes += entry.size
+
+            while len(self._data) > self.max_entries or (
+                self.max_bytes is not None and self.bytes > self.max_bytes
+            ):
+                _, evicted = self._data.popitem(last=False)
+                self.bytes -= evicted.size
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry.size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def count(self) -> int:
+        """
+        Returns the number of stored entries, including expired entries not yet dropped.
+        """
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "entries": len(self._data),
+            "bytes": self.bytes,
+        }
+
+
+"""
+An `AbstractDatabase` that chains several databases, fastest first.
+
+Reads try each tier in order. A hit in a slower tier is promoted into every faster tier so that
+the next read is served from memory. Writes go through to every tier, or, with `write_behind`,
+only to the first tier immediately and to the remaining tiers from a background thread. Per-tier
+hit ratios are reported by `stats()`.
+
+Example:
+    TieredDatabase(MemoryDatabase(max_entries=1024), SQLiteDatabase("generated.db"))
+
+Args:
+    tiers (AbstractDatabase): Databases ordered from fastest to slowest.
+    write_behind (bool, optional): Write to tiers after the first from a background thread.
+    max_pending (int, optional): Maximum number of writes waiting for the background thread.
+        `set` blocks when the queue is full.
+
+Raises:
+    ValueError: If no tiers are given.
+"""
+
+
+class TieredDatabase(AbstractDatabase):
+    def __init__(
+        self,
+        *tiers: AbstractDatabase,
+        write_behind: bool = False,
+        max_pending: int = 10000,
+    ) -> None:
+        if not tiers:
+            raise ValueError("At least one tier is required")
+
+        self.tiers = list(tiers)
+        self.write_behind = write_behind
+        self.lookups = [0] * len(self.tiers)
+        self.hits = [0] * len(self.tiers)
+        self.misses = 0
+        self.write_errors = 0
+        self._queue: "queue.Queue[Optional[Tuple[str, Any]]]" = queue.Queue(
+            maxsize=max_pending
+        )
+        self._writer: Optional[threading.Thread] = None
+
+        if write_behind and len(self.tiers) > 1:
+            self._writer = threading.Thread(
+                target=self._write_behind, name="generative-write-behind", daemon=True
+            )
+            self._writer.start()
+
+    def _write_behind(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+
+                key, data = item
+                for tier in self.tiers[1:]:
+                    tier.set(key, data)
+            except Exception:
+                self.write_errors += 1
+                logger.exception("Write-behind to a slower tier failed")
+            finally:
+                self._queue.task_done()
+
+    def contains(self, query: str) -> bool:
+        return any(tier.contains(query) for tier in self.tiers)
+
+    def get(self, query: str) -> Any:
+        for i, tier in enumerate(self.tiers):
+            self.lookups[i] += 1
+            data = tier.get(query)
+
+            if data is not None:
+                self.hits[i] += 1
+
+                # Promote into the faster tiers
+                for faster in self.tiers[:i]:
+                    faster.set(query, data)
+
+                return data
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, data: Any) -> None:
+        self.tiers[0].set(key, data)
+
+        if self._writer is not None:
+            self._queue.put((key, data))
+        else:
+            for tier in self.tiers[1:]:
+                tier.set(key, data)
+
+    def flush(self) -> None:
+        """
+        Blocks until every pending write-behind has been applied.
+        """
+        if self._writer is not None:
+            self._queue.join()
+
+    def close(self) -> None:
+        """
+        Applies pending writes and stops the write-behind thread.
+        """
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tiers": [
+                {
+                    "tier": type(tier).__name__,
+                    "lookups": self.lookups[i],
+                    "hits": self.hits[i],
+                    "hit_ratio": (
+                        self.hits[i] / self.lookups[i] if self.lookups[i] else 0.0
+                    ),
+                }
+                for i, tier in enumerate(self.tiers)
+            ],
+            "misses": self.misses,
+            "pending_writes": self._queue.qsize(),
+            "write_errors": self.write_errors,
+        }
@@ -1,32 +1,101 @@
-import re
-import time
+import functools
 import inspect
 import textwrap
 import traceback
-from typing import Callable, Any, Optional, Dict
-
-from RestrictedPython import compile_restricted
+from typing import Callable, Any, Hashable, NamedTuple, Optional, Dict, Tuple, Type
 
 from .metaclasses import (
     AbstractDatabase,
     DatabaseException,
     AbstractGenerativeModel,
+    AbstractKeyPolicy,
 )
 
 from .utils import (
     clean_function,
-    remove_prepended,
-    extract_func_name,
-    format_binary_output,
     is_valid_syntax,
 )
 
-from .prompt import (
-    format_generative_function,
-    format_stack_trace,
-    format_semantic_checker,
+from .models import (
+    CODE_GENERATION_OPTIONS,
+    STACK_TRACE_OPTIONS,
+    agenerate_code,
+    agenerate_with,
+    as_async_model,
+    generate_code,
+    generate_with,
+    is_async_model,
+)
+
+from .cache import (
+    CompiledFunction,
+    CompiledFunctionCache,
+    NegativeCache,
+    VerdictCache,
+    compiled_functions,
+    acritique,
+    compile_function,
+    critique,
+    critic_verdicts,
+    failed_generations,
+)
+
+from .context import GenerationContext
+from .index import MAX_CONTEXT_FUNCTIONS, MAX_CONTEXT_TOKENS, class_signature
+
+from .concurrency import AtomicSlot, SingleFlight, generations
+
+from .keys import FunctionKeyPolicy
+
+from .tracebacks import (
+    DeferredExplainer,
+    ExplanationCache,
+    TracebackCompactor,
+    trace_compactor,
+    trace_explanations,
 )
 
+from .prompt import format_stack_trace
+
+# Maximum number of per-key implementations an `adapt` wrapper keeps in memory
+MAX_IMPLEMENTATIONS = 1024
+
+
+"""
+Extract generated code from a database result.
+
+Args:
+    record (Any): A stored capability dictionary, a string of code, or None.
+
+Returns:
+    The generated code, or None if the record does not contain any.
+"""
+
+
+def _generated_code(record: Any) -> Optional[str]:
+    if isinstance(record, dict):
+        return record.get("generated_code")
+
+    return record
+
+
+"""
+An implementation installed by `adapt`, with the class context it was resolved for.
+
+Attributes:
+    compiled (CompiledFunction): The compiled implementation.
+    context_hash (str): Hash of the class's functions when the implementation was resolved.
+    class_signature (tuple): The class's `index.class_signature` at that time, a cheaper check of
+        whether the class may have changed.
+"""
+
+
+class Implementation(NamedTuple):
+    compiled: CompiledFunction
+    context_hash: str
+    class_signature: Tuple[Hashable, ...]
+
+
 """
 A decorator that replaces the behavior of the decorated function with arbitrary code.
 
@@ -36,9 +105,34 @@ Args:
     critic (AbstractGenerativeModel, optional): LLM to review generated code from `model`.
     database (AbstractDatabase, optional): An instance of a class that implements the
                                            AbstractDatabase interface.
+    cache (CompiledFunctionCache, optional): Cache of compiled generated functions. Defaults to
+                                             the process-wide `cache.compiled_functions`.
+    single_flight (SingleFlight, optional): Coalesces concurrent generations for the same
+                                            function. Defaults to the process-wide
+                                            `concurrency.generations`.
+    key_policy (AbstractKeyPolicy, optional): Builds database keys from calls and decides which
+                                              calls share an implementation. Defaults to
+                                              `keys.FunctionKeyPolicy`, one implementation per
+                                              function.
+    negative_cache (NegativeCache, optional): Remembers keys whose generation failed so they
+                                              fall back to the original function until their
+                                              back-off expires. Defaults to the process-wide
+                                              `cache.failed_generations`.
+    verdicts (VerdictCache, optional): Remembers the critic's verdicts on generated code.
+                                       Defaults to the process-wide `cache.critic_verdicts`.
+    max_context_tokens (int, optional): Token budget for class functions shown to `model` in
+                                        full. The functions most relevant to the decorated
+                                        function are chosen; the rest are listed by signature.
+    max_context_functions (int, optional): Maximum number of class functions shown in full.
+    minify (bool, optional): Show `model` source code without comments, docstrings, blank
+                             lines or decorators. See `utils.minify_source`.
 
 Returns:
     A function that wraps the original function, replacing its behavior with the provided code.
+    Once code has been resolved for a key and the class of `self`, it is installed in the
+    wrapper's `_implementation` slot and later calls with that key on instances of that class
+    run it without consulting the database or model, until functions are added to, removed from
+    or replaced on the class.
 """
 
 
@@ -47,101 +141,306 @@ def adapt(
     model: Optional[AbstractGenerativeModel] = None,
     critic: Optional[AbstractGenerativeModel] = None,
     database: Optional[AbstractDatabase] = None,
+    cache: Optional[CompiledFunctionCache] = None,
+    single_flight: Optional[SingleFlight] = None,
+    key_policy: Optional[AbstractKeyPolicy] = None,
+    negative_cache: Optional[NegativeCache] = None,
+    verdicts: Optional[VerdictCache] = None,
+    max_context_tokens: int = MAX_CONTEXT_TOKENS,
+    max_context_functions: int = MAX_CONTEXT_FUNCTIONS,
+    minify: bool = False,
 ) -> Callable:
+    if cache is None:
+        cache = compiled_functions
+
+    if negative_cache is None:
+        negative_cache = failed_generations
+
+    if verdicts is None:
+        verdicts = critic_verdicts
+
+    if single_flight is None:
+        single_flight = generations
+
+    if key_policy is None:
+        key_policy = FunctionKeyPolicy()
+
     def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
-        nonlocal code
-        func_source: str = ""
-        try:
-            # Get the source code of the function
-            func_source = inspect.getsource(func)
-        except (TypeError, OSError):
-            code = ""
+        context = GenerationContext(
+            func, max_context_tokens, max_context_functions, minify
+        )
+        func_name = context.name
+        static_code = code if context.source else ""
+
+        # Implementations are kept in a dictionary from (class, key) to Implementation that is
+        # never mutated, only replaced atomically. Calls read it without locking; only resolving
+        # a missing or outdated implementation synchronizes. Classes are resolved separately
+        # because each offers the model its own functions as context, and an implementation is
+        # resolved again once that context changes.
+        slot = AtomicSlot({})
+
+        def installed(key: str, cls: Type[Any]) -> Optional[CompiledFunction]:
+            implementation = slot.get().get((cls, key))
+
+            if implementation is None:
+                return None
+
+            # The class's functions are compared first because that is cheaper than hashing
+            # them, and the context can only change with them
+            if implementation.class_signature != class_signature(
+                cls
+            ) and implementation.context_hash != context.context_hash(cls):
+                return None
+
+            return implementation.compiled
+
+        def lookup(key: str, cls: Type[Any]) -> Optional[str]:
+            if not database:
+                return None
+
+            # Records are versioned by the function's source and its class context
+            return _generated_code(database.get(context.storage_key(key, cls)))
+
+        def load(code: str) -> CompiledFunction:
+            # Reuse the compiled function if this exact code was compiled before
+            cache_key = cache.key(func, code)
+            compiled = cache.get(cache_key)
+
+            if compiled is None:
+                compiled = compile_function(code)
+                cache.set(cache_key, compiled)
+
+            return compiled
+
+        def store(
+            key: str, cls: Type[Any], compiled: CompiledFunction, args: Any, kwargs: Any
+        ) -> None:
+            if not database:
+                return
 
-        def wrapper(self, *args: Any, **kwargs: Any) -> Any:
-            nonlocal code
-            has_cached_code = False
-            func_name = extract_func_name(func_source)
+            try:
+                capability = {
+                    "function_name": func_name,
+                    "source_hash": context.source_hash,
+                    "context_hash": context.context_hash(cls),
+                    "args": args,
+                    "kwargs": kwargs,
+                    "generated_code": compiled.code,
+                }
+                database.set(context.storage_key(key, cls), capability)
+            except Exception as e:
+                raise DatabaseException(
+                    "An error occurred while adding to the database"
+                ) from e
+
+        def install(key: str, cls: Type[Any], code: Optional[str]) -> Any:
+            if not code or code.strip() == "":
+                return None
 
-            if database:
-                query = str(
-                    {
-                        "function_name": func_name,
-                        "args": args,
-                        "kwargs": kwargs,
-                    }
-                )
+            compiled = load(code)
 
-                code = database.get(query)
-                has_cached_code = code is not None
+            signature = class_signature(cls)
+            implementation = Implementation(
+                compiled, context.context_hash(cls), signature
+            )
+
+            def add(
+                implementations: Dict[Tuple[Type[Any], str], Implementation],
+            ) -> Dict[Tuple[Type[Any], str], Implementation]:
+                updated = dict(implementations)
+                updated[(cls, key)] = implementation
+
+                # Drop the oldest implementations once the bound is exceeded
+                for oldest in list(updated)[: len(updated) - MAX_IMPLEMENTATIONS]:
+                    del updated[oldest]
 
-            if not has_cached_code and model and func_source:
-                is_semantically_correct = False
+                return updated
 
-                # Here, we can access `self` and get all functions of its class
-                class_functions = inspect.getmembers(
-                    self.__class__, predicate=inspect.isfunction
+            slot.update(add)
+
+            return compiled
+
+        if inspect.iscoroutinefunction(func):
+            async_model = as_async_model(model)
+            async_critic = as_async_model(critic)
+
+            async def agenerate(cls: Type[Any]) -> Optional[str]:
+                prompt = context.prompt(cls)
+                code = clean_function(
+                    await agenerate_code(async_model, prompt, CODE_GENERATION_OPTIONS)
                 )
 
-                # Format the generative function here, inside the wrapper,
-                # where you have access to `self`
-                prompt = format_generative_function(func_source, class_functions)
-                code = clean_function(model.generate(prompt))
-                print(f"code {time.time()}:\n{code}")
+                if not code or not is_valid_syntax(code):
+                    return None
 
-                if not code:
-                    return func(self, *args, **kwargs)
+                if not async_critic or not await acritique(
+                    async_critic, code, verdicts
+                ):
+                    return None
 
-                if critic:
-                    prompt = format_semantic_checker(code, input="", context="")
-                    output = critic.generate(prompt)
-                    is_semantically_correct = format_binary_output(output)
+                return code
 
-                if not is_semantically_correct:
-                    return func(self, *args, **kwargs)
+            async def aresolve(key: str, cls: Type[Any], args: Any, kwargs: Any) -> Any:
+                # Another caller may have installed an implementation while this one waited
+                compiled = installed(key, cls)
+                if compiled is not None:
+                    return compiled
 
-            if not code or code.strip() == "":
-                return func(self, *args, **kwargs)
-            else:
-                # TODO: sanitize given function using traditional methods and LLM
-                # It's recommended to use RestrictedPython.safe_globals to whitelist
-                # the global namespace
-                # global_vars = {} allows all global variables to be accessed.
-                # However, using RestrictedPython.safe_globals prevents many common functions
-                # from being implemented by the LLM.
-                global_vars: Dict[str, Any] = {}
-                code = remove_prepended(code)
-                code = textwrap.dedent(code)
-
-                if not is_valid_syntax(code):
-                    raise SyntaxError("Invalid syntax")
-
-                byte_code = compile_restricted(code, mode="exec")
-                exec(byte_code, global_vars)
-
-                # TODO: sanitize generated code i.e. generative_func
-                func_name = extract_func_name(code)
-                generative_func = global_vars[func_name]
+                code = static_code
+                has_cached_code = False
 
                 if database:
-                    try:
-                        capability = {
-                            "args": args,
-                            "kwargs": kwargs,
-                            "generated_code": code,
-                        }
-                        database.set(func_name, capability)
-                    except Exception as e:
-                        raise DatabaseException(
-                            "An error occurred while adding to the database"
-                        ) from e
+                    code = lookup(key, cls)
+                    has_cached_code = code is not None
+
+                if has_cached_code or not async_model or not context.source:
+                    return install(key, cls, code)
+
+                code = await agenerate(cls)
+
+                if code is None:
+                    negative_cache.record_failure((context.identity, key))
+                    return None
+
+                try:
+                    compiled = install(key, cls, code)
+                except Exception:
+                    # Code that RestrictedPython rejects or that fails to run is backed off like
+                    # code the critic rejects
+                    negative_cache.record_failure((context.identity, key))
+                    return None
+
+                negative_cache.record_success((context.identity, key))
+
+                # Only newly generated code is stored; records read from the database are not
+                # written back
+                store(key, cls, compiled, args, kwargs)
+
+                return compiled
+
+            async def async_wrapper(self, *args: Any, **kwargs: Any) -> Any:
+                key = key_policy.key(func_name, args, kwargs)
+                cls = self.__class__
+                compiled = installed(key, cls)
+
+                if compiled is None:
+                    # Keys that failed recently fall back without calling the model
+                    if negative_cache.should_skip((context.identity, key)):
+                        return await func(self, *args, **kwargs)
+
+                    # Concurrent callers share a single resolution for this key
+                    compiled = await single_flight.ado(
+                        (context.identity, cls, key),
+                        lambda: aresolve(key, cls, args, kwargs),
+                    )
+
+                    if compiled is None:
+                        return await func(self, *args, **kwargs)
 
                 # TODO: sanitize result
-                result = generative_func(self, *args, **kwargs)
+                result = compiled.func(self, *args, **kwargs)
+
+                # RestrictedPython only compiles plain functions, but they may still return
+                # awaitables
+                if inspect.isawaitable(result):
+                    result = await result
 
                 return result
 
+            async_wrapper._is_generative = model is not None  # type: ignore[attr-defined]
+            async_wrapper._implementation = slot  # type: ignore[attr-defined]
+            async_wrapper._context = context  # type: ignore[attr-defined]
+
+            return async_wrapper
+
+        if is_async_model(model) or is_async_model(critic):
+            raise TypeError(
+                "Asynchronous models can only be used to decorate async functions"
+            )
+
+        def generate(cls: Type[Any]) -> Optional[str]:
+            is_semantically_correct = False
+
+            # The prompt offers the functions of `self`'s class as context and is only
+            # rebuilt when that class changes
+            prompt = context.prompt(cls)
+            code = clean_function(generate_code(model, prompt, CODE_GENERATION_OPTIONS))
+
+            if not code or not is_valid_syntax(code):
+                return None
+
+            if critic:
+                is_semantically_correct = critique(critic, code, verdicts)
+
+            if not is_semantically_correct:
+                return None
+
+            return code
+
+        def resolve(key: str, cls: Type[Any], args: Any, kwargs: Any) -> Any:
+            # Another caller may have installed an implementation while this one waited
+            compiled = installed(key, cls)
+            if compiled is not None:
+                return compiled
+
+            code = static_code
+            has_cached_code = False
+
+            if database:
+                code = lookup(key, cls)
+                has_cached_code = code is not None
+
+            if has_cached_code or not model or not context.source:
+                return install(key, cls, code)
+
+            code = generate(cls)
+
+            if code is None:
+                negative_cache.record_failure((context.identity, key))
+                return None
+
+            try:
+                compiled = install(key, cls, code)
+            except Exception:
+                # Code that RestrictedPython rejects or that fails to run is backed off like
+                # code the critic rejects
+                negative_cache.record_failure((context.identity, key))
+                return None
+
+            negative_cache.record_success((context.identity, key))
+
+            # Only newly generated code is stored; records read from the database are not
+            # written back
+            store(key, cls, compiled, args, kwargs)
+
+            return compiled
+
+        def wrapper(self, *args: Any, **kwargs: Any) -> Any:
+            key = key_policy.key(func_name, args, kwargs)
+            cls = self.__class__
+            compiled = installed(key, cls)
+
+            if compiled is None:
+                # Keys that failed recently fall back without calling the model
+                if negative_cache.should_skip((context.identity, key)):
+                    return func(self, *args, **kwargs)
+
+                # Concurrent callers share a single resolution for this key
+                compiled = single_flight.do(
+                    (context.identity, cls, key),
+                    lambda: resolve(key, cls, args, kwargs),
+                )
+
+                if compiled is None:
+                    return func(self, *args, **kwargs)
+
+            # TODO: sanitize result
+            return compiled.func(self, *args, **kwargs)
+
         # Add a special attribute to the wrapper to indicate it has access to a generative model
         wrapper._is_generative = model is not None  # type: ignore[attr-defined]
+        wrapper._implementation = slot  # type: ignore[attr-defined]
+        wrapper._context = context  # type: ignore[attr-defined]
 
         return wrapper
 
@@ -162,6 +461,17 @@ Args:
         Model that can generate alternative implementations of the input function.
     critic (AbstractGenerativeModel, optional): LLM to review generated code from `model`.
     database (AbstractDatabase, optional): Database to store generated code from `model`.
+    single_flight (SingleFlight, optional): Coalesces concurrent generations for the same
+        function. Defaults to the process-wide `concurrency.generations`.
+    key_policy (AbstractKeyPolicy, optional): Builds database keys from calls. Defaults to
+        `keys.FunctionKeyPolicy`.
+    negative_cache (NegativeCache, optional): Remembers functions whose repair failed so their
+        exceptions are re-raised without calling the model until the back-off expires. Defaults
+        to the process-wide `cache.failed_generations`.
+    verdicts (VerdictCache, optional): Remembers the critic's verdicts on generated code.
+        Defaults to the process-wide `cache.critic_verdicts`.
+    minify (bool, optional): Show `model` the function's source without comments, blank lines
+        or decorators. See `utils.minify_source`.
 
 Returns:
     A function that wraps the original function, catching any exceptions that it raises, and
@@ -173,88 +483,263 @@ def catch(
     model: AbstractGenerativeModel,
     critic: Optional[AbstractGenerativeModel] = None,
     database: Optional[AbstractDatabase] = None,
+    single_flight: Optional[SingleFlight] = None,
+    key_policy: Optional[AbstractKeyPolicy] = None,
+    negative_cache: Optional[NegativeCache] = None,
+    verdicts: Optional[VerdictCache] = None,
+    minify: bool = False,
 ) -> Callable:
-    def extract_func_name(code: str) -> str:
-        match = re.search(r"def\s+(\w+)", code)
-        if match:
-            return match.group(1)
-        else:
-            raise ValueError("No function definition found in provided code.")
+    if single_flight is None:
+        single_flight = generations
+
+    if key_policy is None:
+        key_policy = FunctionKeyPolicy()
+
+    if negative_cache is None:
+        negative_cache = failed_generations
+
+    if verdicts is None:
+        verdicts = critic_verdicts
 
     def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
-        func_source: str = ""
-        try:
-            # Get the source code of the function
-            func_source = inspect.getsource(func)
-        except (TypeError, OSError):
-            pass
+        context = GenerationContext(func, minify=minify)
+        func_name = context.name
+
+        # Compiled repairs are kept in a dictionary from failure key to function that is never
+        # mutated, only replaced atomically, so known failures are repaired without locking
+        repairs = AtomicSlot({})
+
+        def lookup(failure: str) -> Optional[str]:
+            if not database:
+                return None
+
+            return _generated_code(database.get(failure))
+
+        def load(code: str) -> Callable[..., Any]:
+            global_vars: Dict[str, Any] = {
+                "func_source": context.source,
+            }
+
+            # TODO: sanitize generated code i.e. generative_func
+            return compile_function(code, global_vars).func
+
+        def install(
+            failure: str,
+            code: str,
+            error: BaseException,
+            args: Any,
+            kwargs: Any,
+            store: bool,
+        ) -> Callable[..., Any]:
+            repair = load(code)
+
+            if store and database:
+                try:
+                    capability = {
+                        "function_name": func_name,
+                        "source_hash": context.source_hash,
+                        "exception": type(error).__qualname__,
+                        "args": args,
+                        "kwargs": kwargs,
+                        "generated_code": code,
+                    }
+                    database.set(failure, capability)
+                except Exception as e:
+                    raise DatabaseException(
+                        "An error occurred while adding to the database"
+                    ) from e
 
-        def wrapper(*args: Any, **kwargs: Any) -> Any:
-            code: str | None = ""
-            try:
-                # Execute the original function first
-                return func(*args, **kwargs)
-            except Exception:
-                func_name = extract_func_name(func_source)
+            def add(installed: Dict[str, Callable[..., Any]]) -> Dict[str, Any]:
+                updated = dict(installed)
+                updated[failure] = repair
 
-                if database:
-                    query = str(
-                        {
-                            "function_name": func_name,
-                            "args": args,
-                            "kwargs": kwargs,
-                        }
-                    )
-                    code = database.get(query)
+                # Drop the oldest repairs once the bound is exceeded
+                for oldest in list(updated)[: len(updated) - MAX_IMPLEMENTATIONS]:
+                    del updated[oldest]
+
+                return updated
+
+            repairs.update(add)
+
+            return repair
+
+        if inspect.iscoroutinefunction(func):
+            async_model = as_async_model(model)
+            async_critic = as_async_model(critic)
+
+            async def agenerate() -> Optional[str]:
+                prompt = context.prompt()
+                code = clean_function(
+                    await agenerate_code(async_model, prompt, CODE_GENERATION_OPTIONS)
+                )
 
-                # If there was an exception, and an LLM is provided, use it
-                if model and func_source:
-                    prompt = format_generative_function(func_source)
-                    code = clean_function(model.generate(prompt))
+                if not code or not is_valid_syntax(code):
+                    return None
 
-                    if not code:
+                if async_critic and not await acritique(async_critic, code, verdicts):
+                    return None
+
+                return code
+
+            async def aresolve(
+                failure: str, error: BaseException, args: Any, kwargs: Any
+            ) -> Optional[Callable[..., Any]]:
+                # Another caller may have installed a repair while this one waited
+                repair = repairs.get().get(failure)
+                if repair is not None:
+                    return repair
+
+                code = lookup(failure)
+                if code:
+                    return install(failure, code, error, args, kwargs, store=False)
+
+                if not async_model or not context.source:
+                    return None
+
+                # Failures whose repair failed recently re-raise immediately
+                if negative_cache.should_skip(failure):
+                    return None
+
+                code = await agenerate()
+
+                if not code:
+                    negative_cache.record_failure(failure)
+                    return None
+
+                try:
+                    repair = install(failure, code, error, args, kwargs, store=True)
+                except DatabaseException:
+                    raise
+                except Exception:
+                    # Repairs that RestrictedPython rejects or that fail to run are backed off
+                    # like repairs the critic rejects
+                    negative_cache.record_failure(failure)
+                    return None
+
+                negative_cache.record_success(failure)
+
+                return repair
+
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                try:
+                    # Execute the original function first
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    key = key_policy.key(func_name, args, kwargs)
+                    failure = context.failure_key(key, e)
+                    repair = repairs.get().get(failure)
+
+                    if repair is None:
+                        # Concurrent occurrences of a failure share a single resolution
+                        repair = await single_flight.ado(
+                            (context.identity, failure),
+                            functools.partial(aresolve, failure, e, args, kwargs),
+                        )
+
+                    # If there is no stored repair, and no LLM is provided or the LLM fails,
+                    # re-raise the original exception
+                    if repair is None:
                         raise
 
-                    if code.strip() != "":
-                        is_semantically_correct = False
+                    # TODO: sanitize result
+                    result = repair(*args, **kwargs)
+
+                    if inspect.isawaitable(result):
+                        result = await result
+
+                    return result
+
+            async_wrapper._is_generative = model is not None  # type: ignore[attr-defined]
+            async_wrapper._repairs = repairs  # type: ignore[attr-defined]
+            async_wrapper._context = context  # type: ignore[attr-defined]
 
-                        if critic:
-                            prompt = format_semantic_checker(code, input="", context="")
-                            output = critic.generate(prompt)
-                            is_semantically_correct = format_binary_output(output)
+            return async_wrapper
 
-                            if not is_semantically_correct:
-                                raise
+        if is_async_model(model) or is_async_model(critic):
+            raise TypeError(
+                "Asynchronous models can only be used to decorate async functions"
+            )
 
-                        global_vars: Dict[str, Any] = {
-                            "func_source": func_source,
-                        }
+        def generate() -> Optional[str]:
+            prompt = context.prompt()
+            code = clean_function(generate_code(model, prompt, CODE_GENERATION_OPTIONS))
 
-                        # TODO: sanitize given function using traditional methods and LLM
-                        code = remove_prepended(code)
-                        code = textwrap.dedent(code)
+            if not code or not is_valid_syntax(code):
+                return None
 
-                        if not is_valid_syntax(code):
-                            raise SyntaxError("Invalid syntax")
+            if critic and not critique(critic, code, verdicts):
+                return None
 
-                        byte_code = compile_restricted(code, mode="exec")
-                        exec(byte_code, global_vars)
+            return code
 
-                        # TODO: sanitize generated code i.e. generative_func
-                        func_name = extract_func_name(code)
-                        generative_func: Callable = global_vars[func_name]
+        def resolve(
+            failure: str, error: BaseException, args: Any, kwargs: Any
+        ) -> Optional[Callable[..., Any]]:
+            # Another caller may have installed a repair while this one waited
+            repair = repairs.get().get(failure)
+            if repair is not None:
+                return repair
 
-                        # TODO: sanitize result
-                        result = generative_func(*args, **kwargs)
+            # Repairs stored for this failure by earlier runs are used without the model
+            code = lookup(failure)
+            if code:
+                return install(failure, code, error, args, kwargs, store=False)
 
-                        return result
+            if not model or not context.source:
+                return None
 
-            # If there was an exception, and no LLM is provided, or if the LLM fails, re-raise the
-            # original exception
-            raise
+            # Failures whose repair failed recently re-raise immediately
+            if negative_cache.should_skip(failure):
+                return None
+
+            code = generate()
+
+            if not code:
+                negative_cache.record_failure(failure)
+                return None
+
+            try:
+                repair = install(failure, code, error, args, kwargs, store=True)
+            except DatabaseException:
+                raise
+            except Exception:
+                # Repairs that RestrictedPython rejects or that fail to run are backed off
+                # like repairs the critic rejects
+                negative_cache.record_failure(failure)
+                return None
+
+            negative_cache.record_success(failure)
+
+            return repair
+
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            try:
+                # Execute the original function first
+                return func(*args, **kwargs)
+            except Exception as e:
+                key = key_policy.key(func_name, args, kwargs)
+                failure = context.failure_key(key, e)
+                repair = repairs.get().get(failure)
+
+                if repair is None:
+                    # Concurrent occurrences of a failure share a single resolution
+                    repair = single_flight.do(
+                        (context.identity, failure),
+                        functools.partial(resolve, failure, e, args, kwargs),
+                    )
+
+                # If there is no stored repair, and no LLM is provided or the LLM fails, re-raise
+                # the original exception
+                if repair is None:
+                    raise
+
+                # TODO: sanitize result
+                return repair(*args, **kwargs)
 
         # Add a special attribute to the wrapper to indicate it has access to a generative model
         wrapper._is_generative = model is not None  # type: ignore[attr-defined]
+        wrapper._repairs = repairs  # type: ignore[attr-defined]
+        wrapper._context = context  # type: ignore[attr-defined]
 
         return wrapper
 
@@ -270,6 +755,16 @@ fails, the original exception is propagated.
 Args:
     model (AbstractGenerativeModel, optional): A model that takes a stack trace as a string
         and returns a string to be used as the message for a new exception.
+    explanations (ExplanationCache, optional): Explanations already generated, keyed by
+        traceback fingerprint, so a recurring error is only explained once. Defaults to the
+        process-wide `tracebacks.trace_explanations`.
+    single_flight (SingleFlight, optional): Coalesces concurrent explanations of the same error.
+        Defaults to the process-wide `concurrency.generations`.
+    deferred (DeferredExplainer, optional): Explains stack traces in the background instead.
+        The original exception is re-raised immediately and the explanation is delivered to the
+        explainer's callback, logger and explanation cache.
+    compactor (TracebackCompactor, optional): Shrinks stack traces before they are sent to the
+        model. Defaults to the process-wide `tracebacks.trace_compactor`.
 
 Returns:
     Callable: A new function that wraps the original one, adding exception handling
@@ -277,7 +772,22 @@ Returns:
 """
 
 
-def stack_trace(model: Optional[AbstractGenerativeModel] = None) -> Callable:
+def stack_trace(
+    model: Optional[AbstractGenerativeModel] = None,
+    explanations: Optional[ExplanationCache] = None,
+    single_flight: Optional[SingleFlight] = None,
+    deferred: Optional[DeferredExplainer] = None,
+    compactor: Optional[TracebackCompactor] = None,
+) -> Callable:
+    if explanations is None:
+        explanations = trace_explanations
+
+    if compactor is None:
+        compactor = trace_compactor
+
+    if single_flight is None:
+        single_flight = generations
+
     def decorator(obj: Any) -> Any:
         if inspect.isclass(obj):
 
@@ -290,29 +800,121 @@ def stack_trace(model: Optional[AbstractGenerativeModel] = None) -> Callable:
 
             return Wrapper
 
+        elif inspect.iscoroutinefunction(obj):
+            async_model = as_async_model(model)
+
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                try:
+                    return await obj(*args, **kwargs)
+                except Exception as e:
+                    # Exceptions already handled by an inner wrapper, as in recursive functions,
+                    # propagate unchanged
+                    if getattr(e, "_is_stack_traced", False):
+                        raise
+
+                    # Capture the stack trace
+                    stack_trace = traceback.format_exc()
+
+                    # Explain in the background without delaying the original exception
+                    if deferred is not None:
+                        deferred.submit(e)
+                        e._is_stack_traced = True  # type: ignore[attr-defined]
+                        raise
+
+                    # If an LLM function is provided, pass the stack trace to it
+                    if async_model:
+                        key = explanations.key(e)
+                        summary = explanations.get(key)
+
+                        if summary is None:
+                            prompt = format_stack_trace(compactor.compact(e))
+
+                            async def explain() -> str:
+                                summary = textwrap.dedent(
+                                    await agenerate_with(
+                                        async_model, prompt, STACK_TRACE_OPTIONS
+                                    )
+                                )
+                                explanations.set(key, summary)
+                                return summary
+
+                            # Concurrent occurrences of an error share one explanation
+                            summary = await single_flight.ado(
+                                ("stack_trace", key), explain
+                            )
+
+                        new_exception_message = f"{stack_trace}\n{summary}"
+
+                        # Raise a new exception with the modified message
+                        exception = Exception(new_exception_message)
+                        exception._is_stack_traced = True  # type: ignore[attr-defined]
+                        raise exception from None
+                    else:
+                        # If no LLM function is provided, just re-raise the original exception
+                        raise e from None
+
+            async_wrapper._is_generative = (  # type: ignore[attr-defined]
+                model is not None or deferred is not None
+            )
+
+            return async_wrapper
+
         elif inspect.isfunction(obj):
+            if is_async_model(model):
+                raise TypeError(
+                    "Asynchronous models can only be used to decorate async functions"
+                )
 
             def wrapper(*args: Any, **kwargs: Any) -> Any:
                 try:
                     return obj(*args, **kwargs)
                 except Exception as e:
+                    # Exceptions already handled by an inner wrapper, as in recursive functions,
+                    # propagate unchanged
+                    if getattr(e, "_is_stack_traced", False):
+                        raise
+
                     # Capture the stack trace
                     stack_trace = traceback.format_exc()
 
+                    # Explain in the background without delaying the original exception
+                    if deferred is not None:
+                        deferred.submit(e)
+                        e._is_stack_traced = True  # type: ignore[attr-defined]
+                        raise
+
                     # If an LLM function is provided, pass the stack trace to it
                     if model:
-                        prompt = format_stack_trace(stack_trace)
-                        summary = textwrap.dedent(model.generate(prompt))
+                        key = explanations.key(e)
+                        summary = explanations.get(key)
+
+                        if summary is None:
+                            prompt = format_stack_trace(compactor.compact(e))
+
+                            def explain() -> str:
+                                summary = textwrap.dedent(
+                                    generate_with(model, prompt, STACK_TRACE_OPTIONS)
+                                )
+                                explanations.set(key, summary)
+                                return summary
+
+                            # Concurrent occurrences of an error share one explanation
+                            summary = single_flight.do(("stack_trace", key), explain)
+
                         new_exception_message = f"{stack_trace}\n{summary}"
 
                         # Raise a new exception with the modified message
-                        raise Exception(new_exception_message) from None
+                        exception = Exception(new_exception_message)
+                        exception._is_stack_traced = True  # type: ignore[attr-defined]
+                        raise exception from None
                     else:
                         # If no LLM function is provided, just re-raise the original exception
                         raise e from None
 
             # Add a special attribute to the wrapper to indicate it has access to a generative model
-            wrapper._is_generative = model is not None  # type: ignore[attr-defined]
+            wrapper._is_generative = (  # type: ignore[attr-defined]
+                model is not None or deferred is not None
+            )
 
             return wrapper
         else:
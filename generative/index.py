@@ -0,0 +1,486 @@
+import re
+import ast
+import math
+import keyword
+import inspect
+import textwrap
+import threading
+import weakref
+from collections import Counter
+from types import FunctionType
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
+
+from .utils import GENERATIVE_DECORATORS, count_tokens, decorator_name, hash_source
+
+# Defaults for how much of a class is offered to a model as context
+MAX_CONTEXT_FUNCTIONS = 8
+MAX_CONTEXT_TOKENS = 2000
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_DEF_NAME = re.compile(r"def\s+(\w+)")
+_WORD = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+_IGNORED_TERMS = frozenset(keyword.kwlist) | {"self", "cls", "none", "true", "false"}
+
+"""
+Return a cheap fingerprint of the functions visible on a class.
+
+The fingerprint changes whenever a function is added to, removed from or replaced on the class
+or any of its bases, which is when prompts built from the class need to be rebuilt.
+
+Args:
+    cls (type): The class to fingerprint.
+
+Returns:
+    tuple: Names and object ids of every function defined along the class's MRO.
+"""
+
+
+def class_signature(cls: Type[Any]) -> Tuple[Hashable, ...]:
+    return tuple(
+        (name, id(value))
+        for klass in cls.__mro__
+        # Built-in types define no Python functions and cannot be changed, so they are skipped
+        if klass.__module__ != "builtins"
+        for name, value in vars(klass).items()
+        # Same test as inspect.isfunction, without a call per attribute
+        if isinstance(value, FunctionType)
+    )
+
+
+"""
+Split source text into lowercase identifier terms for relevance ranking.
+
+Identifiers are split on underscores and camel case, so `set_target` and `setTarget` both yield
+"set" and "target". Keywords and names such as `self` carry no meaning and are dropped.
+
+Args:
+    texts (str): Source code, names or prose.
+
+Returns:
+    Counter: Occurrences of each term.
+"""
+
+
+def identifier_terms(*texts: str) -> "Counter[str]":
+    terms: "Counter[str]" = Counter()
+
+    for text in texts:
+        for identifier in _IDENTIFIER.findall(text):
+            if identifier.lower() in _IGNORED_TERMS:
+                continue
+
+            for word in _WORD.findall(identifier):
+                word = word.lower()
+                if len(word) > 1 and word not in _IGNORED_TERMS:
+                    terms[word] += 1
+
+    return terms
+
+
+"""
+A function offered to a model as context.
+
+Attributes:
+    name (str): Name the function is reachable under.
+    signature (str): The function's header, e.g. "def add(self, a, b)".
+    docstring (str): The function's docstring, or "".
+    source (str): The function's dedented source, or its signature if the source is unavailable.
+    tokens (int): Estimated number of tokens in `source`.
+"""
+
+
+class IndexedFunction(NamedTuple):
+    name: str
+    signature: str
+    docstring: str
+    source: str
+    tokens: int
+
+
+def _format_arguments(arguments: ast.arguments, source: str) -> str:
+    if hasattr(ast, "unparse"):
+        return ast.unparse(arguments)
+
+    # Python 3.8 cannot unparse, so the arguments are pieced together from their source
+    def describe(
+        argument: ast.arg, default: Optional[ast.expr] = None, prefix: str = ""
+    ) -> str:
+        text = prefix + argument.arg
+        if argument.annotation is not None:
+            text += f": {ast.get_source_segment(source, argument.annotation)}"
+        if default is not None:
+            text += f"={ast.get_source_segment(source, default)}"
+        return text
+
+    positional = arguments.posonlyargs + arguments.args
+    defaults: List[Optional[ast.expr]] = [None] * (
+        len(positional) - len(arguments.defaults)
+    )
+    defaults += arguments.defaults
+
+    parts = []
+    for position, (argument, default) in enumerate(zip(positional, defaults)):
+        parts.append(describe(argument, default))
+        if position == len(arguments.posonlyargs) - 1:
+            parts.append("/")
+
+    if arguments.vararg is not None:
+        parts.append(describe(arguments.vararg, prefix="*"))
+    elif arguments.kwonlyargs:
+        parts.append("*")
+
+    for argument, default in zip(arguments.kwonlyargs, arguments.kw_defaults):
+        parts.append(describe(argument, default))
+
+    if arguments.kwarg is not None:
+        parts.append(describe(arguments.kwarg, prefix="**"))
+
+    return ", ".join(parts)
+
+
+def _index_source(name: str, source: str) -> IndexedFunction:
+    source = textwrap.dedent(source)
+    signature = f"def {name}(...)"
+    docstring = ""
+
+    try:
+        node = ast.parse(source).body[0]
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            signature = f"def {name}({_format_arguments(node.args, source)})"
+            docstring = ast.get_docstring(node) or ""
+
+            # Decorators of this package say nothing about what the function does
+            dropped = {
+                row
+                for decorator in node.decorator_list
+                if decorator_name(decorator) in GENERATIVE_DECORATORS
+                for row in range(decorator.lineno - 1, decorator.end_lineno or 0)
+            }
+            if dropped:
+                lines = source.splitlines(keepends=True)
+                source = "".join(
+                    line for row, line in enumerate(lines) if row not in dropped
+                )
+    except (SyntaxError, IndexError):
+        pass
+
+    return IndexedFunction(name, signature, docstring, source, count_tokens(source))
+
+
+"""
+Describe a function, or the source code of one, for use as context in prompts.
+
+Functions decorated with `adapt`, `catch` or `functools.wraps` are described by the function they
+wrap, without the decorators of this package.
+
+Args:
+    name (str): Name the function is reachable under.
+    function (Callable | str): The function, or its source code.
+
+Returns:
+    IndexedFunction: The function's signature, docstring, dedented source and token count.
+"""
+
+
+def _unwrap(function: Callable[..., Any]) -> Callable[..., Any]:
+    # Functions decorated with adapt or catch expose the original function through their
+    # GenerationContext; other decorators through functools.wraps
+    context = getattr(function, "_context", None)
+    original = getattr(context, "func", None)
+    if original is not None:
+        return original
+
+    try:
+        return inspect.unwrap(function)
+    except ValueError:
+        return function
+
+
+def index_function(
+    name: str, function: Union[Callable[..., Any], str]
+) -> IndexedFunction:
+    if isinstance(function, str):
+        return _index_source(name, function)
+
+    function = _unwrap(function)
+
+    try:
+        return _index_source(name, inspect.getsource(function))
+    except (TypeError, OSError):
+        pass
+
+    try:
+        signature = f"def {name}{inspect.signature(function)}"
+    except (TypeError, ValueError):
+        signature = f"def {name}(...)"
+
+    docstring = inspect.getdoc(function) or ""
+    return IndexedFunction(
+        name, signature, docstring, signature, count_tokens(signature)
+    )
+
+
+"""
+The functions of a class, described once for use as context in prompts.
+
+Building the index reads the source of every function on the class. Prompts are then built from
+the index without further reflection. Functions added later, for example through
+`GenerativeMetaClass.generate`, are added to the index individually with `add`.
+
+Args:
+    cls (type): The class to index.
+
+Attributes:
+    signature (tuple): `class_signature` of the class when the index was built.
+"""
+
+
+class ClassContextIndex:
+    def __init__(self, cls: Type[Any]) -> None:
+        self.signature = class_signature(cls)
+        self._lock = threading.Lock()
+        self._hash: Union[str, None] = None
+        self._added: Tuple[str, ...] = ()
+        self._terms: Dict[str, Tuple[IndexedFunction, "Counter[str]"]] = {}
+        self._entries: Dict[str, IndexedFunction] = {
+            name: index_function(name, function)
+            for name, function in inspect.getmembers(cls, predicate=inspect.isfunction)
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def entries(self) -> List[IndexedFunction]:
+        """
+        Returns the indexed functions, ordered by name.
+        """
+        return [self._entries[name] for name in sorted(self._entries)]
+
+    def add(
+        self,
+        name: str,
+        function: Union[Callable[..., Any], str],
+        cls: Optional[Type[Any]] = None,
+    ) -> IndexedFunction:
+        """
+        Adds or replaces a single function.
+
+        :param name: Name the function is reachable under.
+        :param function: The function, or its source code.
+        :param cls: The indexed class, if the function was just set on it. The index then takes
+            on the class's new signature, so the change does not cause `context_index` to
+            rebuild the index.
+        :return: The indexed function.
+        """
+        entry = index_function(name, function)
+
+        with self._lock:
+            # Entries are replaced as a whole so readers never see a partial update
+            self._entries = {**self._entries, name: entry}
+            self._added = tuple(dict.fromkeys(self._added + (name,)))
+            self._hash = None
+
+            if cls is not None:
+                self.signature = class_signature(cls)
+
+        return entry
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            entries = dict(self._entries)
+            entries.pop(name, None)
+            self._entries = entries
+            self._added = tuple(added for added in self._added if added != name)
+            self._hash = None
+
+    def tokens(self) -> int:
+        """
+        Returns the estimated number of tokens in the source of every indexed function.
+        """
+        return sum(entry.tokens for entry in self._entries.values())
+
+    def terms(self, name: str) -> "Counter[str]":
+        """
+        Returns the identifier terms of an indexed function, computed once per function.
+
+        :param name: Name of the indexed function.
+        :return: Term counts of the function's name, signature, docstring and source.
+        """
+        entry = self._entries[name]
+        terms = self._terms.get(name)
+
+        if terms is None or terms[0] is not entry:
+            terms = (entry, identifier_terms(entry.name, entry.docstring, entry.source))
+            self._terms[name] = terms
+
+        return terms[1]
+
+    def context_hash(self) -> str:
+        """
+        Returns a content hash that changes whenever a function is added, removed or changed.
+        """
+        if self._hash is None:
+            self._hash = hash_source(
+                "\0".join(f"{entry.name}\n{entry.source}" for entry in self.entries())
+            )
+
+        return self._hash
+
+
+_indexes: "weakref.WeakKeyDictionary[type, ClassContextIndex]" = (
+    weakref.WeakKeyDictionary()
+)
+_indexes_lock = threading.Lock()
+
+
+"""
+Return the context index of a class, building it on first use.
+
+The index is stored on the class itself, or alongside it for classes that do not accept new
+attributes. It is rebuilt when functions are added to, removed from or replaced on the class;
+functions added to the index with `ClassContextIndex.add` are carried over.
+
+Args:
+    cls (type): The class to index.
+
+Returns:
+    ClassContextIndex: The class's index.
+"""
+
+
+def context_index(cls: Type[Any]) -> ClassContextIndex:
+    index = cls.__dict__.get("_context_index")
+    if index is None:
+        index = _indexes.get(cls)
+    signature = class_signature(cls)
+
+    if index is not None and index.signature == signature:
+        return index
+
+    with _indexes_lock:
+        rebuilt = ClassContextIndex(cls)
+
+        if index is not None:
+            # Keep functions that were added to the index individually
+            for name in index._added:
+                if name in index._entries and name not in rebuilt._entries:
+                    rebuilt._entries[name] = index._entries[name]
+            rebuilt._added = index._added
+
+        try:
+            setattr(cls, "_context_index", rebuilt)
+        except (AttributeError, TypeError):
+            _indexes[cls] = rebuilt
+
+    return rebuilt
+
+
+"""
+Context functions chosen for a prompt.
+
+Attributes:
+    full (list): Functions whose full source is included, most relevant first.
+    summaries (list): Remaining functions, described by their signature only.
+"""
+
+
+class ContextSelection(NamedTuple):
+    full: List[IndexedFunction]
+    summaries: List[IndexedFunction]
+
+
+"""
+Choose the context functions most relevant to the code being generated.
+
+Functions are ranked by TF-IDF cosine similarity between their identifier terms and those of the
+target (its name, parameters and body), with a bonus for functions the target calls by name. The
+highest ranked functions are included in full while they fit within `max_tokens`, up to
+`top_k` of them; the rest are summarized by their signatures.
+
+Args:
+    context (ClassContextIndex | list): An index or a list of `IndexedFunction`.
+    target (str): Source code, or name and parameters, of the function being generated. A
+        function defined by `target` is left out of its own context.
+    top_k (int, optional): Maximum number of functions included in full.
+    max_tokens (int, optional): Token budget for the functions included in full.
+
+Returns:
+    ContextSelection: The functions to include in full and the functions to summarize.
+"""
+
+
+def select_context(
+    context: Union[ClassContextIndex, Iterable[IndexedFunction]],
+    target: str,
+    top_k: int = MAX_CONTEXT_FUNCTIONS,
+    max_tokens: int = MAX_CONTEXT_TOKENS,
+) -> ContextSelection:
+    match = _DEF_NAME.search(target)
+    own_name = match.group(1) if match else None
+
+    if isinstance(context, ClassContextIndex):
+        entries = [entry for entry in context.entries() if entry.name != own_name]
+        documents = [context.terms(entry.name) for entry in entries]
+    else:
+        entries = [entry for entry in context if entry.name != own_name]
+        documents = [
+            identifier_terms(entry.name, entry.docstring, entry.source)
+            for entry in entries
+        ]
+
+    if sum(entry.tokens for entry in entries) <= max_tokens and len(entries) <= top_k:
+        return ContextSelection(entries, [])
+
+    frequencies: "Counter[str]" = Counter()
+    for document in documents:
+        frequencies.update(document.keys())
+
+    def weigh(terms: "Counter[str]") -> Dict[str, float]:
+        return {
+            term: count * (math.log((len(entries) + 1) / (frequencies[term] + 1)) + 1)
+            for term, count in terms.items()
+            if term in frequencies
+        }
+
+    query = weigh(identifier_terms(target))
+    query_norm = math.sqrt(sum(weight * weight for weight in query.values())) or 1.0
+    # The target's own name is not a call to another function
+    called = set(_IDENTIFIER.findall(target)) - {own_name}
+
+    scores = []
+    for position, (entry, document) in enumerate(zip(entries, documents)):
+        weights = weigh(document)
+        norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+        dot = sum(weight * weights.get(term, 0.0) for term, weight in query.items())
+        score = dot / (norm * query_norm) + (1.0 if entry.name in called else 0.0)
+        scores.append((-score, position))
+
+    full: List[IndexedFunction] = []
+    summaries: List[IndexedFunction] = []
+    used = 0
+
+    for _, position in sorted(scores):
+        entry = entries[position]
+
+        if len(full) < top_k and used + entry.tokens <= max_tokens:
+            full.append(entry)
+            used += entry.tokens
+        else:
+            summaries.append(entry)
+
+    return ContextSelection(full, summaries)
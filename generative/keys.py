@@ -0,0 +1,150 @@
+import sys
+import hashlib
+from typing import Any, Dict, Tuple
+
+from .metaclasses import AbstractKeyPolicy
+
+"""
+Keys every call to a function the same way, so all calls share one generated implementation.
+
+This is the default policy. It does no work proportional to the size of the arguments.
+"""
+
+
+class FunctionKeyPolicy(AbstractKeyPolicy):
+    def key(self, func_name: str, args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> str:
+        return func_name
+
+
+"""
+Return a short description of an argument's type and shape, without reading its contents.
+
+Arrays and data frames are described by their shape and dtype(s), sized containers by their
+length, and everything else by its type alone.
+
+Args:
+    value (Any): An argument value.
+
+Returns:
+    str: The description.
+"""
+
+
+def describe_shape(value: Any) -> str:
+    kind = type(value)
+    description = f"{kind.__module__}.{kind.__qualname__}"
+
+    shape = getattr(value, "shape", None)
+    if isinstance(shape, tuple):
+        description += f"{list(shape)}"
+
+        dtype = getattr(value, "dtype", None)
+        if dtype is None:
+            dtype = getattr(value, "dtypes", None)
+        if dtype is not None:
+            description += f":{dtype!s}".replace("\n", ",")
+
+    elif hasattr(value, "__len__") and not isinstance(value, (str, bytes)):
+        try:
+            description += f"[{len(value)}]"
+        except TypeError:
+            pass
+
+    return description
+
+
+"""
+Keys calls by the types and shapes of their arguments.
+
+Calls with arguments of the same types and shapes share a generated implementation. Building the
+key does not depend on the size of the arguments' contents.
+"""
+
+
+class ShapeKeyPolicy(AbstractKeyPolicy):
+    def key(self, func_name: str, args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+
+        for value in args:
+            digest.update(describe_shape(value).encode("utf-8"))
+            digest.update(b"\x00")
+
+        for name in sorted(kwargs):
+            digest.update(f"{name}=".encode("utf-8"))
+            digest.update(describe_shape(kwargs[name]).encode("utf-8"))
+            digest.update(b"\x00")
+
+        return f"{func_name}:{digest.hexdigest()}"
+
+
+def _update_digest(digest: Any, value: Any) -> None:
+    kind = type(value)
+    digest.update(f"{kind.__module__}.{kind.__qualname__}:".encode("utf-8"))
+
+    if value is None or isinstance(value, (bool, int, float, complex)):
+        digest.update(repr(value).encode("utf-8"))
+    elif isinstance(value, str):
+        digest.update(value.encode("utf-8"))
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        digest.update(value)
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{len(value)}[".encode("utf-8"))
+        for item in value:
+            _update_digest(digest, item)
+        digest.update(b"]")
+    elif isinstance(value, dict):
+        # Dictionaries that compare equal hash equally regardless of insertion order
+        items = sorted(
+            (_value_digest(key), _value_digest(item)) for key, item in value.items()
+        )
+        digest.update(f"{len(items)}{{".encode("utf-8"))
+        for key_digest, item_digest in items:
+            digest.update(key_digest)
+            digest.update(item_digest)
+        digest.update(b"}")
+    elif isinstance(value, (set, frozenset)):
+        for item_digest in sorted(_value_digest(item) for item in value):
+            digest.update(item_digest)
+    elif kind.__module__.split(".")[0] == "pandas" and "pandas" in sys.modules:
+        pandas = sys.modules["pandas"]
+        digest.update(describe_shape(value).encode("utf-8"))
+        digest.update(memoryview(pandas.util.hash_pandas_object(value).to_numpy()))
+    elif hasattr(value, "tobytes") and hasattr(value, "shape"):
+        # Array-likes such as NumPy arrays are hashed from their buffer without a copy when
+        # they are contiguous
+        digest.update(describe_shape(value).encode("utf-8"))
+        if getattr(getattr(value, "dtype", None), "kind", None) == "O":
+            # Object arrays hold pointers, so hash the objects they refer to
+            _update_digest(digest, value.tolist())
+        else:
+            try:
+                digest.update(memoryview(value).cast("B"))
+            except (TypeError, ValueError):
+                digest.update(value.tobytes())
+    else:
+        digest.update(repr(value).encode("utf-8"))
+
+
+def _value_digest(value: Any) -> bytes:
+    digest = hashlib.blake2b(digest_size=16)
+    _update_digest(digest, value)
+    return digest.digest()
+
+
+"""
+Keys calls by the full values of their arguments.
+
+Values are fed into a streaming BLAKE2 digest in a canonical form: dictionaries and sets hash the
+same regardless of ordering, and array buffers are hashed without being converted to strings.
+Every distinct input gets its own generated implementation, so this policy is best reserved for
+functions whose generated code genuinely depends on the input.
+"""
+
+
+class ValueKeyPolicy(AbstractKeyPolicy):
+    def key(self, func_name: str, args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        _update_digest(digest, args)
+        _update_digest(digest, kwargs)
+
+        return f"{func_name}:{digest.hexdigest()}"
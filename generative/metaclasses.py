@@ -1,7 +1,10 @@
 from abc import ABC, abstractmethod
 from typing import (
     Any,
+    AsyncIterator,
     Dict,
+    Iterator,
+    NamedTuple,
     Optional,
     Tuple,
     Type,
@@ -11,8 +14,11 @@ from .utils import (
     extract_func_name,
     is_valid_syntax,
     clean_function,
+    hash_source,
 )
 
+from .index import context_index
+
 """
 This is an abstract base class that represents a database API.
 
@@ -69,6 +75,33 @@ class AbstractDatabase(ABC):
         pass
 
 
+"""
+This is an abstract base class that represents a policy for building database keys from calls.
+
+Decorators use the key to look up and store generated code, and to decide which calls share a
+generated implementation. Implementations live in `generative.keys`.
+
+Subclasses must implement the following methods:
+
+key(self, func_name: str, args: tuple, kwargs: dict) -> str:
+    Builds the key for a call.
+"""
+
+
+class AbstractKeyPolicy(ABC):
+    @abstractmethod
+    def key(self, func_name: str, args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> str:
+        """
+        Builds the key for a call.
+
+        :param func_name: Name of the decorated function.
+        :param args: Positional arguments of the call.
+        :param kwargs: Keyword arguments of the call.
+        :return: Key identifying calls that share generated code.
+        """
+        pass
+
+
 """Exception raised for database-related errors."""
 
 
@@ -76,6 +109,24 @@ class DatabaseException(Exception):
     pass
 
 
+"""
+Per-call settings for a generation, passed to models that accept them.
+
+Fields left as None, or an empty `stop`, leave the model's own defaults in place.
+
+Attributes:
+    max_tokens (int, optional): Maximum number of tokens to generate.
+    stop (tuple): Sequences that end the generation when the model produces them.
+    temperature (float, optional): Sampling temperature.
+"""
+
+
+class GenerationOptions(NamedTuple):
+    max_tokens: Optional[int] = None
+    stop: Tuple[str, ...] = ()
+    temperature: Optional[float] = None
+
+
 """
 This is an abstract base class that represents a generative text model.
 
@@ -86,6 +137,14 @@ Subclasses must implement the following methods:
 
 generate(self, prompt: str) -> str:
     Generates code from a prompt.
+
+`generate` may also take an `options` argument. Models that do are passed the `GenerationOptions`
+chosen by the caller, e.g. a small `max_tokens` for the critic and an "### END FUNCTION ###" stop
+sequence for code generation. Models that do not are called with the prompt alone.
+
+Prompts built by `generative.prompt` are `PromptParts`: strings that also expose a static
+`prefix` and a call-specific `suffix`. Models backed by providers with prompt caching can send the
+prefix separately, e.g. as a system prompt, using `generative.prompt.split_prompt`.
 """
 
 
@@ -101,6 +160,98 @@ class AbstractGenerativeModel(ABC):
         pass
 
 
+"""
+This is an abstract base class that represents an asynchronous generative text model.
+
+Developers can extend this class to implement model classes backed by asynchronous clients, so
+that awaiting a generation does not block the event loop. Synchronous models can be used where an
+asynchronous model is expected by wrapping them in `generative.models.AsyncModelAdapter`.
+
+Subclasses must implement the following methods:
+
+agenerate(self, prompt: str) -> str:
+    Generates code from a prompt without blocking the event loop.
+
+Like `AbstractGenerativeModel.generate`, `agenerate` may also take an `options` argument.
+"""
+
+
+class AbstractAsyncGenerativeModel(ABC):
+    @abstractmethod
+    async def agenerate(cls, prompt: str) -> str:
+        """
+        Generates code from a prompt without blocking the event loop.
+
+        :param prompt: The prompt to generate code from.
+        :return: The generated code.
+        """
+        pass
+
+
+"""
+This is an abstract base class that represents a generative text model that streams its output.
+
+Code generation reads a streamed completion only until the generated function is complete and
+then closes the stream, so the rest of the completion, such as an explanation or a call to the
+function, is never waited for. Implementations should cancel the underlying request when their
+generator is closed. `generate` is provided and joins the whole stream.
+
+Subclasses must implement the following methods:
+
+stream(self, prompt: str, options: Optional[GenerationOptions] = None) -> Iterator[str]:
+    Yields pieces of the completion as they are generated.
+"""
+
+
+class AbstractStreamingGenerativeModel(AbstractGenerativeModel):
+    @abstractmethod
+    def stream(
+        self, prompt: str, options: Optional[GenerationOptions] = None
+    ) -> Iterator[str]:
+        """
+        Yields pieces of the completion for a prompt as they are generated.
+
+        :param prompt: The prompt to generate code from.
+        :param options: Settings for this call.
+        :return: An iterator over pieces of the completion.
+        """
+        pass
+
+    def generate(self, prompt: str, options: Optional[GenerationOptions] = None) -> str:
+        return "".join(self.stream(prompt, options))
+
+
+"""
+This is an abstract base class that represents an asynchronous generative text model that streams
+its output.
+
+Subclasses must implement the following methods:
+
+astream(self, prompt: str, options: Optional[GenerationOptions] = None) -> AsyncIterator[str]:
+    Yields pieces of the completion as they are generated, without blocking the event loop.
+"""
+
+
+class AbstractAsyncStreamingGenerativeModel(AbstractAsyncGenerativeModel):
+    @abstractmethod
+    def astream(
+        self, prompt: str, options: Optional[GenerationOptions] = None
+    ) -> AsyncIterator[str]:
+        """
+        Yields pieces of the completion for a prompt as they are generated.
+
+        :param prompt: The prompt to generate code from.
+        :param options: Settings for this call.
+        :return: An asynchronous iterator over pieces of the completion.
+        """
+        pass
+
+    async def agenerate(
+        self, prompt: str, options: Optional[GenerationOptions] = None
+    ) -> str:
+        return "".join([chunk async for chunk in self.astream(prompt, options)])
+
+
 """
 BaseMetaClass is a metaclass that defines a single attribute: is_generative.
 
@@ -176,16 +327,24 @@ class GenerativeMetaClass(BaseMetaClass):
 
             if database:
                 try:
-                    capability = str(
-                        {
-                            "args": {},
-                            "kwargs": {},
-                        }
+                    # Records are versioned by the method's source and its class context, like
+                    # the records of `adapt`. The code is given, so it is only recorded, never
+                    # looked up.
+                    cls = self if isinstance(self, type) else type(self)
+                    source_hash = hash_source(code)
+                    context_hash = context_index(cls).context_hash()
+                    capability = {
+                        "function_name": func_name,
+                        "source_hash": source_hash,
+                        "context_hash": context_hash,
+                        "args": {},
+                        "kwargs": {},
+                        "generated_code": code,
+                    }
+                    database.set(
+                        f"{func_name}:{source_hash[:16]}:{context_hash[:16]}",
+                        capability,
                     )
-                    if not database.contains(capability):
-                        database.set(func_name, capability)
-                    else:
-                        code = database.get(capability)
                 except Exception as e:
                     raise DatabaseException(
                         "An error occurred while adding to the database"
@@ -193,6 +352,16 @@ class GenerativeMetaClass(BaseMetaClass):
 
             byte_code = compile(code, filename=func_name, mode="exec")
             exec(byte_code, {}, local_vars)
+
+            if not isinstance(self, type):
+                # Only this instance has the method, so other instances' prompts must not
+                # offer it
+                setattr(self, func_name, local_vars[func_name])
+                return
+
+            # Offer the new method as context to later generations without re-indexing the class
+            index = context_index(self)
             setattr(self, func_name, local_vars[func_name])
+            index.add(func_name, code, cls=self)
 
         return generate
@@ -0,0 +1,390 @@
+import time
+import asyncio
+import inspect
+import functools
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from .metaclasses import AbstractAsyncGenerativeModel, GenerationOptions
+from .utils import (
+    IrrecoverableSyntaxError,
+    acollect_function,
+    collect_function,
+    count_tokens,
+)
+
+# Synchronous model calls spend almost all of their time waiting on the network, so the shared
+# executor is sized for many generations in flight rather than for CPU count.
+DEFAULT_MAX_WORKERS = 256
+
+_default_executor: Optional[ThreadPoolExecutor] = None
+_default_executor_lock = threading.Lock()
+
+
+"""
+Return the process-wide executor used to run synchronous models from asynchronous code.
+
+Returns:
+    ThreadPoolExecutor: The shared executor, created on first use.
+"""
+
+
+def default_executor() -> ThreadPoolExecutor:
+    global _default_executor
+
+    if _default_executor is None:
+        with _default_executor_lock:
+            if _default_executor is None:
+                _default_executor = ThreadPoolExecutor(
+                    max_workers=DEFAULT_MAX_WORKERS, thread_name_prefix="generative"
+                )
+
+    return _default_executor
+
+
+# Code generation stops at the end marker the prompts ask for, so nothing after the function is
+# generated or paid for
+CODE_GENERATION_OPTIONS = GenerationOptions(
+    max_tokens=1024, stop=("### END FUNCTION ###",)
+)
+
+# The critic's answer is parsed for a single "True" or "False"
+CRITIC_OPTIONS = GenerationOptions(max_tokens=5, temperature=0.0)
+
+# A summary and a short numbered list of suggestions
+STACK_TRACE_OPTIONS = GenerationOptions(max_tokens=512)
+
+# How many more times a streamed generation is started after one is aborted for its syntax
+STREAM_RETRIES = 2
+
+
+# Bounded so that the functions it has seen, such as those of short-lived model classes or mocks,
+# are not kept alive forever
+@functools.lru_cache(maxsize=256)
+def _accepts_options(method: Callable[..., Any]) -> bool:
+    try:
+        parameter = inspect.signature(method).parameters.get("options")
+    except (TypeError, ValueError):
+        return False
+
+    # `**kwargs` is often forwarded to a client that would not expect `options`
+    return parameter is not None and parameter.kind in (
+        parameter.POSITIONAL_OR_KEYWORD,
+        parameter.KEYWORD_ONLY,
+    )
+
+
+def _options_kwargs(
+    method: Callable[..., Any], options: Optional[GenerationOptions]
+) -> Dict[str, Any]:
+    # Bound methods are recreated on every attribute access, so the signature is cached by
+    # the underlying function
+    if options is None or not _accepts_options(getattr(method, "__func__", method)):
+        return {}
+    return {"options": options}
+
+
+"""
+Generate text with a model, passing generation options if the model accepts them.
+
+Models whose `generate` has an explicit `options` parameter receive `options`. Other models,
+including those that only take `**kwargs`, are called with the prompt alone, so existing models
+keep working.
+
+Args:
+    model (AbstractGenerativeModel): A synchronous model class or instance.
+    prompt (str): The prompt.
+    options (GenerationOptions, optional): Settings for this call.
+
+Returns:
+    str: The generated text.
+"""
+
+
+def generate_with(
+    model: Any, prompt: str, options: Optional[GenerationOptions] = None
+) -> str:
+    return model.generate(prompt, **_options_kwargs(model.generate, options))
+
+
+"""
+Asynchronous counterpart of `generate_with`, for models implementing `agenerate`.
+
+Args:
+    model (AbstractAsyncGenerativeModel): An asynchronous model class or instance.
+    prompt (str): The prompt.
+    options (GenerationOptions, optional): Settings for this call.
+
+Returns:
+    str: The generated text.
+"""
+
+
+async def agenerate_with(
+    model: Any, prompt: str, options: Optional[GenerationOptions] = None
+) -> str:
+    return await model.agenerate(prompt, **_options_kwargs(model.agenerate, options))
+
+
+"""
+Counts streamed code generations and the time saved by aborting doomed ones.
+
+The time saved by an abort is estimated from the average length of completed streams: the tokens
+the aborted stream would still have produced, at the rate it was producing them. No time is
+counted as saved until a stream has completed.
+"""
+
+
+class StreamMetrics:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.clear()
+
+    def record_completion(self, completion: str, seconds: float) -> None:
+        """
+        Records a stream that was read to the end of its function.
+
+        :param completion: The completion that was read.
+        :param seconds: Time spent reading it.
+        """
+        with self._lock:
+            self._completed += 1
+            self._completed_tokens += count_tokens(completion)
+            self._seconds += seconds
+
+    def record_abort(self, completion: str, seconds: float, retried: bool) -> None:
+        """
+        Records a stream that was aborted because of an irrecoverable syntax error.
+
+        :param completion: The completion read before the abort.
+        :param seconds: Time spent reading it.
+        :param retried: Whether the generation was started again.
+        """
+        tokens = count_tokens(completion)
+
+        with self._lock:
+            self._aborted += 1
+            self._retries += int(retried)
+            self._aborted_tokens += tokens
+            self._seconds += seconds
+
+            if self._completed and tokens:
+                expected = self._completed_tokens / self._completed
+                self._seconds_saved += max(expected - tokens, 0) * seconds / tokens
+
+    def clear(self) -> None:
+        with self._lock:
+            self._completed = 0
+            self._aborted = 0
+            self._retries = 0
+            self._completed_tokens = 0
+            self._aborted_tokens = 0
+            self._seconds = 0.0
+            self._seconds_saved = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns counts of completed and aborted streams, retries, tokens read, time spent reading
+        and the estimated time saved by aborting.
+        """
+        with self._lock:
+            return {
+                "completed": self._completed,
+                "aborted": self._aborted,
+                "retries": self._retries,
+                "tokens": self._completed_tokens + self._aborted_tokens,
+                "seconds": self._seconds,
+                "seconds_saved": self._seconds_saved,
+            }
+
+
+# Process-wide metrics shared by code generations that are not given their own
+stream_metrics = StreamMetrics()
+
+
+"""
+Generate a function with a model, reading a streamed completion only as far as needed.
+
+Models with a `stream` method, such as `AbstractStreamingGenerativeModel`, are read until the
+function is complete, as detected by `utils.FunctionStreamParser`, and the stream is then closed.
+A stream is also closed as soon as the function has a syntax error no continuation can fix, and
+the generation is started again, up to `retries` times. Other models are called through
+`generate_with`.
+
+Args:
+    model (AbstractGenerativeModel): A synchronous model class or instance.
+    prompt (str): The prompt.
+    options (GenerationOptions, optional): Settings for this call.
+    retries (int, optional): Generations started again after an aborted stream.
+    metrics (StreamMetrics, optional): Records completed and aborted streams. Defaults to the
+        process-wide `stream_metrics`.
+
+Returns:
+    str: The completion up to the end of the generated function. If every stream was aborted,
+        the last partial completion, which fails syntax validation downstream.
+"""
+
+
+def generate_code(
+    model: Any,
+    prompt: str,
+    options: Optional[GenerationOptions] = None,
+    retries: int = STREAM_RETRIES,
+    metrics: Optional[StreamMetrics] = None,
+) -> str:
+    stream = getattr(model, "stream", None)
+    if not callable(stream):
+        return generate_with(model, prompt, options)
+
+    if metrics is None:
+        metrics = stream_metrics
+
+    completion = ""
+    for attempt in range(retries + 1):
+        start = time.perf_counter()
+        try:
+            chunks = stream(prompt, **_options_kwargs(stream, options))
+            completion = collect_function(chunks, check_syntax=True)
+        except IrrecoverableSyntaxError as e:
+            completion = e.completion
+            metrics.record_abort(
+                completion, time.perf_counter() - start, attempt < retries
+            )
+            continue
+
+        metrics.record_completion(completion, time.perf_counter() - start)
+        return completion
+
+    return completion
+
+
+"""
+Asynchronous counterpart of `generate_code`.
+
+Models with an `astream` method are read until the function is complete or doomed. Synchronous
+streaming models wrapped in an `AsyncModelAdapter` are read the same way on the adapter's
+executor.
+
+Args:
+    model (AbstractAsyncGenerativeModel): An asynchronous model class or instance.
+    prompt (str): The prompt.
+    options (GenerationOptions, optional): Settings for this call.
+    retries (int, optional): Generations started again after an aborted stream.
+    metrics (StreamMetrics, optional): Records completed and aborted streams. Defaults to the
+        process-wide `stream_metrics`.
+
+Returns:
+    str: The completion up to the end of the generated function.
+"""
+
+
+async def agenerate_code(
+    model: Any,
+    prompt: str,
+    options: Optional[GenerationOptions] = None,
+    retries: int = STREAM_RETRIES,
+    metrics: Optional[StreamMetrics] = None,
+) -> str:
+    if metrics is None:
+        metrics = stream_metrics
+
+    if isinstance(model, AsyncModelAdapter) and callable(
+        getattr(model.model, "stream", None)
+    ):
+        loop = asyncio.get_running_loop()
+        executor = model.executor if model.executor is not None else default_executor()
+        return await loop.run_in_executor(
+            executor, generate_code, model.model, prompt, options, retries, metrics
+        )
+
+    astream = getattr(model, "astream", None)
+    if not callable(astream):
+        return await agenerate_with(model, prompt, options)
+
+    completion = ""
+    for attempt in range(retries + 1):
+        start = time.perf_counter()
+        try:
+            chunks = astream(prompt, **_options_kwargs(astream, options))
+            completion = await acollect_function(chunks, check_syntax=True)
+        except IrrecoverableSyntaxError as e:
+            completion = e.completion
+            metrics.record_abort(
+                completion, time.perf_counter() - start, attempt < retries
+            )
+            continue
+
+        metrics.record_completion(completion, time.perf_counter() - start)
+        return completion
+
+    return completion
+
+
+"""
+Determine whether a model can only be awaited.
+
+Args:
+    model (Any): A model class or instance.
+
+Returns:
+    bool: True if the model implements `agenerate` but not `generate`.
+"""
+
+
+def is_async_model(model: Any) -> bool:
+    return callable(getattr(model, "agenerate", None)) and not callable(
+        getattr(model, "generate", None)
+    )
+
+
+"""
+Adapts a synchronous `AbstractGenerativeModel` to the `AbstractAsyncGenerativeModel` interface.
+
+Each call to `agenerate` runs the wrapped model's blocking `generate` on an executor, so the event
+loop stays responsive while the request is in flight.
+
+Args:
+    model (AbstractGenerativeModel): The synchronous model class or instance to wrap.
+    executor (Executor, optional): Executor to run generations on. Defaults to the shared
+        executor returned by `default_executor()`.
+"""
+
+
+class AsyncModelAdapter(AbstractAsyncGenerativeModel):
+    def __init__(self, model: Any, executor: Optional[Executor] = None) -> None:
+        self.model = model
+        self.executor = executor
+
+    async def agenerate(
+        self, prompt: str, options: Optional[GenerationOptions] = None
+    ) -> str:
+        loop = asyncio.get_running_loop()
+        executor = self.executor if self.executor is not None else default_executor()
+        return await loop.run_in_executor(
+            executor, generate_with, self.model, prompt, options
+        )
+
+
+"""
+Return a model that can be awaited, wrapping synchronous models in an `AsyncModelAdapter`.
+
+Args:
+    model (Any, optional): A synchronous or asynchronous model class or instance.
+    executor (Executor, optional): Executor used if the model has to be adapted.
+
+Returns:
+    AbstractAsyncGenerativeModel: A model implementing `agenerate`, or None if no model was given.
+"""
+
+
+def as_async_model(
+    model: Any, executor: Optional[Executor] = None
+) -> Optional[AbstractAsyncGenerativeModel]:
+    if model is None:
+        return None
+
+    if callable(getattr(model, "agenerate", None)):
+        return model
+
+    return AsyncModelAdapter(model, executor=executor)
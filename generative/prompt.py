@@ -1,76 +1,131 @@
 import textwrap
-from typing import Any, List, Tuple
+from typing import Any, Sequence, Tuple, Union
 from . import rules
+from .utils import minify_source
+from .index import (
+    MAX_CONTEXT_FUNCTIONS,
+    MAX_CONTEXT_TOKENS,
+    ClassContextIndex,
+    IndexedFunction,
+    index_function,
+    select_context,
+)
+
+Context = Union[ClassContextIndex, Sequence[Any]]
+
+# Bump whenever a static prompt prefix changes, so prefixes cached by a provider under an old
+# version are not assumed to match
+PROMPT_VERSION = "1"
 
 """
-Prompt for generating entire functions
+A prompt made of a static prefix followed by the text specific to one call.
+
+The prefix holds instructions, rules and examples. It is built once per prompt kind and is byte
+identical across calls, so providers that cache prompt prefixes can reuse it. A `PromptParts`
+is a `str` of the whole prompt, so models that take a plain prompt keep working. Models that
+support structured prompts can read `prefix` and `suffix` to send the prefix as a separately
+cached system prompt; see `split_prompt`.
 
 Args:
-    code    (string): Source code fo function to be appended to prompt.
-    context (list):   List of tuples of available functions.
+    prefix (str): Static instructions, identical for every prompt of a kind.
+    suffix (str): Source code, context and other text specific to the call.
+    version (str): Kind and `PROMPT_VERSION` of the prefix, e.g. "generative_function/1".
+"""
+
+
+class PromptParts(str):
+    prefix: str
+    suffix: str
+    version: str
+
+    def __new__(cls, prefix: str, suffix: str, version: str = "") -> "PromptParts":
+        parts = super().__new__(cls, prefix + suffix)
+        parts.prefix = prefix
+        parts.suffix = suffix
+        parts.version = version
+        return parts
+
+    def __getnewargs__(self) -> Tuple[str, str, str]:  # type: ignore[override]
+        return self.prefix, self.suffix, self.version
+
 
-Returns:
-    Prompt for generating a function.
 """
+Split a prompt into its static prefix and the text specific to the call.
 
+Args:
+    prompt (str): A prompt, built by this module or not.
 
-def format_generative_function(code: str, context: List[Tuple[str, str]] = []) -> str:
-    return textwrap.dedent(
-        f"""
-    The given source code is potentially broken.
-    Please rewrite the function using the available functions.
+Returns:
+    tuple: The prefix and suffix of a `PromptParts`, or "" and the prompt for plain strings.
+"""
 
-    {rules.CODE_GENERATION_RULES}
 
-    For example, only do this:
-    ```
-    ### BEGIN FUNCTION ###
-    def func():
-    \t# function body
-    ### END FUNCTION ###
-    ```
-    and do not do this:
-    ```
-    ### BEGIN FUNCTION ###
-    def func():
-    \t# function body
-    ### END FUNCTION ###
-    return func()
-    ```
+def split_prompt(prompt: str) -> Tuple[str, str]:
+    if isinstance(prompt, PromptParts):
+        return prompt.prefix, prompt.suffix
+    return "", prompt
 
-    You can only use avaiable functions to generate code.
-    The functions are given in a list of tuples.
-    The first element is the function name.
-    The second element is the function source.
-    Available functions: {context}
 
-    Source code:
-    {code}
-    """
-    )
+def _summarize(entry: IndexedFunction) -> str:
+    if not entry.docstring:
+        return entry.signature
+    return f"{entry.signature}: {entry.docstring.splitlines()[0]}"
 
 
 """
-Prompt for generating entire functions
+Render the functions a model may call as readable source code.
+
+The functions most relevant to `target` are rendered in full, within `max_tokens` and up to
+`max_functions` of them. The remaining functions are listed by signature and the first line of
+their docstring.
 
 Args:
-    code    (string): Source code fo function to be appended to prompt.
-    kwargs  (Any): Parameters of function to be generated.
-    context (list, optional): List of tuples of available functions.
+    context (ClassContextIndex | list): An index of available functions, a list of
+        `IndexedFunction`, or a list of (name, source or function) tuples.
+    target (string, optional): Code the functions are offered for, used to rank them.
+    max_tokens (int, optional): Token budget for functions rendered in full.
+    max_functions (int, optional): Maximum number of functions rendered in full.
+    minify (bool, optional): Render functions without comments, docstrings or blank lines.
 
 Returns:
-    Prompt for generating a function.
+    The available functions, one source block each, followed by signature summaries.
 """
 
 
-def format_generative_function_from_input(
-    text: str, kwargs: Any, context: List[Tuple[str, str]] = []
+def format_available_functions(
+    context: Context,
+    target: str = "",
+    max_tokens: int = MAX_CONTEXT_TOKENS,
+    max_functions: int = MAX_CONTEXT_FUNCTIONS,
+    minify: bool = False,
 ) -> str:
-    kwargs = str(kwargs)
-    return textwrap.dedent(
-        f"""
-    {rules.CODE_GENERATION_RULES}
+    if not isinstance(context, ClassContextIndex):
+        context = [
+            entry if isinstance(entry, IndexedFunction) else index_function(*entry)
+            for entry in context
+        ]
+
+    full, summaries = select_context(context, target, max_functions, max_tokens)
+    if not full and not summaries:
+        return "There are no available functions."
+
+    text = "Available functions:"
+
+    if full:
+        sources = (
+            minify_source(entry.source) if minify else entry.source for entry in full
+        )
+        text += "\n\n" + "\n\n".join(source.strip() for source in sources)
+
+    if summaries:
+        lines = "\n".join(_summarize(entry) for entry in summaries)
+        text += f"\n\nOther available functions (signatures only):\n{lines}"
+
+    return text
 
+
+_EXAMPLES = textwrap.dedent(
+    """
     For example, only do this:
     ```
     ### BEGIN FUNCTION ###
@@ -87,31 +142,25 @@ def format_generative_function_from_input(
     return func()
     ```
 
-    You can only use avaiable functions to generate code.
-    The functions are given in a list of tuples.
-    The first element is the function name.
-    The second element is the function source.
-    Available functions: {context}
-
-    Generate a function name: {text} that takes the following parameters: {kwargs}
+    You can only use available functions to generate code.
     """
+)
+
+GENERATIVE_FUNCTION_PREFIX = (
+    textwrap.dedent(
+        """
+        The given source code is potentially broken.
+        Please rewrite the function using the available functions.
+        """
     )
+    + rules.CODE_GENERATION_RULES
+    + _EXAMPLES
+)
 
+GENERATIVE_FUNCTION_FROM_INPUT_PREFIX = rules.CODE_GENERATION_RULES + _EXAMPLES
 
-"""
-Prompt for summarizing as human-readable stack traces
-
-Args:
-    text (string): Stack trace to be appended to prompt.
-
-Returns:
-    Prompt for summarizing a stack trace.
-"""
-
-
-def format_stack_trace(text: str) -> str:
-    return textwrap.dedent(
-        f"""
+STACK_TRACE_PREFIX = textwrap.dedent(
+    """
     Explain the following stack trace.
     Make suggestions for how to fix the error.
     Given the name of the function where the exception occurred.
@@ -127,29 +176,11 @@ def format_stack_trace(text: str) -> str:
     <numbered list with steps to fix the error>
     \n
     ```
-
-    Stack trace:
-    {text}
     """
-    )
-
-
-"""
-Prompt for checking semantic correctness of code.
-
-Args:
-    code  (string): Stack trace to be appended to prompt.
-    input (Any, optional): Input to the function.
-    context (string, optional): Context of the codebase.
-
-Returns:
-    Prompt for semantically checking generated code.
-"""
-
+)
 
-def format_semantic_checker(code: str, input: Any = "", context: str = "") -> str:
-    return textwrap.dedent(
-        f"""
+SEMANTIC_CHECKER_PREFIX = textwrap.dedent(
+    """
     You are a python interpreter that can execute pseudocode.
     Execute the following pseudocode and return the output only!
     Do not explain the code.
@@ -168,7 +199,125 @@ def format_semantic_checker(code: str, input: Any = "", context: str = "") -> st
             return True (code) is semantically correct else False
         else:
             return True (code, input, purpose_of_code) is semantically correct else False
-
-    is_semantically_correct('{code}', '{str(input)}', '{context}') # return True or False
     """
+)
+
+
+"""
+Prompt for generating entire functions
+
+Args:
+    code    (string): Source code fo function to be appended to prompt.
+    context (ClassContextIndex | list, optional): Available functions.
+    max_context_tokens (int, optional): Token budget for available functions shown in full.
+    max_context_functions (int, optional): Maximum number of available functions shown in full.
+    minify (bool, optional): Strip comments, blank lines and decorators from the source code, and
+        docstrings from available functions. See `utils.minify_source`.
+
+Returns:
+    Prompt for generating a function, with `GENERATIVE_FUNCTION_PREFIX` as its prefix.
+"""
+
+
+def format_generative_function(
+    code: str,
+    context: Context = (),
+    max_context_tokens: int = MAX_CONTEXT_TOKENS,
+    max_context_functions: int = MAX_CONTEXT_FUNCTIONS,
+    minify: bool = False,
+) -> PromptParts:
+    available = format_available_functions(
+        context, code, max_context_tokens, max_context_functions, minify
+    )
+    if minify:
+        # The function's own docstring may be all there is to say what it should do
+        code = minify_source(code, keep_docstring=True)
+    return PromptParts(
+        GENERATIVE_FUNCTION_PREFIX,
+        f"{available}\n\nSource code:\n{code}\n",
+        f"generative_function/{PROMPT_VERSION}",
+    )
+
+
+"""
+Prompt for generating entire functions
+
+Args:
+    code    (string): Source code fo function to be appended to prompt.
+    kwargs  (Any): Parameters of function to be generated.
+    context (ClassContextIndex | list, optional): Available functions.
+    max_context_tokens (int, optional): Token budget for available functions shown in full.
+    max_context_functions (int, optional): Maximum number of available functions shown in full.
+    minify (bool, optional): Strip comments, docstrings and blank lines from available functions.
+
+Returns:
+    Prompt for generating a function, with `GENERATIVE_FUNCTION_FROM_INPUT_PREFIX` as its prefix.
+"""
+
+
+def format_generative_function_from_input(
+    text: str,
+    kwargs: Any,
+    context: Context = (),
+    max_context_tokens: int = MAX_CONTEXT_TOKENS,
+    max_context_functions: int = MAX_CONTEXT_FUNCTIONS,
+    minify: bool = False,
+) -> PromptParts:
+    kwargs = str(kwargs)
+    available = format_available_functions(
+        context,
+        f"{text}\n{kwargs}",
+        max_context_tokens,
+        max_context_functions,
+        minify,
+    )
+    return PromptParts(
+        GENERATIVE_FUNCTION_FROM_INPUT_PREFIX,
+        f"{available}\n\n"
+        f"Generate a function name: {text} that takes the following parameters: {kwargs}\n",
+        f"generative_function_from_input/{PROMPT_VERSION}",
+    )
+
+
+"""
+Prompt for summarizing as human-readable stack traces
+
+Args:
+    text (string): Stack trace to be appended to prompt.
+
+Returns:
+    Prompt for summarizing a stack trace, with `STACK_TRACE_PREFIX` as its prefix.
+"""
+
+
+def format_stack_trace(text: str) -> PromptParts:
+    return PromptParts(
+        STACK_TRACE_PREFIX,
+        f"\nStack trace:\n{text}\n",
+        f"stack_trace/{PROMPT_VERSION}",
+    )
+
+
+"""
+Prompt for checking semantic correctness of code.
+
+Args:
+    code  (string): Stack trace to be appended to prompt.
+    input (Any, optional): Input to the function.
+    context (string, optional): Context of the codebase.
+
+Returns:
+    Prompt for semantically checking generated code, with `SEMANTIC_CHECKER_PREFIX` as its
+    prefix.
+"""
+
+
+def format_semantic_checker(
+    code: str, input: Any = "", context: str = ""
+) -> PromptParts:
+    return PromptParts(
+        SEMANTIC_CHECKER_PREFIX,
+        f"\nis_semantically_correct('{code}', '{str(input)}', '{context}')"
+        " # return True or False\n",
+        f"semantic_checker/{PROMPT_VERSION}",
     )
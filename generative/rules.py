@@ -13,6 +13,7 @@ Do not give a header introducing the code e.g. 'Rewritten source code:'
 Do not write any code outside of the function body.
 Do not call the function or return a reference to it.
 Do not use decorators.
+Do not use async def or await.
 Do not print anything!
 Do not repeat code that you already generated.
 Do not use functions that are not in the available functions list!
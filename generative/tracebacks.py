@@ -0,0 +1,436 @@
+import asyncio
+import hashlib
+import logging
+import os
+import textwrap
+import threading
+import traceback
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from .cache import LRUCache
+from .models import (
+    STACK_TRACE_OPTIONS,
+    agenerate_with,
+    generate_with,
+    is_async_model,
+)
+from .prompt import format_stack_trace
+from .utils import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Frames from this package are the decorators' own wrappers, not the user's code
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_CAUSE = "\nThe above exception was the direct cause of the following exception:\n\n"
+_CONTEXT = "\nDuring handling of the above exception, another exception occurred:\n\n"
+
+DROP_NEWEST = "newest"
+DROP_OLDEST = "oldest"
+
+"""
+Return a fingerprint of an exception that is the same for every recurrence of the same error.
+
+The fingerprint covers the exception's type and its frames (file, function and line), along with
+those of any exceptions it was raised from or while handling. Exception messages, argument values
+and memory addresses are left out, so an error that recurs with different data fingerprints
+equally.
+
+Args:
+    error (BaseException): The exception, with its traceback.
+
+Returns:
+    str: Hex digest identifying the error.
+"""
+
+
+def traceback_fingerprint(error: BaseException) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    seen = set()
+    current: Optional[BaseException] = error
+
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+
+        kind = type(current)
+        digest.update(f"{kind.__module__}.{kind.__qualname__}\n".encode("utf-8"))
+
+        for frame in traceback.extract_tb(current.__traceback__):
+            digest.update(
+                f"{frame.filename}:{frame.name}:{frame.lineno}\n".encode("utf-8")
+            )
+
+        current = current.__cause__ or current.__context__
+
+    return digest.hexdigest()
+
+
+"""
+An LRU cache of stack trace explanations, keyed by traceback fingerprint.
+
+A recurring error is explained by the model once; later occurrences reuse the explanation.
+
+Args:
+    maxsize (int): Maximum number of explanations kept in memory.
+"""
+
+
+class ExplanationCache(LRUCache):
+    @staticmethod
+    def key(error: BaseException) -> str:
+        return traceback_fingerprint(error)
+
+
+# Process-wide cache shared by decorators that are not given their own
+trace_explanations = ExplanationCache(maxsize=1024)
+
+
+def _truncate(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+
+    return f"{text[:limit]}... [{len(text) - limit} characters truncated]"
+
+
+"""
+Shrinks stack traces before they are sent to a model.
+
+Compaction drops the frames added by this package's decorators, collapses runs of repeated frames
+(including cycles of several frames, as in mutual recursion), truncates long source lines and
+exception messages, and finally omits frames from the middle of the trace until it fits within
+`max_tokens`. The first and last frames, which usually locate the error, are kept.
+
+Token counts before and after compaction are accumulated for `stats()` and logged at debug level.
+
+Args:
+    max_tokens (int, optional): Token budget for a compacted stack trace.
+    max_line_length (int, optional): Maximum characters kept from a frame's source line.
+    max_message_length (int, optional): Maximum characters kept from an exception's message.
+    max_cycle (int, optional): Longest run of distinct frames detected as repeating.
+"""
+
+
+class TracebackCompactor:
+    def __init__(
+        self,
+        max_tokens: int = 1024,
+        max_line_length: int = 160,
+        max_message_length: int = 500,
+        max_cycle: int = 8,
+    ) -> None:
+        self.max_tokens = max_tokens
+        self.max_line_length = max_line_length
+        self.max_message_length = max_message_length
+        self.max_cycle = max_cycle
+        self.compacted = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def _entries(self, stack: traceback.StackSummary) -> List[str]:
+        frames = [
+            frame
+            for frame in stack
+            if os.path.dirname(os.path.abspath(frame.filename)) != _PACKAGE_DIR
+        ]
+        keys = [(frame.filename, frame.lineno, frame.name) for frame in frames]
+
+        entries = []
+        i = 0
+        while i < len(frames):
+            period, repeats = 1, 1
+
+            for length in range(1, self.max_cycle + 1):
+                count = 1
+                cycle = keys[i : i + length]
+                while keys[i + count * length : i + (count + 1) * length] == cycle:
+                    count += 1
+
+                if count > 1 and count * length > period * repeats:
+                    period, repeats = length, count
+
+            for frame in frames[i : i + period]:
+                entry = (
+                    f'  File "{frame.filename}", line {frame.lineno}, in {frame.name}\n'
+                )
+                if frame.line:
+                    entry += (
+                        f"    {_truncate(frame.line.strip(), self.max_line_length)}\n"
+                    )
+                entries.append(entry)
+
+            if repeats > 1:
+                what = "line" if period == 1 else f"{period} frames"
+                entries.append(
+                    f"  [Previous {what} repeated {repeats - 1} more times]\n"
+                )
+
+            i += period * repeats
+
+        return entries
+
+    def _format(self, exception: traceback.TracebackException, budget: int) -> str:
+        message = _truncate(
+            "".join(exception.format_exception_only()).rstrip("\n"),
+            self.max_message_length,
+        )
+        header = "Traceback (most recent call last):\n" if exception.stack else ""
+        footer = f"{message}\n"
+        entries = self._entries(exception.stack)
+
+        costs = [count_tokens(entry) for entry in entries]
+        remaining = budget - count_tokens(header) - count_tokens(footer)
+
+        if sum(costs) > remaining and len(entries) > 2:
+            # Keep the outermost frames and as many of the innermost as fit
+            head = entries[:2]
+            remaining -= sum(costs[:2]) + count_tokens("  [... 0 frames omitted ...]")
+
+            tail: List[str] = []
+            for entry, cost in zip(reversed(entries[2:]), reversed(costs[2:])):
+                if cost > remaining:
+                    break
+                tail.insert(0, entry)
+                remaining -= cost
+
+            omitted = len(entries) - len(head) - len(tail)
+            entries = head + [f"  [... {omitted} frames omitted ...]\n"] + tail
+
+        return header + "".join(entries) + footer
+
+    def compact(self, error: BaseException) -> str:
+        """
+        Formats `error` and its chained exceptions as a compacted stack trace.
+
+        :param error: The exception, with its traceback.
+        :return: The compacted stack trace.
+        """
+        exception = traceback.TracebackException.from_exception(error)
+
+        # Chained exceptions are printed innermost first, as the interpreter does
+        chain: List[Tuple[traceback.TracebackException, str]] = []
+        seen = set()
+        current: Optional[traceback.TracebackException] = exception
+        separator = ""
+
+        while current is not None and id(current) not in seen:
+            seen.add(id(current))
+            chain.insert(0, (current, separator))
+
+            if current.__cause__ is not None:
+                current, separator = current.__cause__, _CAUSE
+            elif current.__context__ is not None and not current.__suppress_context__:
+                current, separator = current.__context__, _CONTEXT
+            else:
+                current = None
+
+        budget = max(self.max_tokens // len(chain), 1)
+        text = ""
+        for link, separator in chain:
+            text += self._format(link, budget) + separator
+
+        before = count_tokens("".join(exception.format()))
+        after = count_tokens(text)
+
+        self.compacted += 1
+        self.tokens_before += before
+        self.tokens_after += after
+        logger.debug("Compacted a stack trace from %d to %d tokens", before, after)
+
+        return text
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "compacted": self.compacted,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+        }
+
+
+# Process-wide compactor shared by decorators that are not given their own
+trace_compactor = TracebackCompactor()
+
+
+"""
+Explains stack traces on a pool of background threads.
+
+Failing callers hand their exception to `submit`, which compacts its stack trace and returns
+immediately so the original exception can propagate without waiting on the model. Explanations
+are added to `explanations` and passed to `callback`, or logged as warnings if no callback is
+given.
+
+Pending stack traces are held in a bounded queue. When it is full, `drop` decides whether the new
+stack trace ("newest") or the oldest pending one ("oldest") is discarded, so a storm of exceptions
+cannot exhaust memory. Errors that are already explained or already pending are not queued again.
+
+Args:
+    model (AbstractGenerativeModel): A model that explains stack traces. Asynchronous models are
+        run on the worker threads' own event loops.
+    explanations (ExplanationCache, optional): Where explanations are stored. Defaults to the
+        process-wide `trace_explanations`.
+    callback (Callable, optional): Called with the traceback fingerprint, the stack trace and its
+        explanation.
+    compactor (TracebackCompactor, optional): Shrinks stack traces before they are queued.
+        Defaults to the process-wide `trace_compactor`.
+    workers (int, optional): Number of worker threads.
+    max_pending (int, optional): Maximum number of stack traces waiting to be explained.
+    drop (str, optional): "newest" or "oldest"; which stack trace is dropped when the queue is full.
+
+Raises:
+    ValueError: If `drop` is not "newest" or "oldest", or `workers` or `max_pending` is not
+        positive.
+"""
+
+
+class DeferredExplainer:
+    def __init__(
+        self,
+        model: Any,
+        explanations: Optional[ExplanationCache] = None,
+        callback: Optional[Callable[[str, str, str], None]] = None,
+        compactor: Optional[TracebackCompactor] = None,
+        workers: int = 2,
+        max_pending: int = 1000,
+        drop: str = DROP_NEWEST,
+    ) -> None:
+        if drop not in (DROP_NEWEST, DROP_OLDEST):
+            raise ValueError(f"Unknown drop policy: {drop}")
+
+        if workers <= 0 or max_pending <= 0:
+            raise ValueError("workers and max_pending must be positive integers")
+
+        if explanations is None:
+            explanations = trace_explanations
+
+        if compactor is None:
+            compactor = trace_compactor
+
+        self.model = model
+        self.explanations = explanations
+        self.callback = callback
+        self.compactor = compactor
+        self.workers = workers
+        self.max_pending = max_pending
+        self.drop = drop
+        self.submitted = 0
+        self.dropped = 0
+        self.explained = 0
+        self.failed = 0
+        self._pending: Deque[Tuple[str, str]] = deque()
+        self._pending_keys: Set[str] = set()
+        self._active = 0
+        self._closed = False
+        self._threads: List[threading.Thread] = []
+        self._condition = threading.Condition()
+
+    def submit(self, error: BaseException) -> bool:
+        """
+        Queues the stack trace of `error` to be explained in the background.
+
+        :param error: The exception, with its traceback.
+        :return: True if the stack trace was queued.
+        """
+        key = self.explanations.key(error)
+
+        if key in self.explanations or key in self._pending_keys:
+            return False
+
+        stack_trace = self.compactor.compact(error)
+
+        with self._condition:
+            if self._closed or key in self.explanations or key in self._pending_keys:
+                return False
+
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+
+                if self.drop == DROP_NEWEST:
+                    return False
+
+                oldest, _ = self._pending.popleft()
+                self._pending_keys.discard(oldest)
+
+            self._pending.append((key, stack_trace))
+            self._pending_keys.add(key)
+            self.submitted += 1
+
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._work, name="generative-explainer", daemon=True
+                )
+                self._threads.append(thread)
+                thread.start()
+
+            self._condition.notify()
+
+        return True
+
+    def _explain(self, stack_trace: str) -> str:
+        prompt = format_stack_trace(stack_trace)
+
+        if is_async_model(self.model):
+            return asyncio.run(agenerate_with(self.model, prompt, STACK_TRACE_OPTIONS))
+
+        return generate_with(self.model, prompt, STACK_TRACE_OPTIONS)
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+
+                if not self._pending:
+                    return
+
+                key, stack_trace = self._pending.popleft()
+                self._active += 1
+
+            try:
+                summary = textwrap.dedent(self._explain(stack_trace))
+                self.explanations.set(key, summary)
+                self.explained += 1
+
+                if self.callback is not None:
+                    self.callback(key, stack_trace, summary)
+                else:
+                    logger.warning("%s\n%s", stack_trace, summary)
+            except Exception:
+                self.failed += 1
+                logger.exception("Explaining a stack trace in the background failed")
+            finally:
+                with self._condition:
+                    self._pending_keys.discard(key)
+                    self._active -= 1
+                    self._condition.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until every queued stack trace has been explained.
+
+        :param timeout: Maximum number of seconds to wait.
+        :return: True if the queue was drained before the timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._active, timeout
+            )
+
+    def close(self) -> None:
+        """
+        Explains the stack traces already queued, then stops the worker threads.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        for thread in self._threads:
+            thread.join()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "explained": self.explained,
+            "failed": self.failed,
+            "pending": len(self._pending),
+        }
@@ -1,7 +1,21 @@
+import io
 import re
 import ast
+import hashlib
 import textwrap
-from typing import Optional
+import tokenize
+from typing import (
+    AsyncIterable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+# Decorators of this package that carry no meaning for a model reading the decorated source
+GENERATIVE_DECORATORS = ("adapt", "catch", "stack_trace", "generate_attribute")
 
 """
 This function takes a string that represents a function.
@@ -176,3 +190,576 @@ def is_valid_syntax(code: str) -> bool:
         return True
     except SyntaxError:
         return False
+
+
+"""
+Compute a stable content hash of a string of source code.
+
+Args:
+    code (str): Source code
+
+Returns:
+    str: Hex digest of the SHA-256 hash of the code.
+"""
+
+
+def hash_source(code: str) -> str:
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+
+"""
+Compute a content hash of source code that ignores formatting.
+
+Code that parses to the same syntax tree, differing only in comments, blank lines, indentation
+or line wrapping, hashes equally. Code that does not parse is hashed after stripping surrounding
+whitespace.
+
+Args:
+    code (str): Source code
+
+Returns:
+    str: Hex digest of the SHA-256 hash of the normalized code.
+"""
+
+
+def hash_normalized_source(code: str) -> str:
+    try:
+        normalized = ast.dump(ast.parse(textwrap.dedent(code)))
+    except SyntaxError:
+        normalized = code.strip()
+
+    return hash_source(normalized)
+
+
+"""
+Estimate the number of tokens a model will see for a string.
+
+Words and runs of digits count as one token each, as does every punctuation character. This tracks
+the sub-word tokenizers used by hosted models closely enough to compare prompt sizes without
+depending on any one of them.
+
+Args:
+    text (str): Text to measure.
+
+Returns:
+    int: Estimated token count.
+"""
+
+
+def count_tokens(text: str) -> int:
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+
+"""
+Return the name a decorator is referred to by, without its module or arguments.
+
+Args:
+    node (ast.expr): A decorator expression, e.g. `adapt`, `generative.adapt` or `adapt(model=m)`.
+
+Returns:
+    str: The decorator's name, e.g. "adapt", or "" for other expressions.
+"""
+
+
+def decorator_name(node: ast.expr) -> str:
+    if isinstance(node, ast.Call):
+        node = node.func
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    if isinstance(node, ast.Name):
+        return node.id
+    return ""
+
+
+def _is_docstring(node: ast.stmt) -> bool:
+    return (
+        isinstance(node, ast.Expr)
+        and isinstance(node.value, ast.Constant)
+        and isinstance(node.value.value, str)
+    )
+
+
+def _structural_lines(
+    tree: ast.Module, keep_docstring: bool, decorators: Iterable[str]
+) -> Tuple[Set[int], Dict[int, str]]:
+    decorators = set(decorators)
+    kept = {id(node) for node in tree.body} if keep_docstring else set()
+    dropped: Set[int] = set()
+    replaced: Dict[int, str] = {}
+
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+
+        for decorator in node.decorator_list:
+            if decorator_name(decorator) in decorators:
+                # Rows are 0-based; the "@" is on the decorator expression's first line
+                dropped.update(range(decorator.lineno - 1, decorator.end_lineno or 0))
+
+        if id(node) not in kept and _is_docstring(node.body[0]):
+            docstring = node.body[0]
+            rows = range(docstring.lineno - 1, docstring.end_lineno or 0)
+
+            if len(node.body) == 1:
+                # A body that was only a docstring still needs a statement
+                replaced[rows[0]] = " " * docstring.col_offset + "pass"
+            dropped.update(rows)
+
+    return dropped, replaced
+
+
+def _minify_lines(code: str, dropped: Set[int], replaced: Dict[int, str]) -> str:
+    lines = code.splitlines()
+    blank: Set[int] = set()
+    spans: Dict[int, List[Tuple[int, int]]] = {}
+    multiline: Set[int] = set()
+    tokenized = 0
+    fstring = getattr(tokenize, "FSTRING_START", None)
+
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            (row, column), (end_row, end_column) = token.start, token.end
+            tokenized = end_row
+
+            if token.type == tokenize.COMMENT:
+                lines[row - 1] = lines[row - 1][:column]
+            elif token.type == tokenize.NL and not lines[row - 1][:column].strip():
+                blank.add(row - 1)
+            elif token.type in (tokenize.NEWLINE, tokenize.NL, tokenize.ENDMARKER):
+                continue
+            elif row != end_row or token.type == fstring:
+                multiline.update(range(row - 1, end_row))
+            else:
+                spans.setdefault(row - 1, []).append((column, end_column))
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        # Lines past the error are kept as they are, except empty ones
+        pass
+
+    def collapse(number: int, line: str) -> str:
+        # A trailing backslash joins lines but is not a token, so such lines are kept as written
+        if number in multiline or number not in spans or line.rstrip().endswith("\\"):
+            return line.rstrip()
+
+        # Rebuild the line from its tokens, separated by at most one space
+        columns = spans[number]
+        text = line[: columns[0][0]]
+        previous = columns[0][0]
+        for start, end in columns:
+            text += (" " if start > previous else "") + line[start:end]
+            previous = end
+        return text
+
+    result = []
+    for number, line in enumerate(lines):
+        if number in replaced:
+            result.append(replaced[number])
+        elif number in dropped or number in blank:
+            continue
+        elif number >= tokenized and not line.strip():
+            continue
+        else:
+            line = collapse(number, line)
+            if line.strip() or number in multiline:
+                result.append(line)
+
+    return "".join(line + "\n" for line in result)
+
+
+"""
+Shrink source code before it is embedded in a prompt.
+
+Comments, docstrings, blank lines and runs of whitespace between tokens are removed, as are
+decorators of this package such as `@adapt(...)` and `@catch(...)`. Code is rewritten line by
+line from its tokens, so string literals and indentation are kept as written. Code that does not
+parse, such as a broken function a model is asked to repair, keeps its docstrings, and only
+decorator lines that name one of `decorators` directly are removed.
+
+Args:
+    code (str): Source code, possibly indented.
+    keep_docstring (bool, optional): Keep the docstrings of top-level functions and classes,
+        which may describe what a model should generate.
+    decorators (Iterable[str], optional): Names of decorators to remove.
+
+Returns:
+    str: The minified source code.
+"""
+
+
+def minify_source(
+    code: str,
+    keep_docstring: bool = False,
+    decorators: Iterable[str] = GENERATIVE_DECORATORS,
+) -> str:
+    code = textwrap.dedent(code)
+
+    try:
+        dropped, replaced = _structural_lines(
+            ast.parse(code), keep_docstring, decorators
+        )
+    except SyntaxError:
+        names = "|".join(decorators)
+        decorator = re.compile(rf"\s*@\s*(?:[\w.]+\.)?(?:{names})\b")
+        dropped = {
+            number
+            for number, line in enumerate(code.splitlines())
+            if names and decorator.match(line)
+        }
+        replaced = {}
+
+    return _minify_lines(code, dropped, replaced)
+
+
+_DEF = re.compile(r"(\s*)(?:async\s+)?def\s")
+_OPENERS = {")": "(", "]": "[", "}": "{"}
+
+END_MARKER = "### END FUNCTION ###"
+
+
+def _scan_line(
+    line: str, quote: Optional[str], depth: int
+) -> Tuple[Optional[str], int, int]:
+    # Returns the open triple quote and bracket depth after the line, and the position of the
+    # first ":" outside strings and brackets, or -1
+    colon = -1
+    i = 0
+
+    while i < len(line):
+        if quote:
+            if line.startswith(quote, i):
+                i += len(quote)
+                quote = None
+            else:
+                i += 2 if line[i] == "\\" else 1
+            continue
+
+        char = line[i]
+        if char == "#":
+            break
+        if char in "\"'":
+            if line.startswith(char * 3, i):
+                quote = char * 3
+                i += 3
+                continue
+
+            # Single-quoted strings end on the same line
+            i += 1
+            while i < len(line) and line[i] != char:
+                i += 2 if line[i] == "\\" else 1
+        elif char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth = max(depth - 1, 0)
+        elif char == ":" and depth == 0 and colon == -1:
+            colon = i
+        i += 1
+
+    return quote, depth, colon
+
+
+"""
+Raised when a streamed completion contains a syntax error that no continuation can fix.
+
+Attributes:
+    completion (str): The completion read before the error was found.
+"""
+
+
+class IrrecoverableSyntaxError(SyntaxError):
+    def __init__(self, message: str, completion: str) -> None:
+        super().__init__(message)
+        self.completion = completion
+
+
+"""
+Find a syntax error in the beginning of some code that no continuation of the code can fix.
+
+The code is tokenized. A closing bracket that does not match the innermost open bracket, a
+dedent to a column that matches no enclosing block, or a string that is not terminated by the
+end of its line cannot be fixed by more text. Brackets, strings and blocks that are merely still
+open can, and are not reported.
+
+Args:
+    code (str): The code received so far, ending at a line break.
+
+Returns:
+    str: A description of the error, or None if the code may still become valid.
+"""
+
+
+def find_irrecoverable_error(code: str) -> Optional[str]:
+    return _find_token_error(code)
+
+
+def _find_token_error(code: str, first_row: int = 1) -> Optional[str]:
+    brackets: List[str] = []
+    offset = first_row - 1
+
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            row = token.start[0] + offset
+
+            if token.type == tokenize.OP and token.string in "([{":
+                brackets.append(token.string)
+            elif token.type == tokenize.OP and token.string in _OPENERS:
+                if not brackets or brackets.pop() != _OPENERS[token.string]:
+                    return f"unmatched {token.string!r} on line {row}"
+            elif token.type == tokenize.ERRORTOKEN and token.string.strip():
+                return f"invalid token {token.string!r} on line {row}"
+    except IndentationError as e:
+        return f"{e.msg} on line {(e.lineno or 1) + offset}"
+    except tokenize.TokenError as e:
+        # Open brackets and strings at the end of the code may still be closed
+        message = str(e.args[0]) if e.args else ""
+        if "EOF" in message or "triple-quoted" in message:
+            return None
+        return message
+
+    return None
+
+
+"""
+Incrementally read a streamed completion until the generated function is complete.
+
+Chunks of a completion are fed as they arrive. The parser reports completion as soon as the
+completion contains `end_marker`, or a top-level function definition has a body and is followed
+by a line at or left of the definition's indentation, such as an explanation or a call to the
+function. Lines inside strings, brackets and backslash continuations are not mistaken for the
+end of the function. Each line is scanned once, so feeding a completion costs time linear in its
+length.
+
+With `check_syntax`, each logical line of the function is also checked as it ends, like
+`find_irrecoverable_error` checks whole code, and reading stops as soon as the function can no
+longer be valid. Only the new logical line is tokenized, against the indentation levels of the
+lines before it, so checking keeps the cost linear.
+
+Args:
+    end_marker (str, optional): Text that ends the function.
+    check_syntax (bool, optional): Stop at syntax errors no continuation can fix.
+
+Attributes:
+    done (bool): True once the function is complete or doomed; later chunks are ignored.
+    error (str): Description of the syntax error that doomed the function, or None.
+"""
+
+
+class FunctionStreamParser:
+    def __init__(
+        self, end_marker: str = END_MARKER, check_syntax: bool = False
+    ) -> None:
+        self.end_marker = end_marker
+        self.check_syntax = check_syntax
+        self.done = False
+        self.error: Optional[str] = None
+        self._start = 0
+        self._checked = 0
+        self._indents = [0]
+        self._lines: List[str] = []
+        self._pending = ""
+        self._indent: Optional[int] = None
+        self._header = False
+        self._body = False
+        self._quote: Optional[str] = None
+        self._depth = 0
+        self._continued = False
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Consumes a chunk of the completion.
+
+        :param chunk: The next piece of streamed text.
+        :return: True if the function is complete.
+        """
+        if self.done:
+            return True
+
+        self._pending += chunk
+
+        marker = self._pending.find(self.end_marker)
+        if marker != -1:
+            # Lines before the marker may still complete the function first
+            head = self._pending[: marker + len(self.end_marker)]
+            self._pending = ""
+            for line in head.splitlines(keepends=True):
+                if self._line(line):
+                    return True
+            self.done = True
+            return True
+
+        *lines, self._pending = self._pending.split("\n")
+        for line in lines:
+            if self._line(line + "\n"):
+                return True
+
+        return False
+
+    def close(self) -> str:
+        """
+        Consumes whatever remains of the completion once the stream has ended.
+
+        :return: The completion up to the end of the function.
+        """
+        if not self.done and self._pending:
+            self._line(self._pending)
+            self._pending = ""
+
+        return self.result()
+
+    def result(self) -> str:
+        """
+        Returns the completion consumed so far, up to the end of the function once it is complete.
+        """
+        return "".join(self._lines)
+
+    def _line(self, line: str) -> bool:
+        logical = self._quote is None and self._depth == 0 and not self._continued
+        content = line.strip()
+        indent = len(line) - len(line.lstrip())
+
+        if self._indent is None:
+            match = _DEF.match(line) if logical else None
+            if match:
+                self._indent = len(match.group(1).expandtabs())
+                self._start = self._checked = len(self._lines)
+        elif (
+            logical
+            and self._body
+            and content
+            and not content.startswith("#")
+            and indent <= self._indent
+        ):
+            self.done = True
+            return True
+
+        self._lines.append(line)
+
+        if self._indent is None:
+            return False
+
+        if self._header and logical and content and not content.startswith("#"):
+            self._body = self._body or indent > self._indent
+
+        self._quote, self._depth, colon = _scan_line(line, self._quote, self._depth)
+        self._continued = line.rstrip("\r\n").endswith("\\")
+
+        if not self._header and colon != -1 and self._depth == 0:
+            self._header = True
+            # A body on the same line as the header, e.g. "def f(): return 1"
+            rest = line[colon + 1 :].split("#", 1)[0].strip()
+            self._body = bool(rest)
+
+        if (
+            self.check_syntax
+            and line.endswith("\n")
+            and self._quote is None
+            and self._depth == 0
+            and not self._continued
+        ):
+            # Only text from the definition on is Python; text before it may be prose
+            self.error = self._check_logical_line()
+            if self.error is not None:
+                self.done = True
+                return True
+
+        return False
+
+    def _check_logical_line(self) -> Optional[str]:
+        text = "".join(self._lines[self._checked :])
+        row = self._checked - self._start + 1
+        self._checked = len(self._lines)
+
+        first = text.split("\n", 1)[0]
+        content = first.lstrip()
+
+        # Indentation is tracked across lines the way the tokenizer does it for whole code
+        if content and not content.startswith("#"):
+            indent = len(first[: len(first) - len(content)].expandtabs())
+
+            if indent > self._indents[-1]:
+                self._indents.append(indent)
+            else:
+                while indent < self._indents[-1]:
+                    self._indents.pop()
+
+                if indent != self._indents[-1]:
+                    return f"unindent does not match any outer indentation level on line {row}"
+
+        return _find_token_error(text[len(first) - len(content) :], row)
+
+
+"""
+Read a streamed completion only until the generated function is complete.
+
+Once the function is complete, the stream is closed, so a model that cancels its request when its
+generator is closed stops generating.
+
+Args:
+    chunks (Iterable[str]): Streamed pieces of a completion.
+    end_marker (str, optional): Text that ends the function.
+    check_syntax (bool, optional): Stop reading at syntax errors no continuation can fix.
+
+Returns:
+    str: The completion up to the end of the function.
+
+Raises:
+    IrrecoverableSyntaxError: If `check_syntax` is set and the function can no longer be valid.
+"""
+
+
+def collect_function(
+    chunks: Iterable[str], end_marker: str = END_MARKER, check_syntax: bool = False
+) -> str:
+    parser = FunctionStreamParser(end_marker, check_syntax)
+    iterator = iter(chunks)
+
+    try:
+        for chunk in iterator:
+            if parser.feed(chunk):
+                break
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+
+    if parser.error is not None:
+        raise IrrecoverableSyntaxError(parser.error, parser.result())
+
+    return parser.close()
+
+
+"""
+Asynchronous counterpart of `collect_function`.
+
+Args:
+    chunks (AsyncIterable[str]): Streamed pieces of a completion.
+    end_marker (str, optional): Text that ends the function.
+    check_syntax (bool, optional): Stop reading at syntax errors no continuation can fix.
+
+Returns:
+    str: The completion up to the end of the function.
+
+Raises:
+    IrrecoverableSyntaxError: If `check_syntax` is set and the function can no longer be valid.
+"""
+
+
+async def acollect_function(
+    chunks: AsyncIterable[str],
+    end_marker: str = END_MARKER,
+    check_syntax: bool = False,
+) -> str:
+    parser = FunctionStreamParser(end_marker, check_syntax)
+    iterator = chunks.__aiter__()
+
+    try:
+        async for chunk in iterator:
+            if parser.feed(chunk):
+                break
+    finally:
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    if parser.error is not None:
+        raise IrrecoverableSyntaxError(parser.error, parser.result())
+
+    return parser.close()
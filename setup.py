@@ -4,6 +4,7 @@ setup(
     name="generative",
     version="0.1",
     packages=find_packages(),
+    python_requires=">=3.8",
     install_requires=[
         "python-dotenv>=1.0.0",
         "RestrictedPython>=6.0",
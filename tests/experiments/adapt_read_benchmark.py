@@ -0,0 +1,79 @@
+"""
+Measures the throughput of calls to an `adapt` function whose implementation is installed.
+
+Calls read the installed implementation without taking a lock, so readers should keep their
+throughput while another thread keeps swapping the implementation. Both cases are reported.
+
+Usage:
+    PYTHONPATH=. python tests/experiments/adapt_read_benchmark.py [threads] [calls_per_thread]
+"""
+
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from generative.cache import CompiledFunctionCache, compile_function
+from generative.index import class_signature
+from generative.functions import Implementation, adapt
+
+
+@adapt("def add(a, b):\n    return a + b\n", cache=CompiledFunctionCache(maxsize=8))
+def add(a, b):
+    return a - b
+
+
+def measure(threads, calls_per_thread, swapping):
+    implementations = [
+        add._implementation.get(),
+        {
+            (int, "add"): Implementation(
+                compile_function("def add(a, b):\n    return b + a\n"),
+                add._context.context_hash(int),
+                class_signature(int),
+            )
+        },
+    ]
+    stop = threading.Event()
+
+    def swap():
+        i = 0
+        while not stop.is_set():
+            add._implementation.set(implementations[i % 2])
+            i += 1
+
+    def read(offset):
+        for i in range(calls_per_thread):
+            add(i, offset)
+
+    swapper = threading.Thread(target=swap) if swapping else None
+    if swapper:
+        swapper.start()
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(read, range(threads)))
+    finally:
+        stop.set()
+        if swapper:
+            swapper.join()
+
+    return threads * calls_per_thread / (time.perf_counter() - start)
+
+
+def main(threads, calls_per_thread):
+    # Install the implementation before measuring
+    add(1, 2)
+
+    print(f"{'swapping':<10} {'calls/s':>12}")
+    for swapping in (False, True):
+        rate = measure(threads, calls_per_thread, swapping)
+        print(f"{str(swapping):<10} {rate:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 8,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 50_000,
+    )
@@ -0,0 +1,63 @@
+"""
+Compares attribute access on plain classes and on classes decorated with `generate_attribute`.
+
+Existing fields and methods should be as fast on decorated instances as on plain ones, since the
+generative fallback only runs when normal lookup fails. An override of `__getattribute__`, which
+`generate_attribute` used to install, is measured alongside for reference.
+
+Usage:
+    PYTHONPATH=. python tests/experiments/attribute_access_benchmark.py [iterations]
+"""
+
+import sys
+import timeit
+
+from generative.classes import generate_attribute
+from generative.metaclasses import AbstractGenerativeModel
+
+
+class Model(AbstractGenerativeModel):
+    def generate(self, prompt: str) -> str:
+        return "def missing():\n    return 'generated'\n"
+
+
+class Plain:
+    def __init__(self):
+        self.field = 1
+
+    def method(self):
+        return self.field
+
+
+@generate_attribute(model=Model())
+class Decorated(Plain):
+    pass
+
+
+class Overridden(Plain):
+    def __getattribute__(self, name):
+        try:
+            return super().__getattribute__(name)
+        except AttributeError:
+            raise
+
+
+def measure(instance, statement, iterations):
+    return min(
+        timeit.repeat(statement, globals={"obj": instance}, number=iterations, repeat=5)
+    )
+
+
+def main(iterations):
+    print(f"{'access':<10} {'plain':>10} {'decorated':>10} {'override':>10}   (ns/op)")
+
+    for name, statement in (("field", "obj.field"), ("method", "obj.method()")):
+        timings = [
+            measure(cls(), statement, iterations) / iterations * 1e9
+            for cls in (Plain, Decorated, Overridden)
+        ]
+        print(f"{name:<10} " + " ".join(f"{t:>10.1f}" for t in timings))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,122 @@
+"""
+Measures how many prompt tokens `minify_source` saves.
+
+The corpus is every function and method of the `generative` package and its tests, each rendered
+as it would be in a prompt: the dedented source returned by `inspect.getsource`. Tokens are
+estimated with `count_tokens`, which ignores whitespace, so characters saved are reported as
+well. A full generation prompt for a decorated method of a class with
+several documented methods is measured as well.
+
+Usage:
+    PYTHONPATH=. python tests/experiments/minify_benchmark.py
+"""
+
+import ast
+import textwrap
+import timeit
+from pathlib import Path
+
+from generative.index import context_index
+from generative.prompt import format_generative_function
+from generative.utils import count_tokens, minify_source
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+def corpus():
+    for path in sorted([*ROOT.glob("generative/*.py"), *ROOT.glob("tests/*.py")]):
+        source = path.read_text()
+        lines = source.splitlines(keepends=True)
+
+        for node in ast.walk(ast.parse(source)):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+                yield path, textwrap.dedent("".join(lines[start - 1 : node.end_lineno]))
+
+
+class Thermostat:
+    def read(self, unit="C"):
+        """
+        Return the current temperature.
+
+        :param unit: "C" or "F".
+        :return: The temperature in the given unit.
+        """
+        # Sensors report Celsius
+        celsius = self.sensor()
+        if unit == "F":
+            return celsius * 9 / 5 + 32
+
+        return celsius
+
+    def set_target(self, value):
+        """
+        Set the temperature the thermostat should reach.
+
+        :param value: Target temperature in Celsius.
+        """
+        # Clamp to what the heater supports
+        self.target = max(5, min(value, 30))
+
+    def sensor(self):
+        """
+        Read the raw sensor value.
+        """
+        return 21
+
+
+WARM = '''
+@adapt(model=GPT4(), critic=Claude())
+def warm(self, degrees):
+    """Raise the target temperature by `degrees`."""
+    # Should use set_target
+    pass
+'''
+
+
+def measure(text):
+    return count_tokens(text), len(text)
+
+
+def saved(before, after):
+    return f"{1 - after / before:>7.1%}"
+
+
+def main():
+    totals = {}
+    for path, source in corpus():
+        counts = totals.setdefault(path.name, [0, 0, 0, 0])
+        for position, value in enumerate(
+            measure(source) + measure(minify_source(source))
+        ):
+            counts[position] += value
+
+    print(
+        f"{'module':<36} {'tokens':>8} {'minified':>9} {'saved':>7} {'chars saved':>12}"
+    )
+    for name, (tokens, chars, minified_tokens, minified_chars) in totals.items():
+        print(
+            f"{name:<36} {tokens:>8} {minified_tokens:>9} "
+            f"{saved(tokens, minified_tokens)} {saved(chars, minified_chars):>12}"
+        )
+
+    tokens, chars, minified_tokens, minified_chars = map(sum, zip(*totals.values()))
+    print(
+        f"{'total':<36} {tokens:>8} {minified_tokens:>9} "
+        f"{saved(tokens, minified_tokens)} {saved(chars, minified_chars):>12}"
+    )
+
+    index = context_index(Thermostat)
+    raw = count_tokens(format_generative_function(WARM, index))
+    minified = count_tokens(format_generative_function(WARM, index, minify=True))
+    print(
+        f"\nprompt for a decorated method: {raw} -> {minified} tokens "
+        f"({saved(raw, minified).strip()} saved)"
+    )
+
+    seconds = min(timeit.repeat(lambda: minify_source(WARM), number=1000, repeat=5))
+    print(f"minify_source: {seconds * 1e3:.1f} us per function")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Measures SQLiteDatabase get/set throughput as the table grows.
+
+Usage:
+    PYTHONPATH=. python tests/experiments/sqlite_benchmark.py [rows ...]
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+from generative.databases import SQLiteDatabase
+
+CODE = "def func_{i}(a, b):\n    return a + b + {i}\n"
+
+
+def capability(i):
+    return {
+        "function_name": f"func_{i}",
+        "source_hash": f"{i:064x}",
+        "args": [i],
+        "kwargs": {},
+        "generated_code": CODE.format(i=i),
+    }
+
+
+def fill(db, start, stop):
+    begin = time.perf_counter()
+    for i in range(start, stop):
+        db.set(f"func_{i}", capability(i))
+    db.flush()
+    elapsed = time.perf_counter() - begin
+
+    return (stop - start) / elapsed
+
+
+def read(db, rows, samples=5000):
+    keys = [f"func_{random.randrange(rows)}" for _ in range(samples)]
+
+    begin = time.perf_counter()
+    for key in keys:
+        db.get(key)
+    elapsed = time.perf_counter() - begin
+
+    return samples / elapsed
+
+
+def main(sizes):
+    print(f"{'rows':>10} {'batch':>6} {'set/s':>12} {'get/s':>12}")
+
+    for batch_size in (1, 500):
+        with tempfile.TemporaryDirectory() as directory:
+            db = SQLiteDatabase(
+                os.path.join(directory, "bench.db"), batch_size=batch_size
+            )
+            rows = 0
+
+            for size in sizes:
+                set_rate = fill(db, rows, size)
+                rows = size
+                get_rate = read(db, rows)
+                print(f"{rows:>10} {batch_size:>6} {set_rate:>12.0f} {get_rate:>12.0f}")
+
+            db.close()
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
@@ -3,6 +3,8 @@ User-defined functions that generate code using LLM.
 """
 
 import os
+import time
+import threading
 import openai
 import cohere
 from anthropic import Anthropic, HUMAN_PROMPT, AI_PROMPT
@@ -10,11 +12,22 @@ from anthropic import Anthropic, HUMAN_PROMPT, AI_PROMPT
 # import google.generativeai as palm
 from dotenv import load_dotenv
 
-from generative.metaclasses import AbstractGenerativeModel
+from generative.metaclasses import AbstractGenerativeModel, GenerationOptions
+from generative.prompt import split_prompt
 
 load_dotenv()
 
 
+def temperature(options: GenerationOptions) -> float:
+    if options.temperature is not None:
+        return options.temperature
+    return float(os.getenv("TEMPERATURE", 0.7))
+
+
+def max_tokens(options: GenerationOptions) -> int:
+    return options.max_tokens or int(os.getenv("MAX_TOKENS", 3600))
+
+
 class GPT4(AbstractGenerativeModel):
     """
     OpenAI Chat Completion API wrapper
@@ -27,7 +40,9 @@ class GPT4(AbstractGenerativeModel):
     """
 
     @classmethod
-    def generate(cls, prompt: str) -> str:
+    def generate(
+        cls, prompt: str, options: GenerationOptions = GenerationOptions()
+    ) -> str:
         openai.api_key = os.getenv("OPENAI_API_KEY")
 
         if openai.api_key is None:
@@ -35,15 +50,21 @@ class GPT4(AbstractGenerativeModel):
                 "The OPENAI_API_KEY environment variable is not set. Please provide your OpenAI API key."
             )
 
+        # The static prefix goes first and unchanged so the provider can reuse its cached prefix
+        prefix, suffix = split_prompt(prompt)
         messages = [
-            {"role": "system", "content": "You are an elite Python programmer."},
-            {"role": "user", "content": prompt},
+            {"role": "system", "content": "You are an elite Python programmer."}
         ]
+        if prefix:
+            messages.append({"role": "system", "content": prefix})
+        messages.append({"role": "user", "content": suffix})
 
         llm_code = openai.ChatCompletion.create(
             model=os.getenv("OPENAI_MODEL_GPT4"),
             messages=messages,
-            temperature=float(os.getenv("TEMPERATURE", 0.7)),
+            temperature=temperature(options),
+            max_tokens=max_tokens(options),
+            stop=list(options.stop) or None,
         )
 
         return llm_code.choices[0].message.content
@@ -61,7 +82,9 @@ class GPT3(AbstractGenerativeModel):
     """
 
     @classmethod
-    def generate(cls, prompt: str) -> str:
+    def generate(
+        cls, prompt: str, options: GenerationOptions = GenerationOptions()
+    ) -> str:
         openai.api_key = os.getenv("OPENAI_API_KEY")
 
         if openai.api_key is None:
@@ -72,8 +95,9 @@ class GPT3(AbstractGenerativeModel):
         llm_code = openai.ChatCompletion.create(
             model=os.getenv("OPENAI_MODEL_GPT3"),
             prompt=prompt,
-            temperature=float(os.getenv("TEMPERATURE", 0.7)),
-            max_tokens=int(os.getenv("MAX_TOKENS", 3600)),
+            temperature=temperature(options),
+            max_tokens=max_tokens(options),
+            stop=list(options.stop) or None,
         )
 
         return llm_code.choices[0].text
@@ -91,7 +115,9 @@ class Claude(AbstractGenerativeModel):
     """
 
     @classmethod
-    def generate(cls, prompt: str) -> str:
+    def generate(
+        cls, prompt: str, options: GenerationOptions = GenerationOptions()
+    ) -> str:
         api_key = os.getenv("ANTHROPIC_API_KEY")
 
         if api_key is None:
@@ -103,10 +129,10 @@ class Claude(AbstractGenerativeModel):
 
         llm_code = model.completions.create(
             prompt=f"{HUMAN_PROMPT} {prompt}{AI_PROMPT}",
-            stop_sequences=[HUMAN_PROMPT],
+            stop_sequences=[HUMAN_PROMPT, *options.stop],
             model=os.getenv("ANTHROPIC_MODEL"),
-            temperature=float(os.getenv("TEMPERATURE", 0.7)),
-            max_tokens_to_sample=int(os.getenv("MAX_TOKENS", 3600)),
+            temperature=temperature(options),
+            max_tokens_to_sample=max_tokens(options),
         )
 
         return llm_code.completion
@@ -124,7 +150,9 @@ class Cohere(AbstractGenerativeModel):
     """
 
     @classmethod
-    def generate(cls, prompt: str) -> str:
+    def generate(
+        cls, prompt: str, options: GenerationOptions = GenerationOptions()
+    ) -> str:
         api_key = os.getenv("COHERE_API_KEY")
 
         if api_key is None:
@@ -137,13 +165,55 @@ class Cohere(AbstractGenerativeModel):
         response = co.generate(
             model=os.getenv("COHERE_MODEL"),
             prompt=prompt,
-            max_tokens=os.getenv("MAX_TOKENS"),
-            temperature=os.getenv("TEMPERATURE"),
+            max_tokens=max_tokens(options),
+            temperature=temperature(options),
+            stop_sequences=list(options.stop) or None,
         )
 
         return response.generations[0].text
 
 
+ADD = "def add(a, b):\n    return a + b\n"
+
+
+class CountingModel(AbstractGenerativeModel):
+    """
+    Stub model that returns the same code for every prompt and counts its calls
+
+    Args:
+        code (string): The code returned for every prompt.
+        delay (float): Seconds each generation takes.
+    """
+
+    def __init__(self, code: str = ADD, delay: float = 0.0) -> None:
+        self.code = code
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt: str) -> str:
+        with self._lock:
+            self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self.code
+
+
+class Critic(AbstractGenerativeModel):
+    """
+    Stub critic that accepts all code and counts its calls
+    """
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt: str) -> str:
+        with self._lock:
+            self.calls += 1
+        return "True"
+
+
 # class Palm(AbstractGenerativeModel):
 #     """
 #     PaLM API wrapper
@@ -0,0 +1,162 @@
+import time
+import asyncio
+import threading
+import pytest
+
+from generative.classes import generate_attribute
+from generative.concurrency import SingleFlight
+from generative.functions import adapt, catch, stack_trace
+from generative.keys import ValueKeyPolicy
+from generative.metaclasses import (
+    AbstractAsyncGenerativeModel,
+    AbstractGenerativeModel,
+)
+from generative.models import AsyncModelAdapter, as_async_model
+
+
+class AsyncFibonacci(AbstractAsyncGenerativeModel):
+    async def agenerate(self, prompt: str) -> str:
+        await asyncio.sleep(0.05)
+        return """
+        def fibonacci(n):
+            if n == 0:
+                return 0
+            elif n == 1:
+                return 1
+            else:
+                return fibonacci(n-1) + fibonacci(n-2)
+        """
+
+
+class AsyncAdd(AbstractAsyncGenerativeModel):
+    async def agenerate(self, prompt: str) -> str:
+        await asyncio.sleep(0.01)
+        return """
+        def add(a, b):
+            return a + b
+        """
+
+
+class AsyncBarrierAdd(AbstractAsyncGenerativeModel):
+    """
+    Only returns once `parties` generations are in flight at the same time
+    """
+
+    def __init__(self, parties):
+        self.parties = parties
+        self.calls = 0
+        self.all_in_flight = None
+
+    async def agenerate(self, prompt: str) -> str:
+        # Created on the running loop, which Python 3.8 and 3.9 bind events to
+        if self.all_in_flight is None:
+            self.all_in_flight = asyncio.Event()
+
+        self.calls += 1
+        if self.calls == self.parties:
+            self.all_in_flight.set()
+
+        # Times out instead of hanging if the generations run one after another
+        await asyncio.wait_for(self.all_in_flight.wait(), timeout=10)
+        return """
+        def add(a, b):
+            return a + b
+        """
+
+
+class AsyncCritic(AbstractAsyncGenerativeModel):
+    async def agenerate(self, prompt: str) -> str:
+        return "True"
+
+
+class SlowSyncModel(AbstractGenerativeModel):
+    def generate(self, prompt: str) -> str:
+        time.sleep(0.05)
+        return "Human-readable summary: (func) failed"
+
+
+class BarrierSyncModel(AbstractGenerativeModel):
+    """
+    Only returns once `parties` generations are running at the same time
+    """
+
+    def __init__(self, parties):
+        self.barrier = threading.Barrier(parties, timeout=10)
+
+    def generate(self, prompt: str) -> str:
+        self.barrier.wait()
+        return "ok"
+
+
+def test_async_adapt_keeps_generations_in_flight():
+    model = AsyncBarrierAdd(200)
+
+    # Every call has its own key, so the generations cannot be coalesced
+    @adapt(
+        model=model,
+        critic=AsyncCritic(),
+        key_policy=ValueKeyPolicy(),
+        single_flight=SingleFlight(),
+    )
+    async def add(a, b):
+        return a - b
+
+    async def main():
+        return await asyncio.gather(*(add(1, n) for n in range(200)))
+
+    # The model only answers once all 200 generations are in flight together
+    results = asyncio.run(main())
+
+    assert results == [n + 1 for n in range(200)]
+    assert model.calls == 200
+
+
+def test_async_catch():
+    @catch(model=AsyncAdd())
+    async def add(a, b):
+        raise Exception("Original function exception")
+
+    assert asyncio.run(add(3, 4)) == 7
+
+
+def test_async_stack_trace_with_sync_model():
+    @stack_trace(model=SlowSyncModel())
+    async def func():
+        raise ValueError("Induced exception")
+
+    with pytest.raises(Exception) as info:
+        asyncio.run(func())
+
+    assert "Human-readable summary" in str(info.value)
+
+
+def test_async_model_adapter_runs_sync_models_concurrently():
+    model = as_async_model(BarrierSyncModel(50))
+    assert isinstance(model, AsyncModelAdapter)
+
+    async def main():
+        return await asyncio.gather(*(model.agenerate("prompt") for _ in range(50)))
+
+    # The model only answers once all 50 calls are running together
+    assert asyncio.run(main()) == ["ok"] * 50
+
+
+def test_async_generate_attribute():
+    @generate_attribute(model=AsyncAdd(), critic=AsyncCritic())
+    class Calculator:
+        def subtract(self, a, b):
+            return a - b
+
+    calculator = Calculator()
+    assert asyncio.run(calculator.add(a=1, b=2)) == 3
+
+    # The generated function is installed on the class and stays awaitable
+    assert asyncio.run(Calculator().add(a=3, b=4)) == 7
+
+
+def test_sync_function_rejects_async_model():
+    with pytest.raises(TypeError):
+
+        @adapt(model=AsyncFibonacci())
+        def fibonacci(n):
+            return n
@@ -0,0 +1,259 @@
+import pytest
+import unittest.mock as mock
+
+from generative.cache import (
+    LRUCache,
+    CompiledFunctionCache,
+    NegativeCache,
+    VerdictCache,
+    compile_function,
+    critique,
+)
+from generative.databases import MemoryDatabase
+from generative.keys import ValueKeyPolicy
+from generative.classes import generate_attribute
+from generative.functions import adapt, catch
+from generative.metaclasses import AbstractGenerativeModel
+
+from .model import CountingModel, Critic
+
+BROKEN = "def add(a, b):\n    return (a +\n"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.get("b") is None
+    assert cache.stats() == {
+        "hits": 3,
+        "misses": 1,
+        "evictions": 1,
+        "size": 2,
+        "maxsize": 2,
+    }
+
+
+def test_lru_cache_rejects_non_positive_size():
+    with pytest.raises(ValueError):
+        LRUCache(maxsize=0)
+
+
+def test_compile_function_strips_surrounding_text():
+    code = """
+    Here is the function:
+    def add(a, b):
+        return a + b
+    ### END FUNCTION ###
+    """
+    compiled = compile_function(code)
+    assert compiled.name == "add"
+    assert compiled.func(3, 4) == 7
+
+
+def test_adapt_compiles_cached_code_once():
+    code = """
+    def add(a, b):
+        return sum([a, b])
+    """
+    cache = CompiledFunctionCache(maxsize=8)
+
+    @adapt(code, cache=cache)
+    def add(a, b):
+        return a + b
+
+    with mock.patch(
+        "generative.functions.compile_function", wraps=compile_function
+    ) as compile_spy:
+        assert add(3, 4) == 7
+        assert add(5, 6) == 11
+
+        # Resolving the implementation again reuses the compiled function
+        add._implementation.set({})
+        assert add(1, 1) == 2
+
+    compile_spy.assert_called_once()
+    assert cache.misses == 1
+    assert cache.hits == 1
+
+
+def test_negative_cache_backs_off_exponentially_up_to_cap():
+    clock = Clock()
+    failures = NegativeCache(base_delay=1.0, max_delay=4.0, clock=clock)
+
+    assert not failures.should_skip("add")
+    assert [failures.record_failure("add") for _ in range(4)] == [1.0, 2.0, 4.0, 4.0]
+    assert failures.should_skip("add")
+
+    clock.now = 4.0
+    assert not failures.should_skip("add")
+
+    failures.record_success("add")
+    assert "add" not in failures
+    assert failures.stats() == {"failures": 4, "skips": 1, "size": 0}
+
+
+def test_adapt_skips_generation_for_recently_failed_keys():
+    clock = Clock()
+    failures = NegativeCache(base_delay=10.0, clock=clock)
+    model = CountingModel(BROKEN)
+
+    @adapt(model=model, negative_cache=failures)
+    def add(a, b):
+        return a + b
+
+    assert add(3, 4) == 7
+    assert add(3, 4) == 7
+    assert add(3, 4) == 7
+    assert model.calls == 1
+    assert failures.stats()["skips"] == 2
+
+    # The key is retried once its back-off expires, then backs off for longer
+    clock.now = 10.0
+    assert add(3, 4) == 7
+    assert model.calls == 2
+    assert failures.record_failure((add._context.identity, "add")) == 40.0
+
+
+def test_catch_reraises_without_generating_for_recently_failed_functions():
+    failures = NegativeCache(base_delay=10.0, clock=Clock())
+    model = CountingModel(BROKEN)
+
+    @catch(model=model, negative_cache=failures)
+    def add(a, b):
+        raise ValueError("broken")
+
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            add(3, 4)
+
+    assert model.calls == 1
+    assert failures.stats()["skips"] == 2
+
+
+def test_rejected_compilations_are_backed_off():
+    # RestrictedPython rejects names starting with an underscore
+    rejected = "def add(a, b):\n    _total = a + b\n    return _total\n"
+
+    adapt_model = CountingModel(rejected)
+    adapt_failures = NegativeCache(base_delay=10.0, clock=Clock())
+
+    @adapt(
+        model=adapt_model,
+        critic=Critic(),
+        negative_cache=adapt_failures,
+        cache=CompiledFunctionCache(maxsize=8),
+    )
+    def add(a, b):
+        return a + b
+
+    assert [add(3, 4) for _ in range(3)] == [7, 7, 7]
+    assert adapt_model.calls == 1
+    assert adapt_failures.stats()["skips"] == 2
+
+    attribute_model = CountingModel(rejected)
+    attribute_failures = NegativeCache(base_delay=10.0, clock=Clock())
+
+    @generate_attribute(
+        model=attribute_model, critic=Critic(), negative_cache=attribute_failures
+    )
+    class Calculator:
+        pass
+
+    for _ in range(3):
+        with pytest.raises(AttributeError):
+            Calculator().add(3, 4)
+
+    assert attribute_model.calls == 1
+    assert attribute_failures.stats()["skips"] == 2
+
+
+def test_generate_attribute_does_not_back_off_model_errors():
+    class BuggyModel(AbstractGenerativeModel):
+        def generate(self, prompt: str) -> str:
+            raise AttributeError("'Client' object has no attribute 'complete'")
+
+    failures = NegativeCache(base_delay=10.0, clock=Clock())
+
+    @generate_attribute(model=BuggyModel(), critic=Critic(), negative_cache=failures)
+    class Calculator:
+        pass
+
+    with pytest.raises(AttributeError, match="Client"):
+        Calculator().add(3, 4)
+
+    assert failures.stats()["failures"] == 0
+
+
+def test_verdict_cache_ignores_formatting_and_persists():
+    db = MemoryDatabase()
+    verdicts = VerdictCache(maxsize=8, database=db)
+
+    verdicts.record("def add(a, b):\n    return a + b\n", True)
+
+    assert verdicts.verdict("def add(a, b):\n\n    # sum\n    return (a + b)") is True
+    assert verdicts.verdict("def add(a, b):\n    return a - b\n") is None
+
+    # A fresh process finds the verdict in the database
+    restarted = VerdictCache(maxsize=8, database=db)
+    assert restarted.verdict("def add(a, b):\n    return a + b\n") is True
+
+
+def test_verdict_cache_keeps_critics_apart():
+    class Strict(AbstractGenerativeModel):
+        def generate(self, prompt):
+            return "False"
+
+    class Lenient(AbstractGenerativeModel):
+        def generate(self, prompt):
+            return "True"
+
+    verdicts = VerdictCache(maxsize=8)
+    code = "def add(a, b):\n    return a + b\n"
+
+    verdicts.record(code, False, Strict())
+
+    assert verdicts.verdict(code, Strict()) is False
+    assert verdicts.verdict(code, Lenient) is None
+
+
+def test_critique_reuses_verdicts():
+    critic = Critic()
+    verdicts = VerdictCache(maxsize=8)
+
+    assert critique(critic, "def add(a, b):\n    return a + b\n", verdicts) is True
+    assert critique(critic, "def add(a, b):\n    return (a + b)\n", verdicts) is True
+
+    assert critic.calls == 1
+
+
+def test_adapt_asks_critic_once_for_identical_code():
+    critic = Critic()
+
+    @adapt(
+        model=CountingModel(),
+        critic=critic,
+        key_policy=ValueKeyPolicy(),
+        verdicts=VerdictCache(maxsize=8),
+    )
+    def add(a, b):
+        return a - b
+
+    assert add(3, 4) == 7
+    assert add(5, 6) == 11
+
+    assert critic.calls == 1
@@ -2,8 +2,9 @@
 import pytest
 import unittest.mock as mock
 from unittest.mock import Mock
+from generative.databases import MemoryDatabase
 from generative.functions import catch
-from .model import GPT4
+from .model import GPT4, CountingModel
 
 
 @pytest.fixture
@@ -30,3 +31,32 @@ def test_catch_with_gpt(model, mock_gpt4_catch):
         # Since the original function raises an exception, we expect the LLM
         # to provide an implementation that returns the sum of a and b
         assert func(3, 4) == 7
+
+
+def deploy(model, db):
+    @catch(model=model, database=db)
+    def add(a, b):
+        if a < 0:
+            raise ValueError("negative")
+        raise Exception("Original function exception")
+
+    return add
+
+
+def test_catch_reuses_repairs_by_failure():
+    model = CountingModel()
+    db = MemoryDatabase()
+    add = deploy(model, db)
+
+    assert add(3, 4) == 7
+    assert add(5, 6) == 11
+    assert model.calls == 1
+
+    # The repair was stored under the failure's fingerprint and is found after a restart
+    assert deploy(model, db)(1, 2) == 3
+    assert model.calls == 1
+
+    # A different exception on a different line is a different failure
+    assert add(-1, 2) == 1
+    assert model.calls == 2
+    assert db.count() == 2
@@ -0,0 +1,237 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from generative.cache import CompiledFunctionCache, compile_function
+from generative.concurrency import SingleFlight
+from generative.index import class_signature
+from generative.functions import Implementation, adapt, catch
+from .model import ADD, CountingModel, Critic
+
+
+def run_concurrently(fn, n):
+    barrier = threading.Barrier(n)
+
+    def call():
+        barrier.wait()
+        return fn()
+
+    with ThreadPoolExecutor(max_workers=n) as executor:
+        return list(executor.map(lambda _: call(), range(n)))
+
+
+def test_single_flight_coalesces_threads():
+    flight = SingleFlight()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return "result"
+
+    results = run_concurrently(lambda: flight.do("key", slow), 20)
+
+    assert results == ["result"] * 20
+    assert len(calls) == 1
+    assert flight.coalesced == 19
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+
+    def fail():
+        time.sleep(0.2)
+        raise RuntimeError("generation failed")
+
+    def call():
+        try:
+            flight.do("key", fail)
+        except RuntimeError:
+            return True
+        return False
+
+    assert all(run_concurrently(call, 10))
+
+
+def test_single_flight_rejects_unknown_policy():
+    with pytest.raises(ValueError):
+        SingleFlight(policy="race")
+
+
+def test_adapt_coalesces_concurrent_generations():
+    model = CountingModel(ADD, delay=0.2)
+    flight = SingleFlight()
+
+    @adapt(
+        model=model,
+        critic=Critic(),
+        cache=CompiledFunctionCache(maxsize=8),
+        single_flight=flight,
+    )
+    def add(a, b):
+        return a - b
+
+    results = run_concurrently(lambda: add(3, 4), 50)
+
+    assert results == [7] * 50
+    assert model.calls == 1
+    assert flight.coalesced == 49
+
+
+def test_adapt_fallback_policy_runs_original_function():
+    model = CountingModel(ADD, delay=0.2)
+    flight = SingleFlight(policy="fallback")
+
+    @adapt(
+        model=model,
+        critic=Critic(),
+        cache=CompiledFunctionCache(maxsize=8),
+        single_flight=flight,
+    )
+    def add(a, b):
+        return a - b
+
+    results = run_concurrently(lambda: add(3, 4), 10)
+
+    assert sorted(results) == [-1] * 9 + [7]
+    assert model.calls == 1
+
+
+def test_catch_coalesces_concurrent_generations():
+    model = CountingModel(ADD, delay=0.2)
+    flight = SingleFlight()
+
+    @catch(model=model, single_flight=flight)
+    def add(a, b):
+        raise Exception("Original function exception")
+
+    results = run_concurrently(lambda: add(3, 4), 20)
+
+    assert results == [7] * 20
+    assert model.calls == 1
+    assert flight.coalesced == 19
+
+
+def test_async_adapt_coalesces_concurrent_generations():
+    model = CountingModel(ADD, delay=0.1)
+    flight = SingleFlight()
+
+    @adapt(
+        model=model,
+        critic=Critic(),
+        cache=CompiledFunctionCache(maxsize=8),
+        single_flight=flight,
+    )
+    async def add(a, b):
+        return a - b
+
+    async def main():
+        return await asyncio.gather(*(add(3, 4) for _ in range(100)))
+
+    assert asyncio.run(main()) == [7] * 100
+    assert model.calls == 1
+    assert flight.coalesced == 99
+
+
+def test_adapt_read_path_under_concurrent_swaps():
+    model = CountingModel(ADD, delay=0.05)
+    flight = SingleFlight()
+    cache = CompiledFunctionCache(maxsize=8)
+
+    @adapt(model=model, critic=Critic(), cache=cache, single_flight=flight)
+    def add(a, b):
+        return a - b
+
+    assert add(1, 2) == 3
+    implementations = [
+        add._implementation.get(),
+        {
+            (int, "add"): Implementation(
+                compile_function("def add(a, b):\n    return b + a\n"),
+                add._context.context_hash(int),
+                class_signature(int),
+            )
+        },
+    ]
+
+    threads, calls_per_thread = 8, 5000
+    stop = threading.Event()
+    swaps = []
+
+    def swap():
+        i = 0
+        while not stop.is_set():
+            add._implementation.set(implementations[i % 2])
+            i += 1
+        swaps.append(i)
+
+    def read(offset):
+        return all(add(i, offset) == i + offset for i in range(calls_per_thread))
+
+    swapper = threading.Thread(target=swap)
+    swapper.start()
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(read, range(threads)))
+    finally:
+        stop.set()
+        swapper.join()
+
+    # Every read ran one of the installed implementations while they were being swapped, and
+    # no read fell back to resolving it again
+    assert all(results)
+    assert swaps[0] > 0
+    assert model.calls == 1
+
+
+def test_single_flight_survives_a_cancelled_leader():
+    flight = SingleFlight()
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return 42
+
+    async def main():
+        leader = asyncio.ensure_future(flight.ado("k", work))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.ado("k", work))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+        return await waiter
+
+    assert asyncio.run(main()) == 42
+    assert len(runs) == 1
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_single_flight_cancels_abandoned_calls():
+    flight = SingleFlight()
+    finished = []
+
+    async def work():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+
+    async def main():
+        callers = [asyncio.ensure_future(flight.ado("k", work)) for _ in range(2)]
+        await asyncio.sleep(0)
+
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+
+    assert finished == []
+    assert flight.stats()["in_flight"] == 0
@@ -0,0 +1,176 @@
+import unittest.mock as mock
+
+from generative.cache import CompiledFunctionCache
+from generative.context import GenerationContext
+from generative.databases import MemoryDatabase
+from generative.functions import adapt
+from generative.keys import ValueKeyPolicy
+from .model import CountingModel, Critic
+
+
+class Calculator:
+    def add(self, a, b):
+        return a + b
+
+
+def test_generation_context_resolves_function_once():
+    def multiply(a, b):
+        return a * b
+
+    context = GenerationContext(multiply)
+    assert context.name == "multiply"
+    assert "return a * b" in context.source
+    assert context.identity.endswith("multiply")
+
+
+def test_generation_context_reuses_class_prompt_until_class_changes():
+    def subtract(self, a, b):
+        return a - b
+
+    context = GenerationContext(subtract)
+
+    with mock.patch(
+        "generative.context.inspect.getmembers", wraps=__import__("inspect").getmembers
+    ) as getmembers:
+        first = context.prompt(Calculator)
+        second = context.prompt(Calculator)
+        assert first is second
+        assert getmembers.call_count == 1
+
+        def negate(self, a):
+            return -a
+
+        Calculator.negate = negate
+        try:
+            third = context.prompt(Calculator)
+        finally:
+            del Calculator.negate
+
+        assert getmembers.call_count == 2
+        assert "negate" in third
+        assert "negate" not in first
+
+
+def test_generation_context_without_source():
+    context = GenerationContext(len)
+    assert context.source == ""
+    assert context.name == "len"
+
+
+def deploy_v1(model, db):
+    @adapt(model=model, critic=Critic(), database=db, cache=CompiledFunctionCache(8))
+    def add(a, b):
+        return a - b
+
+    return add
+
+
+def deploy_v2(model, db):
+    @adapt(model=model, critic=Critic(), database=db, cache=CompiledFunctionCache(8))
+    def add(a, b):
+        return a * b
+
+    return add
+
+
+def test_storage_key_includes_source_and_context_hashes():
+    def multiply(a, b):
+        return a * b
+
+    context = GenerationContext(multiply)
+    key = context.storage_key("multiply", Calculator)
+
+    assert key.startswith("multiply:")
+    assert context.source_hash[:16] in key
+    assert context.context_hash(Calculator)[:16] in key
+    assert key != context.storage_key("multiply", int)
+
+
+def test_records_survive_unchanged_redeploys_and_invalidate_on_change():
+    model = CountingModel()
+    db = MemoryDatabase()
+
+    assert deploy_v1(model, db)(3, 4) == 7
+    assert model.calls == 1
+
+    record = list(db._data.values())[0].data
+    assert record["source_hash"] == deploy_v1(model, db)._context.source_hash
+    assert "context_hash" in record
+
+    # Same source after a restart: the stored record is reused
+    assert deploy_v1(model, db)(3, 4) == 7
+    assert model.calls == 1
+
+    # Changed source: the old record is no longer reachable
+    assert deploy_v2(model, db)(3, 4) == 7
+    assert model.calls == 2
+
+
+def test_subclasses_resolve_their_own_implementation():
+    class Count(int):
+        def double(self):
+            return self * 2
+
+    model = CountingModel()
+    db = MemoryDatabase()
+    add = deploy_v1(model, db)
+
+    assert add(3, 4) == 7
+    assert add(Count(3), 4) == 7
+
+    # The subclass offers different context, so it gets its own generation and record
+    assert model.calls == 2
+    assert len(db._data) == 2
+    assert {(cls, "add") for cls in (int, Count)} == set(add._implementation.get())
+
+
+def test_installed_implementations_follow_class_changes():
+    class Count(int):
+        pass
+
+    def triple(self):
+        return self * 3
+
+    model = CountingModel()
+    db = MemoryDatabase()
+    add = deploy_v1(model, db)
+
+    assert add(Count(3), 4) == 7
+    assert add(Count(3), 4) == 7
+    assert model.calls == 1
+
+    # A new method changes the context, so the implementation is resolved again
+    setattr(Count, "triple", triple)
+    assert add(Count(3), 4) == 7
+    assert model.calls == 2
+
+
+def test_generated_code_is_stored_once_whatever_the_compile_cache_holds():
+    model = CountingModel()
+    db = MemoryDatabase()
+    cache = CompiledFunctionCache(8)
+
+    def deploy():
+        @adapt(
+            model=model,
+            critic=Critic(),
+            database=db,
+            cache=cache,
+            key_policy=ValueKeyPolicy(),
+        )
+        def add(a, b):
+            return a - b
+
+        return add
+
+    # The compiled code is already cached for a second key, but that key's record is stored
+    add = deploy()
+    assert add(3, 4) == 7
+    assert add(3, 5) == 8
+    assert len(db._data) == 2
+
+    # A restart reads the records back without calling the model or rewriting them
+    with mock.patch.object(db, "set", wraps=db.set) as set_record:
+        assert deploy()(3, 4) == 7
+    assert model.calls == 2
+    set_record.assert_not_called()
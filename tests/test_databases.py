@@ -0,0 +1,230 @@
+import gc
+import json
+import sqlite3
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from generative.databases import SQLiteDatabase, MemoryDatabase, TieredDatabase
+from generative.functions import adapt
+from generative.cache import CompiledFunctionCache
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / "generated.db"))
+    yield db
+    db.close()
+
+
+def capability(name, code, source_hash=None):
+    return {
+        "function_name": name,
+        "source_hash": source_hash,
+        "args": (1, 2),
+        "kwargs": {},
+        "generated_code": code,
+    }
+
+
+def test_sqlite_get_set_contains(sqlite_db):
+    assert not sqlite_db.contains("add")
+    assert sqlite_db.get("add") is None
+
+    sqlite_db.set("add", capability("add", "def add(a, b): return a + b"))
+
+    assert sqlite_db.contains("add")
+    assert sqlite_db.get("add")["generated_code"] == "def add(a, b): return a + b"
+
+
+def test_sqlite_uses_wal_and_indexes(sqlite_db, tmp_path):
+    connection = sqlite3.connect(str(tmp_path / "generated.db"))
+    journal_mode = connection.execute("PRAGMA journal_mode").fetchone()[0]
+    indexes = {
+        row[1] for row in connection.execute("PRAGMA index_list(generated_code)")
+    }
+    connection.close()
+
+    assert journal_mode == "wal"
+    assert "idx_generated_code_function_name" in indexes
+    assert "idx_generated_code_source_hash" in indexes
+
+
+def test_sqlite_batches_writes(tmp_path):
+    path = str(tmp_path / "generated.db")
+    db = SQLiteDatabase(path, batch_size=3)
+    reader = SQLiteDatabase(path)
+
+    db.set("a", capability("a", "def a(): return 1"))
+    db.set("b", capability("b", "def b(): return 2"))
+
+    # Buffered records are visible to the writer but not yet committed
+    assert db.get("a")["generated_code"] == "def a(): return 1"
+    assert reader.get("a") is None
+
+    db.set("c", capability("c", "def c(): return 3"))
+    assert reader.get("a")["generated_code"] == "def a(): return 1"
+    assert reader.count() == 3
+
+    db.close()
+    reader.close()
+
+
+def test_sqlite_writes_buffered_records_when_dropped(tmp_path):
+    path = str(tmp_path / "generated.db")
+    db = SQLiteDatabase(path, batch_size=3)
+
+    db.set("a", capability("a", "def a(): return 1"))
+    del db
+    gc.collect()
+
+    reader = SQLiteDatabase(path)
+    assert reader.get("a")["generated_code"] == "def a(): return 1"
+    reader.close()
+
+
+def test_sqlite_writes_buffered_records_at_exit(tmp_path):
+    path = str(tmp_path / "generated.db")
+    script = (
+        "from generative.databases import SQLiteDatabase\n"
+        f"db = SQLiteDatabase({path!r}, batch_size=3)\n"
+        "db.set('a', {'generated_code': 'def a(): return 1'})\n"
+    )
+
+    subprocess.run([sys.executable, "-c", script], check=True)
+
+    reader = SQLiteDatabase(path)
+    assert reader.get("a")["generated_code"] == "def a(): return 1"
+    reader.close()
+
+
+def test_sqlite_find_by_function_name_and_source_hash(sqlite_db):
+    sqlite_db.set_many(
+        [
+            ("add:1", capability("add", "def add(a, b): return a + b", "h1")),
+            ("add:2", capability("add", "def add(a, b): return b + a", "h2")),
+            ("sub:1", capability("sub", "def sub(a, b): return a - b", "h1")),
+        ]
+    )
+
+    assert len(sqlite_db.find(function_name="add")) == 2
+    assert len(sqlite_db.find(source_hash="h1")) == 2
+    assert len(sqlite_db.find(function_name="add", source_hash="h2")) == 1
+
+
+def test_sqlite_shared_across_threads(sqlite_db):
+    def write(i):
+        sqlite_db.set(f"f{i}", capability(f"f{i}", f"def f{i}(): return {i}"))
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sqlite_db.count() == 8
+
+
+def test_adapt_with_sqlite_database(sqlite_db):
+    code = """
+    def add(a, b):
+        return sum([a, b])
+    """
+
+    @adapt(code, database=sqlite_db, cache=CompiledFunctionCache(maxsize=8))
+    def add(a, b):
+        return a + b
+
+    # Nothing is stored for the function, so it runs unchanged
+    assert add(3, 4) == 7
+    sqlite_db.set(
+        add._context.storage_key("add", int),
+        capability("add", "def add(a, b):\n    return a * b\n"),
+    )
+    add._implementation.set({})
+
+    assert add(3, 4) == 12
+
+
+def test_memory_database_evicts_least_recently_used():
+    db = MemoryDatabase(max_entries=2)
+    db.set("a", capability("a", "def a(): return 1"))
+    db.set("b", capability("b", "def b(): return 2"))
+    db.get("a")
+    db.set("c", capability("c", "def c(): return 3"))
+
+    assert db.contains("a")
+    assert not db.contains("b")
+    assert db.contains("c")
+    assert db.stats()["evictions"] == 1
+
+
+def test_memory_database_limits_bytes():
+    record = capability("a", "def a(): return 1")
+    size = len(json.dumps(record))
+    db = MemoryDatabase(max_entries=100, max_bytes=size * 3)
+
+    for i in range(10):
+        db.set(str(i), record)
+
+    assert db.count() == 3
+    assert db.stats()["bytes"] <= size * 3
+    assert db.get("9") == record
+    assert db.get("0") is None
+
+
+def test_memory_database_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("generative.databases.time.monotonic", lambda: now[0])
+
+    db = MemoryDatabase(ttl=10)
+    db.set("a", capability("a", "def a(): return 1"))
+    db.set("b", capability("b", "def b(): return 2"), ttl=60)
+
+    now[0] += 30
+    assert db.get("a") is None
+    assert db.get("b") is not None
+    assert db.stats()["expirations"] == 1
+    assert db.stats()["hits"] == 1
+    assert db.stats()["misses"] == 1
+
+
+def test_tiered_database_promotes_reads(sqlite_db):
+    memory = MemoryDatabase()
+    db = TieredDatabase(memory, sqlite_db)
+    sqlite_db.set("add", capability("add", "def add(a, b): return a + b"))
+
+    assert db.get("add")["generated_code"] == "def add(a, b): return a + b"
+    assert memory.contains("add")
+    assert db.get("add") is not None
+    assert db.get("missing") is None
+
+    stats = db.stats()
+    assert [tier["hits"] for tier in stats["tiers"]] == [1, 1]
+    assert [tier["lookups"] for tier in stats["tiers"]] == [3, 2]
+    assert stats["tiers"][1]["hit_ratio"] == 0.5
+    assert stats["misses"] == 1
+
+
+def test_tiered_database_writes_through(sqlite_db):
+    memory = MemoryDatabase()
+    db = TieredDatabase(memory, sqlite_db)
+    db.set("add", capability("add", "def add(a, b): return a + b"))
+
+    assert memory.contains("add")
+    assert sqlite_db.contains("add")
+
+
+def test_tiered_database_writes_behind(sqlite_db):
+    memory = MemoryDatabase()
+    db = TieredDatabase(memory, sqlite_db, write_behind=True)
+
+    for i in range(50):
+        db.set(f"f{i}", capability(f"f{i}", f"def f{i}(): return {i}"))
+
+    assert memory.contains("f49")
+    db.flush()
+    assert sqlite_db.count() == 50
+    db.close()
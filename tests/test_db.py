@@ -96,4 +96,6 @@ def test_selfheal_with_gpt4(
                 assert fibonacci(8) == 21
 
                 # Now, we'll assert that the mock Redis was interacted with as expected.
-                mock_vector_db.set.assert_called_once()
+                # The code came from the database, so it is not written back.
+                mock_vector_db.get.assert_called_once()
+                mock_vector_db.set.assert_not_called()
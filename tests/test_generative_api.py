@@ -1,8 +1,15 @@
+import copy
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 import unittest.mock as mock
 from unittest.mock import Mock, MagicMock
-from .model import GPT4, Claude
-from generative.classes import generate_attribute
+from .model import GPT4, Claude, CountingModel, Critic
+from generative.classes import (
+    evict_generated_members,
+    generate_attribute,
+    generated_members,
+)
 
 
 @pytest.fixture
@@ -46,17 +53,9 @@ def model_resp():
 def mock_gpt4_generate_attributes():
     response = Mock()
     response.choices = [Mock()]
-    response.choices[
-        0
-    ].message.content = """
-    def save_custom_mode(modes):
-        for mode in modes['study-mode']:
-            if mode['action'] == 'disable-notifications':
-                disable_notifications(mode['component'])
-            elif mode['action'] == 'set-volume':
-                set_volume(mode['component'], mode['parameters'])
-            elif mode['action'] in ['block-all', 'unblock']:
-                manage_block(mode['component'], mode['action'], mode['parameters'])
+    response.choices[0].message.content = """
+    def save_custom_mode(**modes):
+        return modes
     """
     return response
 
@@ -95,3 +94,51 @@ def test_imagined_action_with_gpt(
                         break
                     except AttributeError:
                         assert False
+
+
+def test_generate_attribute_only_intercepts_missing_attributes():
+    model = MagicMock()
+
+    @generate_attribute(model=model)
+    class Mobile(object):
+        def __init__(self):
+            self.volume = 3
+
+        def phone(self):
+            return "ringing"
+
+    mobile = Mobile()
+
+    # Normal lookups go through object.__getattribute__ untouched
+    assert type(mobile).__getattribute__ is object.__getattribute__
+    assert mobile.volume == 3
+    assert mobile.phone() == "ringing"
+
+    # Special names are not generated, so protocols such as copy keep working
+    assert copy.copy(mobile).volume == 3
+    assert callable(mobile.set_volume)
+    model.generate.assert_not_called()
+
+
+def test_generate_attribute_installs_generated_functions_on_the_class():
+    model = CountingModel(delay=0.05)
+
+    @generate_attribute(model=model, critic=Critic())
+    class Calculator:
+        pass
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda i: Calculator().add(a=i, b=1), range(8)))
+
+    assert results == [i + 1 for i in range(8)]
+    assert model.calls == 1
+
+    # Later accesses are plain attribute lookups
+    assert "add" in vars(Calculator)
+    assert Calculator().add(2, 3) == 5
+    assert list(generated_members(Calculator)) == ["add"]
+    assert "return a + b" in generated_members(Calculator)["add"]
+
+    evict_generated_members(Calculator, "add")
+    assert "add" not in vars(Calculator)
+    assert generated_members(Calculator) == {}
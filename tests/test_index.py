@@ -0,0 +1,247 @@
+import ast
+import unittest.mock as mock
+
+from generative.functions import adapt
+
+from generative.index import (
+    context_index,
+    identifier_terms,
+    index_function,
+    select_context,
+)
+from generative.metaclasses import GenerativeMetaClass
+from generative.prompt import format_generative_function
+
+
+class Thermostat:
+    def read(self, unit="C"):
+        """Return the current temperature."""
+        return 21
+
+    def set_target(self, value):
+        self.target = value
+
+
+def test_context_index_describes_class_functions():
+    index = context_index(Thermostat)
+    read, set_target = index.entries()
+
+    assert read.name == "read"
+    assert read.signature == "def read(self, unit='C')"
+    assert read.docstring == "Return the current temperature."
+    assert read.source.startswith("def read(self")
+    assert read.tokens > 0
+    assert set_target.signature == "def set_target(self, value)"
+    assert index.tokens() == read.tokens + set_target.tokens
+
+
+def test_context_index_is_stored_on_the_class_and_reused():
+    class Fan:
+        def spin(self):
+            return "whirr"
+
+    with mock.patch(
+        "generative.index.inspect.getmembers", wraps=__import__("inspect").getmembers
+    ) as getmembers:
+        index = context_index(Fan)
+        assert context_index(Fan) is index
+        assert Fan.__dict__["_context_index"] is index
+        assert getmembers.call_count == 1
+
+        index.add("stop", "def stop():\n    return 'silence'\n")
+
+        def reverse(self):
+            return "rrihw"
+
+        Fan.reverse = reverse
+        rebuilt = context_index(Fan)
+
+    assert rebuilt is not index
+    assert getmembers.call_count == 2
+    assert "reverse" in rebuilt
+    assert "stop" in rebuilt
+
+
+def test_metaclass_generate_updates_the_index():
+    class Radio(metaclass=GenerativeMetaClass):
+        def tune(self, frequency):
+            return frequency
+
+    before = context_index(Radio).context_hash()
+
+    with mock.patch(
+        "generative.index.inspect.getmembers", wraps=__import__("inspect").getmembers
+    ) as getmembers:
+        Radio.generate(Radio, "def mute():\n    return 0\n")
+
+        assert Radio.mute() == 0
+        assert "mute" in context_index(Radio)
+        assert context_index(Radio).context_hash() != before
+        assert getmembers.call_count == 0
+
+
+def test_instance_generate_leaves_the_class_index_alone():
+    class Radio(metaclass=GenerativeMetaClass):
+        def tune(self, frequency):
+            return frequency
+
+    radio = Radio()
+    before = context_index(Radio).context_hash()
+
+    radio.generate("def mute():\n    return 0\n")
+
+    assert radio.mute() == 0
+    assert "mute" not in context_index(Radio)
+    assert context_index(Radio).context_hash() == before
+
+
+def test_prompt_renders_index_as_source():
+    prompt = format_generative_function(
+        "def warm(self):\n    pass\n", context_index(Thermostat)
+    )
+
+    assert "Available functions:" in prompt
+    assert 'def read(self, unit="C"):\n' in prompt
+    assert "\\n" not in prompt
+    assert "('read'" not in prompt
+
+
+class Ledger:
+    def deposit(self, amount):
+        """Add money to the balance."""
+        self.balance = self.balance + amount
+        return self.balance
+
+    def withdraw(self, amount):
+        """Take money from the balance."""
+        self.balance = self.balance - amount
+        return self.balance
+
+    def render_report(self, template, title):
+        """Render a printable report."""
+        header = template.format(title=title, width=80, margin=4, border="=")
+        footer = template.format(title="end", width=80, margin=4, border="-")
+        return header + footer
+
+    def export_csv(self, path, rows, delimiter):
+        """Write rows to a CSV file."""
+        lines = [delimiter.join(str(cell) for cell in row) for row in rows]
+        return path, "\n".join(lines)
+
+
+def test_identifier_terms_split_names():
+    terms = identifier_terms("def setTarget(self, max_value): return HTTPError")
+
+    assert terms["set"] == terms["target"] == terms["max"] == terms["value"] == 1
+    assert terms["http"] == terms["error"] == 1
+    assert "self" not in terms
+    assert "def" not in terms
+
+
+def test_select_context_ranks_relevant_functions_first():
+    index = context_index(Ledger)
+    target = "def transfer(self, amount, other):\n    return self.withdraw(amount)\n"
+
+    full, summaries = select_context(index, target, top_k=2, max_tokens=10_000)
+
+    assert [entry.name for entry in full] == ["withdraw", "deposit"]
+    assert {entry.name for entry in summaries} == {"export_csv", "render_report"}
+
+
+def test_select_context_respects_token_budget():
+    index = context_index(Ledger)
+    target = "def transfer(self, amount):\n    pass\n"
+    budget = index.tokens() // 2
+
+    full, summaries = select_context(index, target, top_k=8, max_tokens=budget)
+
+    assert sum(entry.tokens for entry in full) <= budget
+    assert len(full) + len(summaries) == len(index)
+    assert "render_report" in [entry.name for entry in summaries]
+
+
+def test_prompt_summarizes_functions_outside_the_budget():
+    prompt = format_generative_function(
+        "def transfer(self, amount):\n    pass\n",
+        context_index(Ledger),
+        max_context_tokens=70,
+        max_context_functions=2,
+    )
+
+    assert "def deposit(self, amount):\n" in prompt
+    assert "Other available functions (signatures only):" in prompt
+    assert (
+        "def render_report(self, template, title): Render a printable report." in prompt
+    )
+    assert "template.format" not in prompt
+
+
+def test_minified_prompt_strips_context_and_target():
+    target = (
+        '@adapt(model=None)\ndef warm(self):\n    """Raise the target."""\n    # TODO\n'
+    )
+
+    prompt = format_generative_function(target, context_index(Thermostat), minify=True)
+
+    assert "Return the current temperature." not in prompt
+    assert 'def read(self, unit="C"):\n    return 21' in prompt
+    assert "@adapt" not in prompt
+    assert "# TODO" not in prompt
+    assert '"""Raise the target."""' in prompt
+
+
+class Account:
+    def deposit(self, amount):
+        return amount
+
+    @adapt(code="def withdraw(amount):\n    return -amount\n")
+    def withdraw(self, amount):
+        """Take money out."""
+        return -amount
+
+
+def test_index_describes_decorated_functions_by_their_source():
+    entry = {entry.name: entry for entry in context_index(Account).entries()}[
+        "withdraw"
+    ]
+
+    assert entry.signature == "def withdraw(self, amount)"
+    assert entry.docstring == "Take money out."
+    assert entry.source.startswith("def withdraw(self, amount):")
+    assert "single_flight" not in entry.source
+
+
+def test_function_is_left_out_of_its_own_context():
+    prompt = format_generative_function(
+        Account.withdraw._context.source, context_index(Account)
+    )
+
+    assert "def deposit(self, amount)" in prompt.suffix
+    assert "Take money out." not in prompt.suffix.split("Source code:")[0]
+    assert "wrapper" not in prompt
+
+
+def test_select_context_does_not_reward_the_targets_own_name():
+    index = context_index(Ledger)
+    target = (
+        "def withdraw(self, amount):\n"
+        "    return self.deposit(-amount) if amount else withdraw(self, 0)\n"
+    )
+    budget = index.tokens()
+
+    full, summaries = select_context(index, target, top_k=1, max_tokens=budget)
+
+    assert [entry.name for entry in full] == ["deposit"]
+    assert "withdraw" not in [entry.name for entry in full + summaries]
+
+
+def test_signature_without_unparse_matches_unparse(monkeypatch):
+    source = (
+        "def move(self, a, /, b: int = 1, *rest, c, d: str = 'x', **options) -> None:\n"
+        "    pass\n"
+    )
+    expected = index_function("move", source).signature
+
+    monkeypatch.delattr(ast, "unparse")
+
+    assert index_function("move", source).signature == expected
@@ -0,0 +1,89 @@
+import array
+
+import pytest
+
+from generative.cache import CompiledFunctionCache
+from generative.functions import adapt
+from generative.keys import (
+    FunctionKeyPolicy,
+    ShapeKeyPolicy,
+    ValueKeyPolicy,
+    describe_shape,
+)
+from generative.databases import MemoryDatabase
+
+
+def test_function_key_policy_ignores_arguments():
+    policy = FunctionKeyPolicy()
+    assert policy.key("add", (1, 2), {}) == "add"
+    assert policy.key("add", (list(range(10**6)),), {"x": 1}) == "add"
+
+
+def test_shape_key_policy_groups_by_type_and_length():
+    policy = ShapeKeyPolicy()
+
+    assert policy.key("f", ([1, 2, 3],), {}) == policy.key("f", ([4, 5, 6],), {})
+    assert policy.key("f", ([1, 2, 3],), {}) != policy.key("f", ([1, 2],), {})
+    assert policy.key("f", (1,), {}) != policy.key("f", ("1",), {})
+    assert policy.key("f", (), {"a": 1, "b": 2}) == policy.key(
+        "f", (), {"b": 3, "a": 4}
+    )
+
+
+def test_describe_shape_uses_shape_and_dtype():
+    class Array:
+        shape = (3, 4)
+        dtype = "float64"
+
+    assert describe_shape(Array()).endswith("Array[3, 4]:float64")
+    assert describe_shape([1, 2]) == "builtins.list[2]"
+
+
+def test_value_key_policy_is_canonical():
+    policy = ValueKeyPolicy()
+
+    assert policy.key("f", ({"a": 1, "b": 2},), {}) == policy.key(
+        "f", ({"b": 2, "a": 1},), {}
+    )
+    assert policy.key("f", ({1, 2, 3},), {}) == policy.key("f", ({3, 2, 1},), {})
+    assert policy.key("f", ([1, 2],), {}) != policy.key("f", ((1, 2),), {})
+    assert policy.key("f", (1,), {}) != policy.key("f", ("1",), {})
+    assert policy.key("f", (), {"x": 1}) != policy.key("f", (), {"x": 2})
+
+
+def test_value_key_policy_hashes_buffers():
+    policy = ValueKeyPolicy()
+    first = array.array("d", range(1000))
+    second = array.array("d", range(1000))
+    second[-1] = -1
+
+    assert policy.key("f", (first,), {}) != policy.key("f", (second,), {})
+
+
+def test_value_key_policy_hashes_numpy_arrays():
+    numpy = pytest.importorskip("numpy")
+    policy = ValueKeyPolicy()
+    values = numpy.arange(12, dtype="float64").reshape(3, 4)
+
+    assert policy.key("f", (values,), {}) == policy.key("f", (values.copy(),), {})
+    assert policy.key("f", (values,), {}) != policy.key("f", (values.T,), {})
+
+
+def test_adapt_stores_and_reads_under_policy_key():
+    db = MemoryDatabase()
+    policy = ShapeKeyPolicy()
+
+    @adapt(database=db, key_policy=policy, cache=CompiledFunctionCache(maxsize=8))
+    def scale(a, b):
+        return a
+
+    key = policy.key("scale", ([1, 2],), {})
+    db.set(
+        scale._context.storage_key(key, int),
+        {"generated_code": "def scale(a, b):\n    return a * len(b)\n"},
+    )
+
+    # Calls whose arguments share the stored shape use the stored implementation
+    assert scale(3, [7, 8]) == 6
+    assert scale(3, [7, 8, 9]) == 3
+    assert set(scale._implementation.get()) == {(int, key)}
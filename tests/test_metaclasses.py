@@ -5,6 +5,7 @@ from unittest.mock import Mock
 from io import StringIO
 
 from .model import GPT4
+from generative.databases import MemoryDatabase
 from generative.metaclasses import GenerativeMetaClass
 from generative.prompt import format_generative_function
 
@@ -64,3 +65,23 @@ def test_generative_metaclass_with_gpt(mock_gpt4_metaclass):
         assert a_good_boy.do_trick() == "*sit*"
         a_good_boy.set_treat("roast beef")
         assert a_good_boy.stomach == "roast beef"
+
+
+def test_metaclass_versions_stored_methods():
+    class Bike(metaclass=GenerativeMetaClass):
+        def pedal(self):
+            return 1
+
+    db = MemoryDatabase()
+    Bike().generate("def ring():\n    return 'ring'\n", db)
+    Bike().generate("def ring():\n    return 'RING'\n", db)
+
+    records = [entry.data for entry in db._data.values()]
+
+    assert len(records) == 2
+    assert all(key.startswith("ring:") for key in db._data)
+    assert {record["generated_code"] for record in records} == {
+        "def ring():\n    return 'ring'\n",
+        "def ring():\n    return 'RING'\n",
+    }
+    assert len({record["source_hash"] for record in records}) == 2
@@ -0,0 +1,210 @@
+import time
+import asyncio
+
+from generative.cache import VerdictCache
+from generative.classes import generate_attribute
+from generative.functions import adapt
+from generative.metaclasses import (
+    AbstractAsyncStreamingGenerativeModel,
+    AbstractGenerativeModel,
+    AbstractStreamingGenerativeModel,
+    GenerationOptions,
+)
+from generative.models import (
+    CODE_GENERATION_OPTIONS,
+    CRITIC_OPTIONS,
+    AsyncModelAdapter,
+    StreamMetrics,
+    agenerate_code,
+    generate_code,
+    generate_with,
+)
+
+
+class RecordingModel(AbstractGenerativeModel):
+    def __init__(self, output):
+        self.output = output
+        self.options = []
+
+    def generate(self, prompt: str, options: GenerationOptions = GenerationOptions()):
+        self.options.append(options)
+        return self.output
+
+
+class PromptOnlyModel(AbstractGenerativeModel):
+    def generate(self, prompt: str) -> str:
+        return f"echo: {prompt}"
+
+
+def test_adapt_passes_tight_options_to_model_and_critic():
+    model = RecordingModel("def multiply(a, b):\n    return a * b\n")
+    critic = RecordingModel("True")
+
+    @adapt(model=model, critic=critic, verdicts=VerdictCache(maxsize=8))
+    def multiply(a, b):
+        return a + b
+
+    assert multiply(3, 4) == 12
+
+    assert model.options == [CODE_GENERATION_OPTIONS]
+    assert "### END FUNCTION ###" in model.options[0].stop
+    assert critic.options == [CRITIC_OPTIONS]
+    assert critic.options[0].max_tokens <= 5
+
+
+def test_generate_attribute_passes_code_generation_options():
+    model = RecordingModel("def triple(x):\n    return x * 3\n")
+    critic = RecordingModel("True")
+
+    @generate_attribute(model=model, critic=critic, verdicts=VerdictCache(maxsize=8))
+    class Calculator:
+        pass
+
+    assert Calculator().triple(x=2) == 6
+    assert model.options == [CODE_GENERATION_OPTIONS]
+    assert critic.options == [CRITIC_OPTIONS]
+
+
+class ForwardingModel(AbstractGenerativeModel):
+    def __init__(self):
+        self.kwargs = []
+
+    def generate(self, prompt: str, **kwargs) -> str:
+        self.kwargs.append(kwargs)
+        return f"echo: {prompt}"
+
+
+def test_models_without_options_are_called_with_the_prompt_alone():
+    assert generate_with(PromptOnlyModel(), "hi", CRITIC_OPTIONS) == "echo: hi"
+
+    # Keyword arguments may be forwarded to a client, so `options` is not passed through them
+    forwarding = ForwardingModel()
+    assert generate_with(forwarding, "hi", CRITIC_OPTIONS) == "echo: hi"
+    assert forwarding.kwargs == [{}]
+
+    adapter = AsyncModelAdapter(PromptOnlyModel())
+    assert asyncio.run(adapter.agenerate("hi", CRITIC_OPTIONS)) == "echo: hi"
+
+    recording = RecordingModel("ok")
+    asyncio.run(AsyncModelAdapter(recording).agenerate("hi", CRITIC_OPTIONS))
+    assert recording.options == [CRITIC_OPTIONS]
+
+
+COMPLETION = [
+    "### BEGIN FUNCTION ###\n",
+    "def square(x):\n",
+    "    return x",
+    " * x\n",
+    "### END FUNCTION ###\n",
+]
+
+
+class StreamingModel(AbstractStreamingGenerativeModel):
+    def __init__(self):
+        self.chunks = 0
+        self.closed = False
+
+    def stream(self, prompt, options=None):
+        try:
+            for chunk in COMPLETION:
+                self.chunks += 1
+                yield chunk
+            while True:
+                self.chunks += 1
+                yield "Explanation that never ends. "
+        finally:
+            self.closed = True
+
+
+class AsyncStreamingModel(AbstractAsyncStreamingGenerativeModel):
+    def __init__(self):
+        self.chunks = 0
+        self.closed = False
+
+    async def astream(self, prompt, options=None):
+        try:
+            for chunk in COMPLETION + ["print(square(2))\n"] * 100:
+                self.chunks += 1
+                yield chunk
+        finally:
+            self.closed = True
+
+
+def test_adapt_stops_reading_streams_at_end_of_function():
+    model = StreamingModel()
+
+    @adapt(model=model, critic=RecordingModel("True"), verdicts=VerdictCache(8))
+    def square(x):
+        return x + x
+
+    assert square(5) == 25
+    assert model.chunks == len(COMPLETION)
+    assert model.closed
+
+
+def test_async_streams_stop_at_end_of_function():
+    model = AsyncStreamingModel()
+    code = asyncio.run(agenerate_code(model, "prompt", CODE_GENERATION_OPTIONS))
+    assert code.endswith("### END FUNCTION ###")
+    assert model.chunks == len(COMPLETION)
+    assert model.closed
+
+    model = StreamingModel()
+    code = asyncio.run(agenerate_code(AsyncModelAdapter(model), "prompt"))
+    assert "return x * x" in code
+    assert model.closed
+
+
+class FlakyStreamingModel(AbstractStreamingGenerativeModel):
+    def __init__(self, completions, delay=0.0):
+        self.completions = list(completions)
+        self.delay = delay
+        self.chunks = 0
+        self.closed = 0
+
+    def stream(self, prompt, options=None):
+        completion = self.completions.pop(0)
+        try:
+            for line in completion.splitlines(keepends=True):
+                time.sleep(self.delay)
+                self.chunks += 1
+                yield line
+        finally:
+            self.closed += 1
+
+
+def test_doomed_streams_are_aborted_and_retried():
+    doomed = "def double(x):\n    return (x]\n" + "    y = 1\n" * 50
+    good = (
+        "def double(x):\n    return x * 2\n"
+        + "    y = 1\n" * 48
+        + "### END FUNCTION ###\n"
+    )
+    model = FlakyStreamingModel([good, doomed, good], delay=0.001)
+    metrics = StreamMetrics()
+
+    assert "return x * 2" in generate_code(model, "prompt", metrics=metrics)
+    model.chunks = 0
+
+    code = generate_code(model, "prompt", metrics=metrics)
+
+    assert "return x * 2" in code
+    assert model.chunks == 2 + 51
+    assert model.closed == 3
+
+    stats = metrics.stats()
+    assert stats["completed"] == 2
+    assert stats["aborted"] == stats["retries"] == 1
+    assert stats["seconds_saved"] > 0
+
+
+def test_retries_are_bounded():
+    doomed = "def double(x):\n    return x)\n"
+    model = FlakyStreamingModel([doomed] * 3)
+    metrics = StreamMetrics()
+
+    assert generate_code(model, "prompt", retries=2, metrics=metrics) == (
+        "def double(x):\n    return x)\n"
+    )
+    assert metrics.stats()["aborted"] == 3
+    assert metrics.stats()["retries"] == 2
@@ -1,8 +1,17 @@
+import pickle
 import pytest
 import unittest.mock as mock
 from unittest.mock import MagicMock
 from .model import Claude
-from generative.prompt import format_semantic_checker
+from generative.prompt import (
+    GENERATIVE_FUNCTION_PREFIX,
+    PROMPT_VERSION,
+    format_generative_function,
+    format_generative_function_from_input,
+    format_semantic_checker,
+    format_stack_trace,
+    split_prompt,
+)
 from generative.utils import format_binary_output
 
 
@@ -98,3 +107,31 @@ def test_incorrect_io_with(mock_anthropic_check_false):
             output = format_binary_output(output)
 
             assert output == False
+
+
+def test_prompt_prefix_is_byte_identical_across_calls():
+    first = format_generative_function(
+        "def add(a, b):\n    pass\n", [("sub", "def sub(a, b):\n    return a - b\n")]
+    )
+    second = format_generative_function(
+        "    def mul(self, a, b):\n        return a ** b\n", (), minify=True
+    )
+
+    assert first.prefix.encode() == second.prefix.encode()
+    assert first.prefix == GENERATIVE_FUNCTION_PREFIX
+    assert first.version == second.version == f"generative_function/{PROMPT_VERSION}"
+    assert first.suffix != second.suffix
+    assert first == first.prefix + first.suffix
+    assert "def sub(a, b)" not in first.prefix
+    assert "Source code:" in first.suffix
+
+    for build in (
+        lambda text: format_stack_trace(text),
+        lambda text: format_semantic_checker(text),
+        lambda text: format_generative_function_from_input(text, {"x": text}),
+    ):
+        assert build("one").prefix.encode() == build("two\n    three").prefix.encode()
+        assert split_prompt(build("one")) == (build("one").prefix, build("one").suffix)
+
+    assert split_prompt("plain") == ("", "plain")
+    assert pickle.loads(pickle.dumps(first)).prefix == first.prefix
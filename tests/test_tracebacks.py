@@ -0,0 +1,200 @@
+import time
+
+import pytest
+
+from generative.functions import stack_trace
+from generative.metaclasses import AbstractGenerativeModel
+from generative.tracebacks import (
+    DeferredExplainer,
+    ExplanationCache,
+    TracebackCompactor,
+    trace_compactor,
+    trace_explanations,
+    traceback_fingerprint,
+)
+from generative.utils import count_tokens
+
+
+class CountingExplainer(AbstractGenerativeModel):
+    def __init__(self):
+        self.calls = 0
+
+    def generate(self, prompt: str) -> str:
+        self.calls += 1
+        return "Human-readable summary:\n(lookup) Index out of range"
+
+
+def lookup(items, index):
+    return items[index]
+
+
+def capture(fn, *args):
+    try:
+        fn(*args)
+    except Exception as e:
+        return e
+
+
+def test_fingerprint_ignores_messages_and_argument_values():
+    first = capture(lookup, [1, 2, 3], 5)
+    second = capture(lookup, [object()], 9)
+
+    assert traceback_fingerprint(first) == traceback_fingerprint(second)
+    assert traceback_fingerprint(first) != traceback_fingerprint(
+        capture(lookup, {}, "key")
+    )
+
+
+def test_stack_trace_explains_recurring_errors_once():
+    model = CountingExplainer()
+
+    @stack_trace(model=model, explanations=ExplanationCache(maxsize=8))
+    def fetch(index):
+        return lookup([1, 2, 3], index)
+
+    for index in range(5, 105):
+        with pytest.raises(Exception) as info:
+            fetch(index)
+
+        assert "Index out of range" in str(info.value)
+        assert "list index out of range" in str(info.value)
+
+    assert model.calls == 1
+
+
+class SlowExplainer(AbstractGenerativeModel):
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.calls = 0
+
+    def generate(self, prompt: str) -> str:
+        self.calls += 1
+        time.sleep(self.delay)
+        return "Human-readable summary:\n(fetch) Index out of range"
+
+
+def test_deferred_stack_trace_reraises_immediately():
+    model = SlowExplainer()
+    delivered = []
+    explainer = DeferredExplainer(
+        model,
+        explanations=ExplanationCache(maxsize=8),
+        callback=lambda key, trace, summary: delivered.append(summary),
+    )
+
+    @stack_trace(deferred=explainer)
+    def fetch(index):
+        return lookup([1, 2, 3], index)
+
+    start = time.perf_counter()
+    for index in range(5, 55):
+        with pytest.raises(IndexError):
+            fetch(index)
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < model.delay
+    assert explainer.flush(timeout=5)
+    assert delivered == ["Human-readable summary:\n(fetch) Index out of range"]
+    assert model.calls == 1
+    explainer.close()
+
+
+def test_deferred_explainer_drops_when_queue_is_full():
+    model = SlowExplainer(delay=0.1)
+    explainer = DeferredExplainer(
+        model,
+        explanations=ExplanationCache(maxsize=8),
+        callback=lambda key, trace, summary: None,
+        workers=1,
+        max_pending=1,
+        drop="oldest",
+    )
+
+    errors = [
+        capture(lookup, [], 0),
+        capture(lookup, {}, "key"),
+        capture(lambda: 1 / 0),
+        capture(lambda: int("x")),
+    ]
+    for error in errors:
+        explainer.submit(error)
+
+    explainer.close()
+
+    stats = explainer.stats()
+    assert stats["dropped"] >= 2
+    assert stats["explained"] == stats["submitted"] - stats["dropped"]
+    assert stats["pending"] == 0
+
+
+def test_deferred_explainer_defaults_to_process_wide_state():
+    explainer = DeferredExplainer(CountingExplainer())
+
+    assert explainer.explanations is trace_explanations
+    assert explainer.compactor is trace_compactor
+    explainer.close()
+
+
+class RecordingExplainer(AbstractGenerativeModel):
+    def __init__(self):
+        self.prompts = []
+
+    def generate(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        return "Human-readable summary:\n(fibonacci) Missing base case"
+
+
+def test_stack_trace_compacts_recursive_tracebacks():
+    model = RecordingExplainer()
+    compactor = TracebackCompactor(max_tokens=400)
+
+    def fibonacci(n):
+        if n < -200:
+            raise ValueError("n must not be negative")
+        return fibonacci_minus_one(n) + fibonacci(n - 2)
+
+    def fibonacci_minus_one(n):
+        return fibonacci(n - 1)
+
+    @stack_trace(
+        model=model, explanations=ExplanationCache(maxsize=8), compactor=compactor
+    )
+    def solve(n):
+        return fibonacci(n)
+
+    with pytest.raises(Exception) as info:
+        solve(10)
+
+    assert "Missing base case" in str(info.value)
+    assert len(model.prompts) == 1
+
+    prompt = model.prompts[0]
+    assert "in wrapper" not in prompt
+    assert "[Previous 2 frames repeated" in prompt
+    assert "ValueError: n must not be negative" in prompt
+
+    stats = compactor.stats()
+    assert stats["tokens_after"] <= 400
+    assert stats["tokens_before"] > 10 * stats["tokens_after"]
+
+
+def test_compactor_keeps_outer_and_inner_frames_within_budget():
+    def step(n):
+        if n == 0:
+            raise ValueError("x" * 5000)
+        if n % 2:
+            return step(n - 1)
+        return step(n - 1)
+
+    error = capture(step, 60)
+
+    # Alternating lines are not collapsed when only single repeated frames are detected
+    text = TracebackCompactor(
+        max_tokens=200, max_message_length=100, max_cycle=1
+    ).compact(error)
+
+    assert count_tokens(text) <= 200
+    assert "frames omitted" in text
+    assert text.startswith("Traceback (most recent call last):")
+    assert 'raise ValueError("x" * 5000)' in text
+    assert "characters truncated" in text
@@ -1,8 +1,35 @@
+import unittest.mock as mock
+
+import generative.utils as utils
 from generative.utils import (
+    FunctionStreamParser,
+    collect_function,
+    count_tokens,
+    find_irrecoverable_error,
+    is_valid_syntax,
+    minify_source,
     to_func_name,
     remove_self_param,
 )
 
+DECORATED = """
+    @adapt(model=GPT4(), critic=Claude())
+    def fibonacci(self, n):
+        \"\"\"Return the n-th Fibonacci number.
+
+        Uses recursion.
+        \"\"\"
+        # Base case
+        if n < 2:   # small inputs
+
+            return n
+
+        def cached(k):
+            \"\"\"Nested helpers lose their docstrings.\"\"\"
+            return fibonacci(k)
+        return cached(n - 1) + cached(n - 2)  # recurse
+"""
+
 
 def test_to_func_name():
     assert to_func_name("Hello World") == "hello_world"
@@ -25,3 +52,123 @@ def test_remove_self_param():
     # Test function with 'self' as part of another parameter name
     func_str = "def my_func(selfish, arg1, arg2):\n    pass\n"
     assert remove_self_param(func_str) == func_str
+
+
+def test_minify_source():
+    minified = minify_source(DECORATED)
+
+    assert minified == (
+        "def fibonacci(self, n):\n"
+        "    if n < 2:\n"
+        "        return n\n"
+        "    def cached(k):\n"
+        "        return fibonacci(k)\n"
+        "    return cached(n - 1) + cached(n - 2)\n"
+    )
+    assert count_tokens(minified) < count_tokens(DECORATED) / 2
+
+    kept = minify_source(DECORATED, keep_docstring=True)
+    assert (
+        '"""Return the n-th Fibonacci number.\n\n    Uses recursion.\n    """' in kept
+    )
+    assert "Nested helpers" not in kept
+
+
+def test_minify_source_without_valid_syntax():
+    broken = DECORATED.replace("return n\n", "return n +\n")
+
+    minified = minify_source(broken)
+
+    assert "@adapt" not in minified
+    assert "#" not in minified
+    assert "\n\n" not in minified.split('"""')[-1]
+    assert "        return n +\n" in minified
+
+
+def chunked(text, size=4):
+    for start in range(0, len(text), size):
+        yield text[start : start + size]
+
+
+def test_collect_function_stops_after_a_complete_definition():
+    completion = (
+        "### BEGIN FUNCTION ###\n"
+        "def pad(text,\n"
+        "        width):\n"
+        '    """Pad text.\n'
+        "Lines in strings at column 0 do not end the function.\n"
+        '"""\n'
+        "    widths = (width,\n"
+        "0)\n"
+        "\n"
+        "# A comment at column 0\n"
+        "    return text.ljust(\\\n"
+        "max(widths))\n"
+    )
+    trailer = "print(pad('a', 3))\nThis function pads text.\n"
+
+    assert collect_function(chunked(completion + trailer)) == completion
+    assert collect_function(["def one(): return 1\none()\n"]) == "def one(): return 1\n"
+    assert collect_function(
+        chunked("def f(x):\n    return x ### END FUNCTION ###\nmore")
+    ) == ("def f(x):\n    return x ### END FUNCTION ###")
+    assert collect_function(chunked("def f(x):\n    return x")) == (
+        "def f(x):\n    return x"
+    )
+
+
+def test_find_irrecoverable_error():
+    assert find_irrecoverable_error("def f(x):\n    return (x]\n") == (
+        "unmatched ']' on line 2"
+    )
+    assert "unindent" in find_irrecoverable_error(
+        "def f(x):\n        y = x\n    return y\n"
+    )
+    assert find_irrecoverable_error("def f(x):\n    return x $ 1\n") is not None
+
+    # Still open, so more text may complete it
+    assert find_irrecoverable_error("def f(x):\n    y = (1,\n") is None
+    assert find_irrecoverable_error('def f(x):\n    s = """doc\n') is None
+    assert find_irrecoverable_error("def f(x):\n    if x:\n        return 1\n") is None
+
+
+def test_minify_source_keeps_line_continuations():
+    code = "def f():\n    return 1  \\\n        +   2\n"
+
+    minified = minify_source(code)
+
+    assert minified == "def f():\n    return 1  \\\n        + 2\n"
+    assert is_valid_syntax(minified)
+
+
+def test_stream_parser_checks_each_logical_line_once():
+    cases = {
+        "def f(x):\n    return (x]\n": "unmatched ']' on line 2",
+        "def f(x):\n        y = x\n    return y\n": (
+            "unindent does not match any outer indentation level on line 3"
+        ),
+        "Sure:\ndef f(x):\n    if x:\n        y = [1,\n  2)\n": (
+            "unmatched ')' on line 4"
+        ),
+        "def f(x):\n    if x:\n        return 1\n    return 0\n": None,
+    }
+
+    for completion, error in cases.items():
+        parser = FunctionStreamParser(check_syntax=True)
+        for chunk in chunked(completion):
+            parser.feed(chunk)
+        assert parser.error == error
+
+    # Every line is tokenized once, not once per later line
+    lines = "".join(f"    y{n} = {n}\n" for n in range(50))
+    with mock.patch(
+        "generative.utils._find_token_error", wraps=utils._find_token_error
+    ) as find:
+        parser = FunctionStreamParser(check_syntax=True)
+        parser.feed("def f(x):\n" + lines)
+
+    assert parser.error is None
+    assert find.call_count == 51
+    assert "".join(call.args[0] for call in find.call_args_list) == (
+        "def f(x):\n" + lines.replace("    y", "y")
+    )